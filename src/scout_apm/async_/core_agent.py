@@ -0,0 +1,258 @@
+# coding=utf-8
+
+import asyncio
+import logging
+
+from scout_apm.core import json_backend
+from scout_apm.core.agent import socket as agent_socket
+from scout_apm.core.agent.circuit_breaker import Backoff, CircuitBreaker
+from scout_apm.core.agent.commands import Register
+from scout_apm.core.agent.manager import get_socket_path
+from scout_apm.core.agent.serializer import Serializer
+from scout_apm.core.config import scout_config
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncCoreAgentSocket(object):
+    """
+    Sends commands to the core agent from an event loop, for asyncio
+    integrations that opt in with the core_agent_asyncio_transport setting.
+
+    It speaks the same protocol as CoreAgentSocketThread, registering on
+    each connection, but commands are queued in an asyncio.Queue and
+    written by a task of the loop over an asyncio stream, so sending one
+    from a request's task takes no locks and wakes no other thread.
+    Whatever's queued when the task wakes up is written in one go, and
+    responses are read by another task rather than waited for.
+
+    Integrations set loop_socket (in scout_apm.core.agent.socket) to the
+    instance for their loop while handling each request, which makes
+    CoreAgentSocketThread.send() hand commands sent from there to it, and
+    should close it before the loop stops. If the loop's tasks are
+    cancelled first, as asyncio.run() does with those left when it returns,
+    whatever's queued is still written, as close() would.
+    """
+
+    # The instance is kept on its loop, so they're collected together.
+    LOOP_ATTRIBUTE = "_scout_apm_core_agent_socket"
+
+    @classmethod
+    def enabled(cls):
+        if not scout_config.value("core_agent_asyncio_transport"):
+            return False
+        socket_path = get_socket_path()
+        if socket_path.is_shm:
+            logger.warning(
+                "core_agent_asyncio_transport doesn't support the shm transport, "
+                "using the core agent socket thread."
+            )
+            return False
+        return True
+
+    @classmethod
+    def instance(cls):
+        """
+        Return the AsyncCoreAgentSocket for the running event loop, creating
+        it the first time.
+        """
+        loop = asyncio.get_running_loop()
+        instance = getattr(loop, cls.LOOP_ATTRIBUTE, None)
+        if instance is None:
+            instance = cls(loop)
+            setattr(loop, cls.LOOP_ATTRIBUTE, instance)
+        return instance
+
+    @classmethod
+    async def close_instance(cls, timeout=2.0):
+        """
+        Close the AsyncCoreAgentSocket for the running event loop, if it has
+        one.
+        """
+        instance = getattr(asyncio.get_running_loop(), cls.LOOP_ATTRIBUTE, None)
+        if instance is not None:
+            await instance.close(timeout)
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=scout_config.value("core_agent_queue_size"))
+        self.serializer = Serializer(
+            dumps=json_backend.get_dumps(scout_config.value("json_backend"))
+        )
+        self.socket_path = get_socket_path()
+        self.log_payload_content = scout_config.value("log_payload_content")
+        self.write_max_bytes = scout_config.value("core_agent_batch_max_bytes")
+        self.circuit = CircuitBreaker(
+            Backoff(agent_socket.RECONNECT_DELAY_MIN, agent_socket.RECONNECT_DELAY_MAX)
+        )
+        self.connected = False
+        self.task = None
+        self.closing = False
+        # Commands dropped since the queue was full, and responses read
+        self.dropped = 0
+        self.received = 0
+
+    def is_circuit_open(self):
+        """
+        Whether the core agent was unreachable the last time this tried it,
+        and it's not time to try again yet.
+        """
+        return self.circuit.is_open()
+
+    def send(self, command):
+        """
+        Queue a command. Must be called from the event loop's thread.
+        """
+        try:
+            self.queue.put_nowait(command)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.debug("AsyncCoreAgentSocket queue full, dropped: %r", command)
+            return
+        if self.task is None or self.task.done():
+            self.task = self.loop.create_task(self.run())
+
+    async def close(self, timeout=2.0):
+        """
+        Wait up to timeout seconds for queued commands to be written, then
+        stop.
+        """
+        if self.task is None:
+            return
+        self.closing = True
+        try:
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.debug(
+                    "AsyncCoreAgentSocket closing with %d commands queued.",
+                    self.queue.qsize(),
+                )
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        finally:
+            self.closing = False
+
+    async def run(self):
+        try:
+            await self._run()
+        except asyncio.CancelledError:
+            if not self.closing and not self.queue.empty():
+                # Cancelled by the loop shutting down rather than by close(),
+                # so write what's queued before it stops.
+                self.task = self.loop.create_task(self._run())
+                await self.close()
+            raise
+
+    async def _run(self):
+        while True:
+            try:
+                reader, writer = await self._connect()
+            except OSError as exc:
+                delay = self.circuit.record_failure(scale=agent_socket.SECOND)
+                logger.debug(
+                    "AsyncCoreAgentSocket connection error: %r, retrying in "
+                    + "%.2f seconds.",
+                    exc,
+                    delay,
+                    exc_info=exc,
+                )
+                await asyncio.sleep(delay)
+                continue
+
+            self.circuit.record_success()
+            responses = self.loop.create_task(self._read_responses(reader))
+            try:
+                await self._write_commands(writer, responses)
+            except (OSError, EOFError) as exc:
+                logger.debug(
+                    "AsyncCoreAgentSocket exception on send: %r", exc, exc_info=exc
+                )
+            finally:
+                self.connected = False
+                responses.cancel()
+                writer.close()
+
+    async def _connect(self):
+        logger.debug("AsyncCoreAgentSocket connecting to %s", self.socket_path)
+        if self.socket_path.is_tcp:
+            host, _, port = self.socket_path.tcp_address.partition(":")
+            reader, writer = await asyncio.open_connection(host, int(port))
+        else:
+            reader, writer = await asyncio.open_unix_connection(self.socket_path)
+        self.connected = True
+        return reader, writer
+
+    async def _write_commands(self, writer, responses):
+        buffer = bytearray()
+        self._add_frame(
+            buffer,
+            Register(
+                app=scout_config.value("name"),
+                key=scout_config.value("key"),
+                hostname=scout_config.value("hostname"),
+            ),
+        )
+        # Commands taken from the queue but not yet written
+        taken = 0
+        try:
+            while True:
+                if buffer:
+                    writer.write(buffer)
+                    # The transport may keep a view of what it couldn't send
+                    # yet, so start a new buffer rather than clearing it.
+                    buffer = bytearray()
+                    await writer.drain()
+                    for _ in range(taken):
+                        self.queue.task_done()
+                    taken = 0
+                    if responses.done():
+                        # The connection was closed or broke.
+                        responses.result()
+                        raise EOFError("Core agent closed the connection")
+
+                command = await self.queue.get()
+                taken = 1
+                self._add_frame(buffer, command)
+                # Write whatever else is waiting along with it.
+                while len(buffer) < self.write_max_bytes:
+                    try:
+                        command = self.queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        break
+                    taken += 1
+                    self._add_frame(buffer, command)
+        finally:
+            # They're lost, but mustn't hold up close().
+            for _ in range(taken):
+                self.queue.task_done()
+
+    def _add_frame(self, buffer, command):
+        if self.log_payload_content and agent_socket.is_request_batch(command):
+            logger.debug(
+                "Sending request: %s. Payload: %s",
+                command.request.request_id,
+                command.message(),
+            )
+        try:
+            frame = self.serializer.frame(command)
+        except (ValueError, TypeError) as exc:
+            logger.debug(
+                "Exception when serializing command message: %r", exc, exc_info=exc
+            )
+            return
+        buffer += frame
+        frame.release()
+
+    async def _read_responses(self, reader):
+        try:
+            while True:
+                raw_size = await reader.readexactly(4)
+                await reader.readexactly(int.from_bytes(raw_size, "big"))
+                self.received += 1
+        except asyncio.IncompleteReadError:
+            return
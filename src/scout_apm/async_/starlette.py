@@ -4,6 +4,8 @@ import wrapt
 from starlette.background import BackgroundTask
 
 import scout_apm.core
+from scout_apm.async_.core_agent import AsyncCoreAgentSocket
+from scout_apm.core.agent.socket import loop_socket
 from scout_apm.core.tracked_request import TrackedRequest
 from scout_apm.core.web_requests import asgi_track_request_data
 
@@ -13,10 +15,13 @@ class ScoutMiddleware:
         self.app = app
         installed = scout_apm.core.install()
         self._do_nothing = not installed
+        self._asyncio_transport = installed and AsyncCoreAgentSocket.enabled()
         if installed:
             install_background_instrumentation()
 
     async def __call__(self, scope, receive, send):
+        if self._asyncio_transport and scope["type"] == "lifespan":
+            return await self.app(scope, receive, self._lifespan_send(send))
         if self._do_nothing or scope["type"] != "http":
             return await self.app(scope, receive, send)
 
@@ -66,6 +71,8 @@ class ScoutMiddleware:
                 tracked_request.stop_span()
             return await send(data)
 
+        if self._asyncio_transport:
+            token = loop_socket.set(AsyncCoreAgentSocket.instance())
         try:
             await self.app(scope, receive, wrapped_send)
         except Exception as exc:
@@ -75,6 +82,20 @@ class ScoutMiddleware:
             if tracked_request.end_time is None:
                 grab_extra_data()
                 tracked_request.stop_span()
+            if self._asyncio_transport:
+                loop_socket.reset(token)
+
+    def _lifespan_send(self, send):
+        async def wrapped_send(message):
+            if message["type"] in (
+                "lifespan.shutdown.complete",
+                "lifespan.shutdown.failed",
+            ):
+                # Write the requests still queued before the server stops.
+                await AsyncCoreAgentSocket.close_instance()
+            return await send(message)
+
+        return wrapped_send
 
 
 background_instrumentation_installed = False
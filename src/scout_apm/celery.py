@@ -59,6 +59,7 @@ def task_prerun_callback(task=None, **kwargs):
     operation = "Job/" + task.name
     tracked_request.start_span(operation=operation)
     tracked_request.operation = operation
+    tracked_request.sample_head()
 
 
 def task_postrun_callback(task=None, **kwargs):
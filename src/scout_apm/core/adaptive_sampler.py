@@ -0,0 +1,98 @@
+# coding=utf-8
+
+import threading
+import time
+
+
+class RateEstimator(object):
+    """
+    Estimates how many requests arrive per second, counting them over
+    windows of WINDOW_SECONDS and smoothing across windows, and from that
+    the probability to sample them at to send target a second.
+
+    Counting an arrival takes no lock. Whichever thread first sees the
+    window is over recalculates, under a lock others don't wait for, and
+    the rest carry on with the previous probability. Arrivals counted while
+    it does so may be lost, which only nudges the estimate.
+    """
+
+    WINDOW_SECONDS = 1.0
+    # Weight of the latest window against the estimate so far
+    SMOOTHING = 0.5
+
+    __slots__ = ("target", "probability", "per_second", "_count", "_start", "_lock")
+
+    def __init__(self, target):
+        self.target = target
+        self.probability = 1.0
+        # Estimated arrivals per second, None until the first window is over
+        self.per_second = None
+        self._count = 0
+        self._start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def arrive(self):
+        """
+        Count an arrival, returning the probability to sample it at.
+        """
+        self._count += 1
+        now = time.monotonic()
+        if now - self._start >= self.WINDOW_SECONDS and self._lock.acquire(False):
+            try:
+                self._recalculate(now)
+            finally:
+                self._lock.release()
+        return self.probability
+
+    def _recalculate(self, now):
+        elapsed = now - self._start
+        if elapsed < self.WINDOW_SECONDS:
+            # Another thread just did.
+            return
+        observed = self._count / elapsed
+        self._count = 0
+        self._start = now
+        if self.per_second is None:
+            self.per_second = observed
+        else:
+            self.per_second += self.SMOOTHING * (observed - self.per_second)
+        if self.per_second <= self.target:
+            self.probability = 1.0
+        else:
+            self.probability = self.target / self.per_second
+
+
+class AdaptiveSampler(object):
+    """
+    Adjusts sample rates to send about target requests a second from the
+    process, or from each operation with per_operation, for the
+    sample_target_per_second and sample_target_per_operation settings.
+
+    Up to MAX_OPERATIONS operations get their own estimate, and any more
+    share one.
+    """
+
+    MAX_OPERATIONS = 1000
+
+    def __init__(self, target, per_operation=False):
+        self.target = target
+        self.per_operation = per_operation
+        self.estimator = RateEstimator(target)
+        # Operation -> RateEstimator
+        self.estimators = {}
+
+    def probability(self, operation):
+        """
+        Count a request for the operation, returning the probability to
+        sample it at.
+        """
+        if not self.per_operation:
+            return self.estimator.arrive()
+        estimator = self.estimators.get(operation)
+        if estimator is None:
+            if len(self.estimators) >= self.MAX_OPERATIONS:
+                return self.estimator.arrive()
+            estimator = self.estimators.setdefault(
+                operation, RateEstimator(self.target)
+            )
+        return estimator.arrive()
@@ -0,0 +1,87 @@
+# coding=utf-8
+
+import random
+import threading
+import time
+
+
+class Backoff(object):
+    """
+    Delays between attempts at something that keeps failing, doubling from
+    base up to maximum. Each delay is picked at random from the upper half
+    of that range, so processes that failed together don't retry in step.
+    """
+
+    __slots__ = ("base", "maximum", "attempts")
+
+    def __init__(self, base, maximum):
+        self.base = base
+        self.maximum = maximum
+        self.attempts = 0
+
+    def next_delay(self):
+        delay = min(self.maximum, self.base * 2**self.attempts)
+        self.attempts += 1
+        return random.uniform(delay / 2, delay)
+
+    def reset(self):
+        self.attempts = 0
+
+
+class CircuitBreaker(object):
+    """
+    Tracks whether the core agent is reachable, so callers can skip work
+    for it while it isn't.
+
+    The circuit is closed while connections succeed. A failure to connect
+    opens it for the next delay from backoff, during which is_open() is
+    true. After that it's half open: callers go ahead again, and the next
+    success closes it, or failure opens it for longer.
+
+    is_open() takes no lock, since it's checked for every request.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    __slots__ = ("backoff", "failures", "_open_until", "_lock")
+
+    def __init__(self, backoff):
+        self.backoff = backoff
+        # Consecutive failures
+        self.failures = 0
+        # time.monotonic() value until which the circuit is open, or 0.0
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if not self.failures:
+            return self.CLOSED
+        elif self.is_open():
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def is_open(self):
+        open_until = self._open_until
+        return bool(open_until) and time.monotonic() < open_until
+
+    def record_failure(self, scale=1):
+        """
+        Open the circuit, returning for how many seconds. Delays from
+        backoff are multiplied by scale.
+        """
+        with self._lock:
+            self.failures += 1
+            delay = self.backoff.next_delay() * scale
+            self._open_until = time.monotonic() + delay
+        return delay
+
+    def record_success(self):
+        if not self.failures:
+            return
+        with self._lock:
+            self.failures = 0
+            self.backoff.reset()
+            self._open_until = 0.0
@@ -4,7 +4,9 @@ import datetime as dt
 import logging
 import re
 
-from scout_apm.compat import iteritems
+from scout_apm.core import clock
+from scout_apm.core.backtrace import DeferredBacktrace
+from scout_apm.core.span_store import SpanStore
 
 logger = logging.getLogger(__name__)
 
@@ -184,10 +186,18 @@ class ApplicationEvent(object):
 
 
 class BatchCommand(object):
-    __slots__ = ("commands",)
+    __slots__ = ("_commands", "request")
 
-    def __init__(self, commands):
-        self.commands = commands
+    def __init__(self, commands=None, request=None):
+        self._commands = commands
+        # The RequestSnapshot this batch was built from, if any
+        self.request = request
+
+    @property
+    def commands(self):
+        if self._commands is None:
+            self._commands = self.request.commands()
+        return self._commands
 
     def message(self):
         return {
@@ -197,54 +207,153 @@ class BatchCommand(object):
         }
 
     @classmethod
-    def from_tracked_request(cls, request):
-        # The TrackedRequest must be finished
-        commands = []
-        commands.append(
-            StartRequest(timestamp=request.start_time, request_id=request.request_id)
+    def from_tracked_request(cls, request, start=True, finish=True):
+        """
+        Build the batch for a TrackedRequest, which must be finished unless
+        finish is False.
+
+        Requests flushed in several batches send StartRequest only in the
+        first one, and the request tags and FinishRequest only in the last.
+        """
+        return cls(
+            request=RequestSnapshot.from_tracked_request(
+                request, start=start, finish=finish
+            )
         )
-        for key, value in iteritems(request.tags):
+
+
+class RequestSnapshot(object):
+    """
+    The parts of a TrackedRequest that are sent to the core agent, handed
+    from the request thread to the socket thread.
+
+    Building one is cheap: it keeps references to the request's tags and
+    completed spans rather than copying them. That's safe because the
+    request never changes them once they're handed over. Flushed spans are
+    moved to a new container, and a finished request copies its tags and
+    spans before recording anything late. Timestamps are kept as monotonic nanoseconds,
+    along with the clock anchor needed to turn them into datetimes.
+    """
+
+    __slots__ = (
+        "request_id",
+        "clock_anchor",
+        "start_ns",
+        "end_ns",
+        "start",
+        "finish",
+        "tags",
+        "spans",
+    )
+
+    def __init__(
+        self, request_id, clock_anchor, start_ns, end_ns, start, finish, tags, spans
+    ):
+        self.request_id = request_id
+        self.clock_anchor = clock_anchor
+        self.start_ns = start_ns
+        self.end_ns = end_ns
+        self.start = start
+        self.finish = finish
+        # Mapping of request tags
+        self.tags = tags
+        # List of Span objects or a SpanStore
+        self.spans = spans
+
+    @classmethod
+    def from_tracked_request(cls, request, start=True, finish=True):
+        return cls(
+            request_id=request.request_id,
+            clock_anchor=request._clock_anchor,
+            start_ns=request._start_ns,
+            end_ns=request._end_ns,
+            start=start,
+            finish=finish,
+            tags=request.tags if finish else {},
+            spans=request.complete_spans,
+        )
+
+    def tag_items(self):
+        return tuple(self.tags.items())
+
+    def span_rows(self):
+        """
+        Yield (span_id, parent_id, operation, start_ns, end_ns, tag_items)
+        for each span.
+        """
+        spans = self.spans
+        if isinstance(spans, SpanStore):
+            return spans.rows()
+        # tuple() copies a dict's items without releasing the GIL, so a tag
+        # set on a finished span from another thread can't break iteration.
+        return (
+            (
+                span.span_id,
+                span.parent,
+                span.operation,
+                span._start_ns,
+                span._end_ns,
+                tuple(span.tags.items()),
+            )
+            for span in spans
+        )
+
+    def commands(self):
+        clock_anchor = self.clock_anchor
+        request_id = self.request_id
+        start_time = clock.ns_to_datetime(clock_anchor, self.start_ns)
+
+        commands = []
+        if self.start:
+            commands.append(StartRequest(timestamp=start_time, request_id=request_id))
+        for key, value in self.tag_items():
             commands.append(
                 TagRequest(
-                    timestamp=request.start_time,
-                    request_id=request.request_id,
+                    timestamp=start_time,
+                    request_id=request_id,
                     tag=key,
                     value=value,
                 )
             )
 
-        for span in request.complete_spans:
+        # Frames of deferred backtraces, shared by the request's spans
+        frames = {}
+        for span_id, parent, operation, start_ns, end_ns, tag_items in self.span_rows():
+            span_start_time = clock.ns_to_datetime(clock_anchor, start_ns)
             commands.append(
                 StartSpan(
-                    timestamp=span.start_time,
-                    request_id=span.request_id,
-                    span_id=span.span_id,
-                    parent=span.parent,
-                    operation=span.operation,
+                    timestamp=span_start_time,
+                    request_id=request_id,
+                    span_id=span_id,
+                    parent=parent,
+                    operation=operation,
                 )
             )
-
-            for key, value in iteritems(span.tags):
+            for key, value in tag_items:
+                if isinstance(value, DeferredBacktrace):
+                    value = value.resolve(frames)
                 commands.append(
                     TagSpan(
-                        timestamp=span.start_time,
-                        request_id=request.request_id,
-                        span_id=span.span_id,
+                        timestamp=span_start_time,
+                        request_id=request_id,
+                        span_id=span_id,
                         tag=key,
                         value=value,
                     )
                 )
-
             commands.append(
                 StopSpan(
-                    timestamp=span.end_time,
-                    request_id=span.request_id,
-                    span_id=span.span_id,
+                    timestamp=clock.ns_to_datetime(clock_anchor, end_ns),
+                    request_id=request_id,
+                    span_id=span_id,
                 )
             )
 
-        commands.append(
-            FinishRequest(timestamp=request.end_time, request_id=request.request_id)
-        )
-
-        return cls(commands)
+        if self.finish:
+            commands.append(
+                FinishRequest(
+                    timestamp=clock.ns_to_datetime(clock_anchor, self.end_ns),
+                    request_id=request_id,
+                )
+            )
+        return commands
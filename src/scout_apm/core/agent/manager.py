@@ -39,6 +39,13 @@ class CoreAgentManager(object):
             )
             return False
 
+        if get_socket_path().is_shm:
+            logger.debug(
+                "Not attempting to launch Core Agent for the shm transport, "
+                "whose consumer must be run separately."
+            )
+            return False
+
         if not self.verify():
             if not scout_config.value("core_agent_download"):
                 logger.debug(
@@ -316,6 +323,14 @@ class SocketPath(str):
     def tcp_address(self):
         return self[len("tcp://") :]
 
+    @property
+    def is_shm(self):
+        return self.startswith("shm://")
+
+    @property
+    def shm_path(self):
+        return self[len("shm://") :]
+
 
 def get_socket_path():
     # Old deprecated name "socket_path"
@@ -0,0 +1,247 @@
+# coding=utf-8
+
+import datetime as dt
+import struct
+import time
+from json.encoder import encode_basestring_ascii
+
+from scout_apm.core.agent.commands import BatchCommand
+from scout_apm.core.backtrace import LIMIT, DeferredBacktrace, resolve_frame
+from scout_apm.core.json_backend import stdlib_dumps
+
+_EPOCH = dt.datetime(1970, 1, 1, tzinfo=dt.timezone.utc)
+_ONE_MICROSECOND = dt.timedelta(microseconds=1)
+_HEADER = struct.Struct(">I")
+
+
+class Serializer(object):
+    """
+    Encodes commands into length prefixed frames for the core agent.
+
+    With the default dumps function, output is byte for byte what
+    json.dumps(command.message()) would give, but batches built from a
+    TrackedRequest are written straight from their RequestSnapshot into one
+    reusable buffer, with the length header reserved up front. Repeated
+    strings such as span IDs and operations are encoded once, and
+    timestamps are formatted from integer nanoseconds.
+    Other commands, and tag values that aren't strings, are encoded with
+    the dumps function, json_backend.stdlib_dumps() by default.
+    DeferredBacktrace tags are resolved here, each distinct frame encoded
+    once per request.
+
+    Not thread safe: each socket thread owns its own Serializer.
+    """
+
+    # Clear the caches past this many entries to bound memory use.
+    MAX_CACHE_SIZE = 10000
+
+    __slots__ = ("_dumps", "_buffer", "_batch_empty", "_strings", "_seconds")
+
+    def __init__(self, dumps=stdlib_dumps):
+        self._dumps = dumps
+        self._buffer = bytearray()
+        self._batch_empty = True
+        # str -> JSON encoded bytes
+        self._strings = {}
+        # Unix timestamp in whole seconds -> formatted date and time
+        self._seconds = {}
+
+    def frame(self, command):
+        """
+        Return a memoryview of the framed command. It's only valid until the
+        next call, and must be released before then.
+        """
+        if isinstance(command, BatchCommand) and command.request is not None:
+            self.start_batch()
+            self.add_request(command.request)
+            return self.end_batch()
+        buffer = self._buffer
+        del buffer[:]
+        buffer += b"\x00\x00\x00\x00"
+        buffer += self._dumps(command.message())
+        _HEADER.pack_into(buffer, 0, len(buffer) - _HEADER.size)
+        return memoryview(buffer)
+
+    def start_batch(self):
+        """
+        Start a frame holding one BatchCommand, which add_request() adds the
+        commands of any number of requests to, and end_batch() finishes.
+        """
+        buffer = self._buffer
+        del buffer[:]
+        buffer += b'\x00\x00\x00\x00{"BatchCommand": {"commands": ['
+        self._batch_empty = True
+
+    def add_request(self, snapshot):
+        """
+        Add the commands for a RequestSnapshot to the current batch. If they
+        can't be encoded, the batch is left as it was and the error raised.
+        """
+        mark = len(self._buffer)
+        try:
+            self._batch_empty = self._write_snapshot(snapshot, self._batch_empty)
+        except Exception:
+            del self._buffer[mark:]
+            raise
+
+    def end_batch(self):
+        """
+        Finish the current batch and return a memoryview of its frame, as
+        frame() does.
+        """
+        buffer = self._buffer
+        buffer += b"]}}"
+        _HEADER.pack_into(buffer, 0, len(buffer) - _HEADER.size)
+        return memoryview(buffer)
+
+    @property
+    def size(self):
+        """
+        The size of the frame written so far, in bytes.
+        """
+        return len(self._buffer)
+
+    def _string(self, value):
+        if not isinstance(value, str):
+            return self._value(value)
+        encoded = self._strings.get(value)
+        if encoded is None:
+            if len(self._strings) >= self.MAX_CACHE_SIZE:
+                self._strings.clear()
+            encoded = self._strings[value] = encode_basestring_ascii(value).encode(
+                "ascii"
+            )
+        return encoded
+
+    def _value(self, value):
+        if isinstance(value, str):
+            return encode_basestring_ascii(value).encode("ascii")
+        return self._dumps(value)
+
+    def _backtrace(self, deferred, frames):
+        """
+        Encode a DeferredBacktrace, with frames the request's table of
+        (code object, line number) -> encoded frame, or None for library code.
+        """
+        encoded = []
+        for key in deferred.frames:
+            try:
+                frame = frames[key]
+            except KeyError:
+                frame = resolve_frame(*key)
+                if frame is not None:
+                    frame = self._dumps(frame)
+                frames[key] = frame
+            if frame is not None:
+                encoded.append(frame)
+                if len(encoded) >= LIMIT:
+                    break
+        return b"[" + b", ".join(encoded) + b"]"
+
+    def _timestamp(self, epoch_us):
+        seconds, microseconds = divmod(epoch_us, 1000000)
+        prefix = self._seconds.get(seconds)
+        if prefix is None:
+            if len(self._seconds) >= self.MAX_CACHE_SIZE:
+                self._seconds.clear()
+            prefix = self._seconds[seconds] = time.strftime(
+                '"%Y-%m-%dT%H:%M:%S', time.gmtime(seconds)
+            ).encode("ascii")
+        if microseconds:
+            return prefix + b'.%06d+00:00"' % microseconds
+        # Matches datetime.isoformat(), which leaves out zero microseconds.
+        return prefix + b'+00:00"'
+
+    def _write_snapshot(self, snapshot, first):
+        """
+        Write the commands for snapshot, preceded by a separator unless
+        they're the first in the batch. Returns whether the batch is still
+        empty.
+        """
+        buffer = self._buffer
+        string = self._string
+        value = self._value
+        timestamp = self._timestamp
+
+        wall, anchor_ns = snapshot.clock_anchor
+        anchor_us = (wall - _EPOCH) // _ONE_MICROSECOND
+        request_id = string(snapshot.request_id)
+        request_start = timestamp(anchor_us + (snapshot.start_ns - anchor_ns) // 1000)
+        # Frames of deferred backtraces, shared by the request's spans
+        frames = {}
+
+        if snapshot.start:
+            if not first:
+                buffer += b", "
+            buffer += b'{"StartRequest": {"timestamp": '
+            buffer += request_start
+            buffer += b', "request_id": '
+            buffer += request_id
+            buffer += b"}}"
+            first = False
+
+        for key, tag_value in snapshot.tag_items():
+            if not first:
+                buffer += b", "
+            first = False
+            buffer += b'{"TagRequest": {"timestamp": '
+            buffer += request_start
+            buffer += b', "request_id": '
+            buffer += request_id
+            buffer += b', "tag": '
+            buffer += string(key)
+            buffer += b', "value": '
+            buffer += value(tag_value)
+            buffer += b"}}"
+
+        for row in snapshot.span_rows():
+            span_id, parent, operation, start_ns, end_ns, tag_items = row
+            span_id = string(span_id)
+            span_start = timestamp(anchor_us + (start_ns - anchor_ns) // 1000)
+            if not first:
+                buffer += b", "
+            first = False
+            buffer += b'{"StartSpan": {"timestamp": '
+            buffer += span_start
+            buffer += b', "request_id": '
+            buffer += request_id
+            buffer += b', "span_id": '
+            buffer += span_id
+            buffer += b', "parent_id": '
+            buffer += string(parent)
+            buffer += b', "operation": '
+            buffer += string(operation)
+            buffer += b"}}"
+            for key, tag_value in tag_items:
+                buffer += b', {"TagSpan": {"timestamp": '
+                buffer += span_start
+                buffer += b', "request_id": '
+                buffer += request_id
+                buffer += b', "span_id": '
+                buffer += span_id
+                buffer += b', "tag": '
+                buffer += string(key)
+                buffer += b', "value": '
+                if isinstance(tag_value, DeferredBacktrace):
+                    buffer += self._backtrace(tag_value, frames)
+                else:
+                    buffer += value(tag_value)
+                buffer += b"}}"
+            buffer += b', {"StopSpan": {"timestamp": '
+            buffer += timestamp(anchor_us + (end_ns - anchor_ns) // 1000)
+            buffer += b', "request_id": '
+            buffer += request_id
+            buffer += b', "span_id": '
+            buffer += span_id
+            buffer += b"}}"
+
+        if snapshot.finish:
+            if not first:
+                buffer += b", "
+            buffer += b'{"FinishRequest": {"timestamp": '
+            buffer += timestamp(anchor_us + (snapshot.end_ns - anchor_ns) // 1000)
+            buffer += b', "request_id": '
+            buffer += request_id
+            buffer += b"}}"
+            first = False
+        return first
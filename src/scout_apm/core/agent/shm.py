@@ -0,0 +1,380 @@
+# coding=utf-8
+"""
+A shared memory transport to the core agent, selected with a
+core_agent_socket_path like "shm:///dev/shm/scout_apm".
+
+Each process's socket thread writes its frames, exactly as it would to a
+socket, into its own ring buffer file in that directory, which a consumer
+on the same host drains. Writing a frame is a memory copy, with no system
+call unless the ring is full.
+
+ShmRelay is a stand-in consumer that forwards the frames to a core agent
+listening on a socket:
+
+    python -m scout_apm.core.agent.shm /dev/shm/scout_apm tcp://127.0.0.1:6590
+"""
+
+import argparse
+import errno
+import glob
+import logging
+import mmap
+import os
+import socket
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Header: magic, version, capacity and producer PID, then the positions
+# each side writes, on separate cache lines.
+_HEADER = struct.Struct(">4sIQQ")
+_MAGIC = b"SCRB"
+_VERSION = 1
+_POSITION = struct.Struct(">Q")
+_WRITE_OFFSET = 64
+_READ_OFFSET = 128
+_DATA_OFFSET = 192
+_LENGTH = struct.Struct(">I")
+# How the payload of a Register command's frame starts, with any JSON backend
+_REGISTER_PREFIX = b'{"Register"'
+
+# Time to sleep waiting for the other side of a ring
+POLL_SECONDS = 0.001
+
+
+def ring_path(directory, pid=None):
+    """
+    Return the path of the ring for a process. Each process, including each
+    forked worker, writes to its own ring, so every ring has one producer.
+    """
+    if pid is None:
+        pid = os.getpid()
+    return os.path.join(directory, "scout-apm-{}.ring".format(pid))
+
+
+class ShmRing(object):
+    """
+    A single producer, single consumer ring buffer of frames in a memory
+    mapped file.
+
+    The write and read positions count bytes written and read since the
+    ring was created, and only grow. The producer copies a frame in, then
+    stores the new write position, and the consumer copies frames out up to
+    it, then stores the new read position. Each side only ever stores its
+    own position, so neither needs a lock.
+    """
+
+    __slots__ = ("path", "capacity", "pid", "_file", "_map", "_write", "_read")
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "r+b")
+        self._map = None
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0)
+            magic, version, self.capacity, self.pid = _HEADER.unpack_from(self._map)
+            if magic != _MAGIC or version != _VERSION:
+                raise ValueError("Not a ring buffer: {}".format(path))
+            if len(self._map) != _DATA_OFFSET + self.capacity:
+                raise ValueError("Truncated ring buffer: {}".format(path))
+        except Exception:
+            if self._map is not None:
+                self._map.close()
+            self._file.close()
+            raise
+        self._write = _POSITION.unpack_from(self._map, _WRITE_OFFSET)[0]
+        self._read = _POSITION.unpack_from(self._map, _READ_OFFSET)[0]
+
+    @classmethod
+    def create(cls, path, capacity):
+        """
+        Open the ring at path for writing, creating it unless it already
+        exists with the given capacity, in which case frames still waiting
+        to be read are kept.
+        """
+        try:
+            ring = cls(path)
+        except (OSError, ValueError):
+            ring = None
+        if ring is not None:
+            if ring.capacity == capacity:
+                return ring
+            ring.close()
+        with open(path, "wb") as ring_file:
+            ring_file.write(_HEADER.pack(_MAGIC, _VERSION, capacity, os.getpid()))
+            ring_file.truncate(_DATA_OFFSET + capacity)
+        return cls(path)
+
+    def close(self):
+        if self._map is None:
+            return
+        self._map.close()
+        self._map = None
+        self._file.close()
+
+    def pending(self):
+        """
+        Return the number of bytes written but not yet read.
+        """
+        return (
+            _POSITION.unpack_from(self._map, _WRITE_OFFSET)[0]
+            - _POSITION.unpack_from(self._map, _READ_OFFSET)[0]
+        )
+
+    def write(self, frame, timeout=None):
+        """
+        Write a frame, waiting up to timeout seconds (or forever if it's
+        None) for the consumer to make room. Returns False if it didn't.
+        """
+        size = len(frame)
+        if size > self.capacity:
+            raise ValueError(
+                "Frame of {} bytes larger than ring of {}".format(size, self.capacity)
+            )
+        deadline = None
+        while (
+            self._write - _POSITION.unpack_from(self._map, _READ_OFFSET)[0]
+            > self.capacity - size
+        ):
+            if deadline is None:
+                deadline = (
+                    float("inf") if timeout is None else time.monotonic() + timeout
+                )
+            elif time.monotonic() >= deadline:
+                return False
+            time.sleep(POLL_SECONDS)
+
+        self._copy_in(self._write, frame)
+        self._write += size
+        _POSITION.pack_into(self._map, _WRITE_OFFSET, self._write)
+        return True
+
+    def read(self):
+        """
+        Return the next frame as bytes, or None if there isn't one.
+        """
+        available = _POSITION.unpack_from(self._map, _WRITE_OFFSET)[0] - self._read
+        if available < _LENGTH.size:
+            return None
+        size = _LENGTH.size + _LENGTH.unpack(self._copy_out(self._read, 4))[0]
+        if available < size:
+            return None
+        frame = self._copy_out(self._read, size)
+        self._read += size
+        _POSITION.pack_into(self._map, _READ_OFFSET, self._read)
+        return frame
+
+    def _copy_in(self, position, data):
+        start = position % self.capacity
+        first = min(len(data), self.capacity - start)
+        offset = _DATA_OFFSET + start
+        self._map[offset : offset + first] = data[:first]
+        if first < len(data):
+            self._map[_DATA_OFFSET : _DATA_OFFSET + len(data) - first] = data[first:]
+
+    def _copy_out(self, position, size):
+        start = position % self.capacity
+        first = min(size, self.capacity - start)
+        offset = _DATA_OFFSET + start
+        data = self._map[offset : offset + first]
+        if first < size:
+            data += self._map[_DATA_OFFSET : _DATA_OFFSET + size - first]
+        return data
+
+
+class ShmSocket(object):
+    """
+    Takes the place of a socket in CoreAgentSocketThread for the shm
+    transport, writing frames to this process's ring in the directory
+    connected to. Nothing is read back, since consumers don't respond.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.ring = None
+        self.timeout = None
+
+    def connect(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        try:
+            self.ring = ShmRing.create(ring_path(directory), self.capacity)
+        except ValueError as exc:
+            raise OSError(errno.EINVAL, str(exc))
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def sendall(self, data):
+        if self.ring is None:
+            raise OSError(errno.ENOTCONN, "Ring buffer not open")
+        try:
+            written = self.ring.write(data, self.timeout)
+        except ValueError as exc:
+            raise OSError(errno.EMSGSIZE, str(exc))
+        if not written:
+            raise socket.timeout("Ring buffer full")
+
+    def shutdown(self, how):
+        pass
+
+    def close(self):
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+
+def _pid_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class ShmRelay(object):
+    """
+    Stand-in consumer for the shm transport: drains the ring of each process
+    in directory, forwarding its frames to the core agent at socket_path
+    (a SocketPath) over a connection per ring, and reading the response to
+    each.
+
+    Each process registers once, when its socket thread connects, so the
+    Register frame read from each ring is kept and sent again first whenever
+    the relay has to reconnect to the core agent for that ring.
+
+    Rings are removed once drained after their process has exited.
+    """
+
+    def __init__(self, directory, socket_path):
+        self.directory = directory
+        self.socket_path = socket_path
+        self.forwarded = 0
+        # Ring path -> (ring, connection to the core agent)
+        self._rings = {}
+        # Ring path -> the last Register frame read from it
+        self._registers = {}
+
+    def drain(self):
+        """
+        Forward all the frames waiting in every ring. Returns how many.
+        """
+        forwarded = 0
+        for path in glob.glob(os.path.join(self.directory, "scout-apm-*.ring")):
+            if path not in self._rings:
+                try:
+                    self._rings[path] = (ShmRing(path), None)
+                except (OSError, ValueError) as exc:
+                    logger.debug("ShmRelay can't open %s: %r", path, exc)
+                    continue
+            forwarded += self._drain_ring(path)
+        self.forwarded += forwarded
+        return forwarded
+
+    def _drain_ring(self, path):
+        ring, connection = self._rings[path]
+        forwarded = 0
+        while True:
+            frame = ring.read()
+            if frame is None:
+                break
+            if frame[_LENGTH.size :].startswith(_REGISTER_PREFIX):
+                self._registers[path] = frame
+            try:
+                if connection is None:
+                    connection = self._connect()
+                    self._rings[path] = (ring, connection)
+                    register = self._registers.get(path)
+                    if register is not None and register is not frame:
+                        connection.sendall(register)
+                        self._read_response(connection)
+                connection.sendall(frame)
+                self._read_response(connection)
+            except OSError as exc:
+                logger.warning("ShmRelay dropped a frame from %s: %r", path, exc)
+                if connection is not None:
+                    connection.close()
+                    connection = None
+                    self._rings[path] = (ring, None)
+                continue
+            forwarded += 1
+        if not _pid_exists(ring.pid) and ring.read() is None:
+            self._remove(path)
+        return forwarded
+
+    def _connect(self):
+        if self.socket_path.is_tcp:
+            host, _, port = self.socket_path.tcp_address.partition(":")
+            return socket.create_connection((host, int(port)))
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(self.socket_path)
+        return connection
+
+    def _read_response(self, connection):
+        size = _LENGTH.unpack(self._recv(connection, _LENGTH.size))[0]
+        self._recv(connection, size)
+
+    def _recv(self, connection, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = connection.recv(size - len(data))
+            if not chunk:
+                raise OSError(errno.ECONNRESET, "Core agent closed the connection")
+            data += chunk
+        return data
+
+    def _remove(self, path):
+        ring, connection = self._rings.pop(path)
+        self._registers.pop(path, None)
+        ring.close()
+        if connection is not None:
+            connection.close()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def run(self, stop_event):
+        """
+        Drain the rings until stop_event is set, sleeping briefly whenever
+        there's nothing to forward.
+        """
+        while not stop_event.is_set():
+            if not self.drain():
+                stop_event.wait(POLL_SECONDS)
+
+    def close(self):
+        for ring, connection in self._rings.values():
+            ring.close()
+            if connection is not None:
+                connection.close()
+        self._rings.clear()
+        self._registers.clear()
+
+
+def main(argv=None):
+    from scout_apm.core.agent.manager import SocketPath
+
+    parser = argparse.ArgumentParser(
+        description="Forward frames from shm transport rings to the core agent."
+    )
+    parser.add_argument("directory", help="the directory of the rings")
+    parser.add_argument("socket_path", help="the core agent's socket path")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    relay = ShmRelay(args.directory, SocketPath(args.socket_path))
+    try:
+        relay.run(threading.Event())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        relay.close()
+        logger.info("Forwarded %d frames.", relay.forwarded)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
@@ -1,6 +1,6 @@
 # coding=utf-8
 
-import json
+import contextvars
 import logging
 import os
 import socket
@@ -9,21 +9,48 @@ import threading
 import time
 
 from scout_apm.compat import queue
-from scout_apm.core.agent.commands import Register
+from scout_apm.core import json_backend
+from scout_apm.core.agent.circuit_breaker import Backoff, CircuitBreaker
+from scout_apm.core.agent.commands import BatchCommand, Register
 from scout_apm.core.agent.manager import get_socket_path
+from scout_apm.core.agent.serializer import Serializer
+from scout_apm.core.agent.shm import ShmSocket
+from scout_apm.core.agent.spool import Spool
+from scout_apm.core.command_queue import CommandQueue
 from scout_apm.core.config import scout_config
 from scout_apm.core.threading import SingletonThread
 
 # Time unit - monkey-patched in tests to make them run faster
 SECOND = 1
+# Delays in seconds between attempts to reach the core agent after it's
+# been unreachable double from the first up to the last.
+RECONNECT_DELAY_MIN = 1
+RECONNECT_DELAY_MAX = 60
 
 logger = logging.getLogger(__name__)
 
+# The AsyncCoreAgentSocket for the event loop, set by asyncio integrations
+# that opt into it while they handle each request. Commands sent from there
+# go to it rather than this thread.
+loop_socket = contextvars.ContextVar("scout_apm_loop_socket", default=None)
+
+
+def estimate_size(command):
+    """
+    Roughly estimate the encoded size of a command in bytes, from counts of
+    what it contains, without encoding it.
+    """
+    if is_request_batch(command):
+        request = command.request
+        return 300 + 100 * len(request.tags) + 400 * len(request.spans)
+    return 300
+
 
 class CoreAgentSocketThread(SingletonThread):
     _instance_lock = threading.Lock()
     _stop_event = threading.Event()
-    _command_queue = queue.Queue(maxsize=500)
+    _command_queue = CommandQueue(maxsize=500, size_of=estimate_size)
+    _circuit = CircuitBreaker(Backoff(RECONNECT_DELAY_MIN, RECONNECT_DELAY_MAX))
 
     @classmethod
     def _on_stop(cls):
@@ -34,13 +61,52 @@ class CoreAgentSocketThread(SingletonThread):
         except queue.Full:
             pass
 
+    @classmethod
+    def _after_fork_in_child(cls):
+        super(CoreAgentSocketThread, cls)._after_fork_in_child()
+        cls._command_queue.reset_after_fork()
+        cls._circuit = CircuitBreaker(Backoff(RECONNECT_DELAY_MIN, RECONNECT_DELAY_MAX))
+
+    @classmethod
+    def is_circuit_open(cls):
+        """
+        Whether the core agent was unreachable the last time the thread tried
+        it, and it's not time to try again yet. Commands sent meanwhile are
+        dropped.
+
+        Where loop_socket is set, send() hands commands to it, so that's the
+        connection checked.
+        """
+        async_socket = loop_socket.get()
+        if async_socket is not None:
+            return async_socket.is_circuit_open()
+        return cls._circuit.is_open()
+
+    @classmethod
+    def pipeline_stats(cls):
+        """
+        Return the number of commands awaiting a response on the current
+        connection, and the times the pipeline window was full since the
+        last call, or None when not connected with a ResponseReader.
+        """
+        reader = getattr(cls._instance, "reader", None)
+        if reader is None:
+            return None
+        return reader.stats()
+
     @classmethod
     def send(cls, command):
-        try:
-            cls._command_queue.put(command, False)
-        except queue.Full as exc:
-            # TODO mark the command as not queued?
-            logger.debug("CoreAgentSocketThread error on send: %r", exc, exc_info=exc)
+        async_socket = loop_socket.get()
+        if async_socket is not None:
+            async_socket.send(command)
+            return
+
+        if cls._circuit.is_open():
+            # Rather than restarting the thread to fail to connect again.
+            return
+
+        if not cls._command_queue.offer(command):
+            logger.debug("CoreAgentSocketThread queue full, dropped: %r", command)
 
         cls.ensure_started()
 
@@ -65,27 +131,65 @@ class CoreAgentSocketThread(SingletonThread):
         return queue_empty
 
     def run(self):
+        self._command_queue.configure(
+            maxsize=scout_config.value("core_agent_queue_size"),
+            max_bytes=scout_config.value("core_agent_queue_bytes"),
+            overflow=scout_config.value("core_agent_queue_overflow"),
+        )
+        self.serializer = Serializer(
+            dumps=json_backend.get_dumps(scout_config.value("json_backend"))
+        )
+        self.log_payload_content = scout_config.value("log_payload_content")
+        self.pipeline_depth = scout_config.value("core_agent_pipeline_depth")
+        self.batch_max_requests = scout_config.value("core_agent_batch_max_requests")
+        self.batch_max_bytes = scout_config.value("core_agent_batch_max_bytes")
+        # A command taken from the queue while batching, to send next
+        self._next_command = None
+        self.reader = None
+        self.spool = None
+        spool_dir = scout_config.value("core_agent_spool_dir")
+        if spool_dir:
+            self.spool = Spool.open(
+                spool_dir,
+                capacity=scout_config.value("core_agent_spool_bytes"),
+                max_age=scout_config.value("core_agent_spool_max_age"),
+            )
+        self.connected = False
+        # Delays between attempts to reconnect while spooling
+        self._backoff = Backoff(RECONNECT_DELAY_MIN, RECONNECT_DELAY_MAX)
+        self._retry_at = 0.0
         self.socket_path = get_socket_path()
         self.socket = self.make_socket()
 
         try:
-            self._connect()
-            self._register()
+            # Try just once when the circuit is half open, since the core
+            # agent was unreachable last time.
+            self._reconnect(connect_attempts=1 if self._circuit.failures else 5)
             while True:
-                try:
-                    body = self._command_queue.get(block=True, timeout=1 * SECOND)
-                except queue.Empty:
-                    body = None
+                if not self.connected and time.monotonic() >= self._retry_at:
+                    self._disconnect()
+                    self._reconnect(connect_attempts=1)
+
+                if self._next_command is not None:
+                    body, self._next_command = self._next_command, None
+                else:
+                    try:
+                        body = self._command_queue.get(block=True, timeout=1 * SECOND)
+                    except queue.Empty:
+                        body = None
 
                 if body is not None:
-                    result = self._send(body)
+                    if self.batch_max_requests > 1 and is_request_batch(body):
+                        result, taken = self._send_requests(body)
+                    else:
+                        result, taken = self._send(body), 1
                     if result:
-                        self._command_queue.task_done()
+                        for _ in range(taken):
+                            self._command_queue.task_done()
                     else:
                         # Something was wrong with the socket.
                         self._disconnect()
-                        self._connect()
-                        self._register()
+                        self._reconnect()
 
                 # Check for stop event after each read. This allows opening,
                 # sending, and then immediately stopping. We do this for
@@ -96,21 +200,98 @@ class CoreAgentSocketThread(SingletonThread):
         except Exception as exc:
             logger.debug("CoreAgentSocketThread exception: %r", exc, exc_info=exc)
         finally:
+            self._stop_reader()
             self.socket.close()
+            if self.spool is not None:
+                if self.spool:
+                    logger.debug(
+                        "CoreAgentSocketThread dropping %d spooled commands.",
+                        len(self.spool),
+                    )
+                self.spool.close()
             logger.debug("CoreAgentSocketThread stopped.")
 
-    def _send(self, command):
-        msg = command.message()
+    def _log_payload(self, command):
+        if self.log_payload_content and is_request_batch(command):
+            logger.debug(
+                "Sending request: %s. Payload: %s",
+                command.request.request_id,
+                command.message(),
+            )
 
+    def _send(self, command, spool=True):
+        self._log_payload(command)
         try:
-            data = json.dumps(msg)
+            full_data = self.serializer.frame(command)
         except (ValueError, TypeError) as exc:
             logger.debug(
                 "Exception when serializing command message: %r", exc, exc_info=exc
             )
             return False
+        return self._send_frame(full_data, spool=spool)
+
+    def _send_requests(self, command):
+        """
+        Send the request batch command in one frame, together with any more
+        request batches waiting in the queue, up to batch_max_requests of
+        them or until the frame reaches batch_max_bytes.
+
+        Returns whether the frame was sent and the number of commands taken
+        from the queue.
+        """
+        serializer = self.serializer
+        serializer.start_batch()
+        taken = added = 0
+        while True:
+            taken += 1
+            self._log_payload(command)
+            try:
+                serializer.add_request(command.request)
+                added += 1
+            except (ValueError, TypeError) as exc:
+                # Leave it out of the batch rather than losing the others.
+                logger.debug(
+                    "Exception when serializing command message: %r", exc, exc_info=exc
+                )
+            if (
+                taken >= self.batch_max_requests
+                or serializer.size >= self.batch_max_bytes
+            ):
+                break
+            try:
+                command = self._command_queue.get_nowait()
+            except queue.Empty:
+                break
+            if not is_request_batch(command):
+                self._next_command = command
+                break
+
+        if not added:
+            return True, taken
+        return self._send_frame(serializer.end_batch()), taken
+
+    def _send_frame(self, full_data, spool=True):
+        """
+        Write a frame to the core agent, or to the spool while it's
+        unreachable. Returns False if something was wrong with the socket, in
+        which case the frame is spooled if there's a spool and spool is true.
+        """
+        if not self.connected:
+            # Only reachable with a spool.
+            self.spool.append(full_data)
+            full_data.release()
+            return True
+
+        if self.reader is not None and not self.reader.acquire(3 * SECOND):
+            if spool and self.spool is not None:
+                self.spool.append(full_data)
+            full_data.release()
+            logger.debug(
+                "CoreAgentSocketThread no responses for %d pipelined commands",
+                self.pipeline_depth,
+            )
+            return False
 
-        full_data = struct.pack(">I", len(data)) + data.encode("utf-8")
         try:
             self.socket.sendall(full_data)
         except OSError as exc:
@@ -124,10 +305,15 @@ class CoreAgentSocketThread(SingletonThread):
                 threading.current_thread(),
                 exc_info=exc,
             )
+            if spool and self.spool is not None:
+                self.spool.append(full_data)
             return False
+        finally:
+            full_data.release()
 
-        # TODO do something with the response sent back in reply to command
-        self._read_response()
+        if self.reader is None and not self.socket_path.is_shm:
+            # TODO do something with the response sent back in reply to command
+            self._read_response()
 
         return True
 
@@ -157,10 +343,65 @@ class CoreAgentSocketThread(SingletonThread):
                 app=scout_config.value("name"),
                 key=scout_config.value("key"),
                 hostname=scout_config.value("hostname"),
+            ),
+            # Each connection registers afresh, so never replay this.
+            spool=False,
+        )
+
+    def _reconnect(self, connect_attempts=5):
+        """
+        Connect and register, then replay any spooled commands.
+
+        If the core agent can't be reached without a spool, open the circuit
+        and raise, stopping the thread until the circuit is half open. With
+        one, commands are spooled until a later attempt, after a growing
+        delay, succeeds.
+        """
+        try:
+            self._connect(connect_attempts=connect_attempts)
+        except OSError:
+            if self.spool is None:
+                delay = self._circuit.record_failure(scale=SECOND)
+                logger.debug(
+                    "CoreAgentSocketThread dropping commands for %.2f seconds.", delay
+                )
+                raise
+            delay = self._backoff.next_delay() * SECOND
+            logger.debug(
+                "CoreAgentSocketThread spooling commands, reconnecting in "
+                + "%.2f seconds.",
+                delay,
             )
+            self.connected = False
+            self._retry_at = time.monotonic() + delay
+            return
+        self.connected = True
+        self._circuit.record_success()
+        self._backoff.reset()
+        self._register()
+        self._replay()
+
+    def _replay(self):
+        if not self.spool:
+            return
+        replayed, expired = self.spool.replayed, self.spool.expired
+        while True:
+            frame = self.spool.pop()
+            if frame is None:
+                break
+            if not self._send_frame(memoryview(frame)):
+                # It was spooled again, so reconnect and try later.
+                self.connected = False
+                self._retry_at = time.monotonic()
+                break
+        logger.debug(
+            "CoreAgentSocketThread replayed %d spooled commands, %d expired.",
+            self.spool.replayed - replayed,
+            self.spool.expired - expired,
         )
 
-    def _connect(self, connect_attempts=5, retry_wait_secs=1):
+    def _connect(self, connect_attempts=5):
+        backoff = Backoff(0.25, 2)
         for attempt in range(1, connect_attempts + 1):
             logger.debug(
                 (
@@ -176,6 +417,9 @@ class CoreAgentSocketThread(SingletonThread):
                 self.socket.connect(self.get_socket_address())
                 self.socket.settimeout(3 * SECOND)
                 logger.debug("CoreAgentSocketThread connected")
+                if self.pipeline_depth > 0 and not self.socket_path.is_shm:
+                    self.reader = ResponseReader(self.socket, self.pipeline_depth)
+                    self.reader.start()
                 return
             except socket.error as exc:
                 logger.debug(
@@ -184,10 +428,22 @@ class CoreAgentSocketThread(SingletonThread):
                 # Return without waiting when reaching the maximum number of attempts.
                 if attempt == connect_attempts:
                     raise
-                time.sleep(retry_wait_secs * SECOND)
+                time.sleep(backoff.next_delay() * SECOND)
+
+    def _stop_reader(self):
+        if self.reader is None:
+            return
+        # Shutting down makes the reader's recv() return immediately.
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.reader.join(3 * SECOND)
+        self.reader = None
 
     def _disconnect(self):
         logger.debug("CoreAgentSocketThread disconnecting from %s", self.socket_path)
+        self._stop_reader()
         try:
             self.socket.close()
         except socket.error as exc:
@@ -198,6 +454,8 @@ class CoreAgentSocketThread(SingletonThread):
             self.socket = self.make_socket()
 
     def make_socket(self):
+        if self.socket_path.is_shm:
+            return ShmSocket(capacity=scout_config.value("core_agent_shm_bytes"))
         if self.socket_path.is_tcp:
             family = socket.AF_INET
         else:
@@ -208,4 +466,95 @@ class CoreAgentSocketThread(SingletonThread):
         if self.socket_path.is_tcp:
             host, _, port = self.socket_path.tcp_address.partition(":")
             return host, int(port)
+        elif self.socket_path.is_shm:
+            return self.socket_path.shm_path
         return self.socket_path
+
+
+def is_request_batch(command):
+    return isinstance(command, BatchCommand) and command.request is not None
+
+
+class ResponseReader(threading.Thread):
+    """
+    Reads the core agent's responses to pipelined commands, so that the
+    socket thread can write commands back to back rather than waiting for
+    a response after each one.
+
+    Each command written takes a slot in a window of pipeline_depth slots,
+    which is freed when its response arrives. When the window is full the
+    socket thread waits, pushing back on the command queue rather than
+    letting unanswered commands pile up in the socket buffers.
+    """
+
+    def __init__(self, sock, pipeline_depth):
+        super(ResponseReader, self).__init__()
+        self.daemon = True
+        self.socket = sock
+        self._window = threading.Semaphore(pipeline_depth)
+        # Commands written and responses read on this connection
+        self.sent = 0
+        self.received = 0
+        # Times the window was full when writing a command, since stats()
+        self.full_waits = 0
+        self._lock = threading.Lock()
+
+    @property
+    def in_flight(self):
+        return self.sent - self.received
+
+    def acquire(self, timeout):
+        """
+        Take a slot for a command about to be written, waiting up to timeout
+        seconds for one to be freed. Returns False if none was.
+        """
+        if not self._window.acquire(blocking=False):
+            with self._lock:
+                self.full_waits += 1
+            if not self._window.acquire(timeout=timeout):
+                return False
+        self.sent += 1
+        return True
+
+    def stats(self):
+        """
+        Return the number of commands awaiting a response, and the times the
+        window was full since the last call.
+        """
+        with self._lock:
+            stats = {"in_flight": self.in_flight, "full_waits": self.full_waits}
+            self.full_waits = 0
+        return stats
+
+    def run(self):
+        try:
+            while self._read_response():
+                self.received += 1
+                self._window.release()
+        except OSError as exc:
+            logger.debug("ResponseReader error on read: %r", exc, exc_info=exc)
+        logger.debug(
+            "ResponseReader stopped with %d responses pending, window full %d times.",
+            self.in_flight,
+            self.full_waits,
+        )
+
+    def _recv(self, size):
+        data = bytearray()
+        while len(data) < size:
+            try:
+                chunk = self.socket.recv(size - len(data))
+            except socket.timeout:
+                # Nothing to read yet. The socket thread stops the reader by
+                # shutting the socket down, rather than relying on timeouts.
+                continue
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def _read_response(self):
+        raw_size = self._recv(4)
+        if raw_size is None:
+            return None
+        return self._recv(struct.unpack(">I", raw_size)[0])
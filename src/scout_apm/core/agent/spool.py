@@ -0,0 +1,200 @@
+# coding=utf-8
+
+import logging
+import mmap
+import os
+import struct
+import time
+
+logger = logging.getLogger(__name__)
+
+# File header: magic, version, head, tail, end and number of records, so the
+# file can be inspected while the process runs.
+_HEADER = struct.Struct(">4sIQQQQ")
+_MAGIC = b"SCSP"
+_VERSION = 1
+# Each record is the monotonic time it was spooled followed by the frame.
+# The frame's own 4 byte length header completes the record header.
+_RECORD = struct.Struct(">dI")
+_TIME = struct.Struct(">d")
+
+
+def spool_path(directory, pid=None):
+    """
+    Return the path of the spool file for a process. Each process, including
+    each forked worker, spools to its own file.
+    """
+    if pid is None:
+        pid = os.getpid()
+    return os.path.join(directory, "scout-apm-{}.spool".format(pid))
+
+
+class Spool(object):
+    """
+    A ring buffer of framed core agent commands, in a memory mapped file of
+    fixed size, for the socket thread to hold commands while the core agent
+    is unreachable and replay them once it's back.
+
+    Appending writes straight into the mapping, so holding a command costs a
+    memory copy rather than a system call. When there's no room for a new
+    frame, the oldest ones are dropped to make it, and frames older than
+    max_age seconds are dropped rather than replayed.
+
+    Records are kept in [head, tail) or, once writing has wrapped around to
+    the start of the file, in [head, end) followed by [0, tail).
+
+    The file belongs to the process that opened it, and is removed by
+    close(). Not thread safe: only the socket thread uses it.
+    """
+
+    __slots__ = (
+        "path",
+        "capacity",
+        "max_age",
+        "pid",
+        "spooled",
+        "replayed",
+        "dropped",
+        "expired",
+        "_file",
+        "_map",
+        "_head",
+        "_tail",
+        "_end",
+        "_count",
+        "_wrapped",
+    )
+
+    def __init__(self, path, capacity, max_age):
+        self.path = path
+        self.capacity = capacity
+        self.max_age = max_age
+        self.pid = os.getpid()
+        # Frames appended, popped for replay, dropped for room, and expired
+        self.spooled = 0
+        self.replayed = 0
+        self.dropped = 0
+        self.expired = 0
+        self._file = open(path, "w+b")
+        try:
+            self._file.truncate(_HEADER.size + capacity)
+            self._map = mmap.mmap(self._file.fileno(), _HEADER.size + capacity)
+        except Exception:
+            self._file.close()
+            raise
+        self._clear()
+
+    @classmethod
+    def open(cls, directory, capacity, max_age):
+        """
+        Open a spool for this process in directory, or return None if it
+        can't be created.
+        """
+        try:
+            os.makedirs(directory, exist_ok=True)
+            return cls(spool_path(directory), capacity, max_age)
+        except (OSError, ValueError) as exc:
+            logger.warning("Could not open core agent spool: %r", exc, exc_info=exc)
+            return None
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        if self._map is None:
+            return
+        self._map.close()
+        self._map = None
+        self._file.close()
+        if os.getpid() == self.pid:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def append(self, frame):
+        """
+        Append a framed command, dropping the oldest frames if there's no
+        room for it. Returns False if the frame could never fit.
+        """
+        if os.getpid() != self.pid:
+            # Inherited across a fork: the mapping belongs to the parent.
+            return False
+        size = _TIME.size + len(frame)
+        if size > self.capacity:
+            self.dropped += 1
+            return False
+
+        while True:
+            if self._count == 0:
+                self._clear()
+            if self._wrapped:
+                if self._tail + size <= self._head:
+                    break
+            elif self._tail + size <= self.capacity:
+                break
+            elif size <= self._head:
+                # Wrap around to the start of the file.
+                self._end = self._tail
+                self._tail = 0
+                self._wrapped = True
+                break
+            self._drop_oldest()
+            self.dropped += 1
+
+        offset = _HEADER.size + self._tail
+        _TIME.pack_into(self._map, offset, time.monotonic())
+        self._map[offset + _TIME.size : offset + size] = frame
+        self._tail += size
+        self._count += 1
+        self.spooled += 1
+        self._write_header()
+        return True
+
+    def pop(self):
+        """
+        Remove and return the oldest frame that hasn't expired, as bytes, or
+        None if there are none left.
+        """
+        oldest = time.monotonic() - self.max_age
+        while self._count:
+            offset, size, spooled_at = self._oldest()
+            self._drop_oldest()
+            if spooled_at < oldest:
+                self.expired += 1
+                continue
+            self.replayed += 1
+            return self._map[offset + _TIME.size : offset + size]
+        return None
+
+    def _oldest(self):
+        offset = _HEADER.size + self._head
+        spooled_at, length = _RECORD.unpack_from(self._map, offset)
+        return offset, _RECORD.size + length, spooled_at
+
+    def _drop_oldest(self):
+        _, size, _ = self._oldest()
+        self._head += size
+        self._count -= 1
+        if self._wrapped and self._head >= self._end:
+            self._head = 0
+            self._wrapped = False
+        self._write_header()
+
+    def _clear(self):
+        self._head = self._tail = self._end = 0
+        self._count = 0
+        self._wrapped = False
+        self._write_header()
+
+    def _write_header(self):
+        _HEADER.pack_into(
+            self._map,
+            0,
+            _MAGIC,
+            _VERSION,
+            self._head,
+            self._tail,
+            self._end,
+            self._count,
+        )
@@ -16,12 +16,19 @@ LIMIT = 50
 IGNORED = 1
 
 
+def _library_paths():
+    paths = sysconfig.get_paths()
+    return tuple({paths["purelib"], paths["platlib"]})
+
+
+# Prefixes of library code, for str.startswith()
+LIBRARY_PATHS = _library_paths()
+
+
 def filter_frames(frames):
     """Filter the stack trace frames down to non-library code."""
-    paths = sysconfig.get_paths()
-    library_paths = {paths["purelib"], paths["platlib"]}
     for frame in frames:
-        if not any(frame["file"].startswith(exclusion) for exclusion in library_paths):
+        if not frame["file"].startswith(LIBRARY_PATHS):
             yield frame
 
 
@@ -65,11 +72,32 @@ def filepaths(frame):
     return filepath, (module_filepath(module, filepath) if module else filepath)
 
 
+# Code object -> (is library code, full path, relative path), since working
+# out the paths takes string operations and module lookups, but they're the
+# same for every frame of the code. Cleared when full, in case code keeps
+# being compiled.
+_code_info = {}
+CODE_INFO_CACHE_SIZE = 10000
+
+
+def code_info(frame):
+    """Get whether frame is running library code, and its filepaths."""
+    code = frame.f_code
+    info = _code_info.get(code)
+    if info is None:
+        full_path, relative_path = filepaths(frame)
+        info = (full_path.startswith(LIBRARY_PATHS), full_path, relative_path)
+        if len(_code_info) >= CODE_INFO_CACHE_SIZE:
+            _code_info.clear()
+        _code_info[code] = info
+    return info
+
+
 def stacktrace_walker(tb):
     """Iterate over each frame of the stack downards for exceptions."""
     for frame, lineno in traceback.walk_tb(tb):
         name = frame.f_code.co_name
-        full_path, relative_path = filepaths(frame)
+        _, full_path, relative_path = code_info(frame)
         yield {
             "file": relative_path,
             "full_path": full_path,
@@ -97,11 +125,86 @@ def backtrace_walker():
         }
 
 
+def user_frame_walker(frame):
+    """Iterate over each non-library frame of the stack upwards from frame.
+
+    Library frames are skipped before any work is done for them.
+    """
+    while frame is not None:
+        is_library, full_path, relative_path = code_info(frame)
+        if not is_library:
+            yield {
+                "file": relative_path,
+                "full_path": full_path,
+                "line": frame.f_lineno,
+                "function": frame.f_code.co_name,
+            }
+        frame = frame.f_back
+
+
 def capture_backtrace():
-    walker = filter_frames(backtrace_walker())
+    walker = user_frame_walker(sys._getframe())
     return list(itertools.islice(walker, LIMIT))
 
 
+class DeferredBacktrace(object):
+    """
+    A span's backtrace recorded as (code object, line number) pairs, for
+    the deferred_backtraces setting, taking no string work on the request
+    thread. Library frames are filtered out, and the rest turned into the
+    frames of the span's stack tag, when the request is serialized.
+    """
+
+    __slots__ = ("frames",)
+
+    def __init__(self, frames):
+        self.frames = frames
+
+    def __repr__(self):
+        return "<DeferredBacktrace(frames={})>".format(len(self.frames))
+
+    def resolve(self, table=None):
+        """
+        Return the stack tag's frames. Pass the same table to resolve each
+        distinct frame only once across several backtraces.
+        """
+        if table is None:
+            table = {}
+        frames = []
+        for key in self.frames:
+            try:
+                frame = table[key]
+            except KeyError:
+                frame = table[key] = resolve_frame(*key)
+            if frame is not None:
+                frames.append(frame)
+                if len(frames) >= LIMIT:
+                    break
+        return frames
+
+
+def resolve_frame(code, lineno):
+    """
+    Return the stack tag frame for a line of code, or None for library code.
+    """
+    # The core-agent will trim the full_path as necessary.
+    full_path = code.co_filename
+    if full_path.endswith(".pyc"):
+        full_path = full_path[:-1]
+    if full_path.startswith(LIBRARY_PATHS):
+        return None
+    return {"file": full_path, "line": lineno, "function": code.co_name}
+
+
+def capture_deferred_backtrace():
+    frames = []
+    frame = sys._getframe()
+    while frame is not None:
+        frames.append((frame.f_code, frame.f_lineno))
+        frame = frame.f_back
+    return DeferredBacktrace(frames)
+
+
 def capture_stacktrace(tb):
     walker = stacktrace_walker(tb)
     return list(reversed(list(itertools.islice(walker, LIMIT))))
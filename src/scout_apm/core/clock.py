@@ -0,0 +1,30 @@
+# coding=utf-8
+
+import datetime as dt
+import time
+
+# Monotonic, high resolution clock used for all span timing. Readings are
+# integer nanoseconds and only meaningful relative to each other.
+now_ns = time.perf_counter_ns
+
+_ONE_MICROSECOND = dt.timedelta(microseconds=1)
+
+
+def anchor():
+    """
+    Capture a (wall clock datetime, monotonic nanoseconds) pair.
+
+    Timings are recorded as monotonic readings and only converted to
+    datetimes, relative to an anchor, when they need to be reported.
+    """
+    return dt.datetime.now(dt.timezone.utc), now_ns()
+
+
+def ns_to_datetime(clock_anchor, ns):
+    wall, anchor_ns = clock_anchor
+    return wall + dt.timedelta(microseconds=(ns - anchor_ns) // 1000)
+
+
+def datetime_to_ns(clock_anchor, value):
+    wall, anchor_ns = clock_anchor
+    return anchor_ns + ((value - wall) // _ONE_MICROSECOND) * 1000
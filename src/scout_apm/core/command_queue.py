@@ -0,0 +1,214 @@
+# coding=utf-8
+
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+from scout_apm.compat import queue
+
+logger = logging.getLogger(__name__)
+
+# What CommandQueue.offer() does when the queue is full:
+# Drop the item being added.
+DROP_NEWEST = "drop_newest"
+# Drop the oldest items to make room.
+DROP_OLDEST = "drop_oldest"
+# Keep a uniform random sample of the items offered since the queue filled.
+SAMPLE = "sample"
+
+OVERFLOW_POLICIES = (DROP_NEWEST, DROP_OLDEST, SAMPLE)
+
+
+class CommandQueue(object):
+    """
+    A queue bounded by number of items and by their estimated total size in
+    bytes, for the background threads that send data out. Many producer
+    threads hand items to one consumer thread.
+
+    Unlike queue.Queue it doesn't notify a condition variable on every put.
+    Items go in a deque under a plain lock held only for the bookkeeping, and
+    the consumer waits on an event that producers set only when it's found
+    the queue empty, so adding an item to a queue the consumer is already
+    draining takes no further synchronization.
+
+    offer() adds an item without blocking, and applies the overflow policy
+    when the queue is full. Items added, dropped, and marked done with
+    task_done() (so successfully sent) are counted for stats().
+    """
+
+    def __init__(self, maxsize=500, max_bytes=0, overflow=DROP_NEWEST, size_of=None):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.overflow = overflow
+        # Function estimating the size of an item in bytes
+        self.size_of = size_of
+        self._reset()
+
+    def _reset(self):
+        # (item, size) pairs
+        self.queue = deque()
+        self.bytes = 0
+        self.enqueued = 0
+        self.dropped = 0
+        self.sent = 0
+        # Items offered since the queue filled, for the SAMPLE policy
+        self._overflowed = 0
+        self._lock = threading.Lock()
+        # Set when items may be waiting. Only cleared by the consumer.
+        self._not_empty = threading.Event()
+
+    def reset_after_fork(self):
+        """
+        Empty the queue in a forked child, replacing its lock and event,
+        which another thread of the parent may have held at the fork. The
+        items are the parent's to send.
+        """
+        self._reset()
+
+    def configure(self, maxsize, max_bytes, overflow):
+        if overflow not in OVERFLOW_POLICIES:
+            logger.warning(
+                "Unknown queue overflow policy %r, using %r.", overflow, DROP_NEWEST
+            )
+            overflow = DROP_NEWEST
+        with self._lock:
+            self.maxsize = maxsize
+            self.max_bytes = max_bytes
+            self.overflow = overflow
+
+    def qsize(self):
+        return len(self.queue)
+
+    def empty(self):
+        return not self.queue
+
+    def _size_of(self, item):
+        if item is None or self.size_of is None:
+            return 0
+        return self.size_of(item)
+
+    def _is_full(self, size):
+        if not self.queue:
+            # Accept anything into an empty queue, so oversized items still
+            # get sent.
+            return False
+        return (self.maxsize > 0 and len(self.queue) >= self.maxsize) or (
+            self.max_bytes > 0 and self.bytes + size > self.max_bytes
+        )
+
+    def _drop(self, index):
+        _, size = self.queue[index]
+        del self.queue[index]
+        self.bytes -= size
+        self.dropped += 1
+
+    def _append(self, item, size):
+        # Called with the lock held.
+        self.queue.append((item, size))
+        self.bytes += size
+        self.enqueued += 1
+
+    def _wake(self):
+        # Checking first saves taking the event's own lock while the
+        # consumer is busy.
+        if not self._not_empty.is_set():
+            self._not_empty.set()
+
+    def put(self, item, block=True, timeout=None):
+        """
+        Add item to the queue, raising queue.Full if it's full. Never blocks:
+        block and timeout are accepted for compatibility with queue.Queue.
+        """
+        size = self._size_of(item)
+        with self._lock:
+            if self._is_full(size):
+                raise queue.Full
+            self._append(item, size)
+        self._wake()
+
+    def offer(self, item):
+        """
+        Add item to the queue without blocking, applying the overflow policy
+        if it's full. Returns whether the item was added.
+        """
+        size = self._size_of(item)
+        with self._lock:
+            if not self._is_full(size):
+                self._overflowed = 0
+            elif self.overflow == DROP_OLDEST:
+                while self._is_full(size):
+                    self._drop(0)
+            elif self.overflow == SAMPLE:
+                # Reservoir sampling: the nth item offered since the queue
+                # filled replaces a random item with probability k / (k + n).
+                self._overflowed += 1
+                capacity = len(self.queue)
+                if random.random() * (capacity + self._overflowed) >= capacity:
+                    self.dropped += 1
+                    return False
+                while self._is_full(size):
+                    self._drop(random.randrange(len(self.queue)))
+            else:
+                self.dropped += 1
+                return False
+            self._append(item, size)
+        self._wake()
+        return True
+
+    def get(self, block=True, timeout=None):
+        """
+        Remove and return the oldest item, waiting up to timeout seconds (or
+        forever if it's None) for one if block is true. Raises queue.Empty if
+        there's none.
+        """
+        deadline = None
+        while True:
+            with self._lock:
+                if self.queue:
+                    item, size = self.queue.popleft()
+                    self.bytes -= size
+                    return item
+                # Cleared with the lock held, so a producer appending after
+                # this sees it cleared and sets it again.
+                self._not_empty.clear()
+            if not block:
+                raise queue.Empty
+            if timeout is None:
+                self._not_empty.wait()
+                continue
+            if deadline is None:
+                deadline = time.monotonic() + timeout
+            remaining = deadline - time.monotonic()
+            if remaining <= 0.0 or not self._not_empty.wait(remaining):
+                # One last look, in case an item arrived right at the end.
+                if not self.queue:
+                    raise queue.Empty
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def task_done(self):
+        """
+        Count an item taken with get() as sent.
+        """
+        with self._lock:
+            self.sent += 1
+
+    def stats(self):
+        """
+        Return the number of items enqueued, dropped and sent since the last
+        call, along with the current number of items and their estimated
+        size in bytes.
+        """
+        with self._lock:
+            stats = {
+                "enqueued": self.enqueued,
+                "dropped": self.dropped,
+                "sent": self.sent,
+                "size": len(self.queue),
+                "bytes": self.bytes,
+            }
+            self.enqueued = self.dropped = self.sent = 0
+        return stats
@@ -22,6 +22,10 @@ class ScoutConfig(object):
     to answer affirmatively returns the value.
     """
 
+    # Incremented whenever values are set or unset, so that values read from
+    # the config can be cached until it changes.
+    version = 0
+
     def __init__(self):
         self.layers = [
             Env(),
@@ -60,9 +64,15 @@ class ScoutConfig(object):
             )
 
     known_keys = [
+        "aggregate_spans",
+        "aggregate_spans_keep",
         "app_server",
         "application_root",
         "collect_remote_ip",
+        "compact_span_storage",
+        "core_agent_asyncio_transport",
+        "core_agent_batch_max_bytes",
+        "core_agent_batch_max_requests",
         "core_agent_config_file",
         "core_agent_dir",
         "core_agent_download",
@@ -70,17 +80,29 @@ class ScoutConfig(object):
         "core_agent_log_file",
         "core_agent_log_level",
         "core_agent_permissions",
+        "core_agent_pipeline_depth",
+        "core_agent_queue_bytes",
+        "core_agent_queue_overflow",
+        "core_agent_queue_size",
+        "core_agent_shm_bytes",
         "core_agent_socket_path",
+        "core_agent_spool_bytes",
+        "core_agent_spool_dir",
+        "core_agent_spool_max_age",
         "core_agent_version",
+        "deferred_backtraces",
         "disabled_instruments",
         "download_url",
         "framework",
         "framework_version",
+        "head_sampling",
         "hostname",
         "ignore",  # Deprecated in favor of ignore_endpoints
         "ignore_endpoints",
         "ignore_jobs",
+        "json_backend",
         "key",
+        "latency_histograms",
         "log_level",
         "log_payload_content",
         "monitor",
@@ -90,10 +112,18 @@ class ScoutConfig(object):
         "endpoint_sample_rate",
         "sample_endpoints",
         "sample_jobs",
+        "sample_target_per_operation",
+        "sample_target_per_second",
         "job_sample_rate",
         "scm_subdirectory",
         "shutdown_message_enabled",
         "shutdown_timeout_seconds",
+        "span_flush_count",
+        "span_flush_seconds",
+        "tail_sampling",
+        "tail_sampling_budget",
+        "tail_sampling_percentile",
+        "tail_sampling_thresholds",
     ]
 
     secret_keys = {"key"}
@@ -115,6 +145,7 @@ class ScoutConfig(object):
         """
         for key, value in kwargs.items():
             SCOUT_PYTHON_VALUES[key] = value
+        ScoutConfig.version += 1
 
     @classmethod
     def unset(cls, *keys: str) -> None:
@@ -123,6 +154,7 @@ class ScoutConfig(object):
         """
         for key in keys:
             SCOUT_PYTHON_VALUES.pop(key, None)
+        ScoutConfig.version += 1
 
     @classmethod
     def reset_all(cls) -> None:
@@ -132,6 +164,7 @@ class ScoutConfig(object):
         This is meant for use in testing.
         """
         SCOUT_PYTHON_VALUES.clear()
+        ScoutConfig.version += 1
 
 
 # Module-level data, the ScoutConfig.set(key="value") adds to this
@@ -220,16 +253,31 @@ class Defaults(object):
 
     def __init__(self):
         self.defaults = {
+            "aggregate_spans": False,
+            "aggregate_spans_keep": 5,
             "app_server": "",
             "application_root": os.getcwd(),
             "collect_remote_ip": True,
+            "compact_span_storage": False,
+            "core_agent_asyncio_transport": False,
+            "core_agent_batch_max_bytes": 1024 * 1024,
+            "core_agent_batch_max_requests": 1,
             "core_agent_dir": "/tmp/scout_apm_core",
             "core_agent_download": True,
             "core_agent_launch": True,
             "core_agent_log_level": "info",
             "core_agent_permissions": 700,
+            "core_agent_pipeline_depth": 0,
+            "core_agent_queue_bytes": 0,
+            "core_agent_queue_overflow": "drop_newest",
+            "core_agent_queue_size": 500,
+            "core_agent_shm_bytes": 8 * 1024 * 1024,
             "core_agent_socket_path": "tcp://127.0.0.1:6590",
+            "core_agent_spool_bytes": 16 * 1024 * 1024,
+            "core_agent_spool_dir": None,
+            "core_agent_spool_max_age": 300.0,
             "core_agent_version": "v1.5.1",  # can be an exact tag name, or 'latest'
+            "deferred_backtraces": False,
             "disabled_instruments": [],
             "download_url": (
                 "https://s3-us-west-1.amazonaws.com/scout-public-downloads/"
@@ -239,13 +287,19 @@ class Defaults(object):
             "errors_enabled": True,
             "errors_ignored_exceptions": (),
             "errors_host": "https://errors.scoutapm.com",
+            "errors_queue_bytes": 0,
+            "errors_queue_overflow": "drop_newest",
+            "errors_queue_size": 500,
             "framework": "",
             "framework_version": "",
+            "head_sampling": False,
             "hostname": None,
             "ignore": [],
             "ignore_endpoints": [],
             "ignore_jobs": [],
+            "json_backend": "auto",
             "key": "",
+            "latency_histograms": False,
             "log_payload_content": False,
             "monitor": False,
             "name": "Python App",
@@ -254,10 +308,18 @@ class Defaults(object):
             "sample_endpoints": [],
             "endpoint_sample_rate": None,
             "sample_jobs": [],
+            "sample_target_per_operation": False,
+            "sample_target_per_second": 0.0,
             "job_sample_rate": None,
             "scm_subdirectory": "",
             "shutdown_message_enabled": True,
             "shutdown_timeout_seconds": 2.0,
+            "span_flush_count": 0,
+            "span_flush_seconds": 0.0,
+            "tail_sampling": False,
+            "tail_sampling_budget": 10,
+            "tail_sampling_percentile": 0.0,
+            "tail_sampling_thresholds": {},
             "uri_reporting": "filtered_params",
         }
 
@@ -307,6 +369,13 @@ def convert_to_float(value: Any) -> float:
         return 0.0
 
 
+def convert_to_int(value: Any) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
 def _coerce_rate_to_float(value: Any, context: str = "") -> float:
     """
     Helper to convert a rate value to float between 0 and 1.
@@ -414,22 +483,72 @@ def convert_endpoint_sampling(value: Union[str, Dict[str, Any]]) -> Dict[str, fl
     return {}
 
 
+def convert_latency_thresholds(value: Union[str, Dict[str, Any]]) -> Dict[str, float]:
+    """
+    Converts latency thresholds in seconds per endpoint or job from string or
+    dict format to a normalized dict.
+    Example: '/users:0.5,reports:2' -> {'users': 0.5, 'reports': 2.0}
+    """
+    if isinstance(value, str):
+        pairs = [pair.strip() for pair in value.split(",") if pair.strip()]
+        items = []
+        for pair in pairs:
+            name, _, seconds = pair.rpartition(":")
+            items.append((name, seconds))
+    elif isinstance(value, dict):
+        items = value.items()
+    else:
+        return {}
+    result = {}
+    for name, seconds in items:
+        try:
+            result[_strip_leading_slash(name)] = float(seconds)
+        except (TypeError, ValueError):
+            logger.warning(f"Invalid latency threshold for {name}: {seconds}")
+    return result
+
+
 CONVERSIONS = {
+    "aggregate_spans": convert_to_bool,
+    "aggregate_spans_keep": convert_to_int,
     "collect_remote_ip": convert_to_bool,
+    "compact_span_storage": convert_to_bool,
+    "core_agent_asyncio_transport": convert_to_bool,
+    "core_agent_batch_max_bytes": convert_to_int,
+    "core_agent_batch_max_requests": convert_to_int,
     "core_agent_download": convert_to_bool,
     "core_agent_launch": convert_to_bool,
+    "core_agent_pipeline_depth": convert_to_int,
+    "core_agent_queue_bytes": convert_to_int,
+    "core_agent_queue_size": convert_to_int,
+    "core_agent_shm_bytes": convert_to_int,
+    "core_agent_spool_bytes": convert_to_int,
+    "core_agent_spool_max_age": convert_to_float,
+    "deferred_backtraces": convert_to_bool,
     "disabled_instruments": convert_to_list,
+    "errors_queue_bytes": convert_to_int,
+    "errors_queue_size": convert_to_int,
+    "head_sampling": convert_to_bool,
     "ignore": convert_ignore_paths,
     "ignore_endpoints": convert_ignore_paths,
     "ignore_jobs": convert_ignore_paths,
+    "latency_histograms": convert_to_bool,
     "monitor": convert_to_bool,
     "sample_rate": convert_sample_rate,
     "sample_endpoints": convert_endpoint_sampling,
     "endpoint_sample_rate": convert_sample_rate,
     "sample_jobs": convert_endpoint_sampling,
+    "sample_target_per_operation": convert_to_bool,
+    "sample_target_per_second": convert_to_float,
     "job_sample_rate": convert_sample_rate,
     "shutdown_message_enabled": convert_to_bool,
     "shutdown_timeout_seconds": convert_to_float,
+    "span_flush_count": convert_to_int,
+    "span_flush_seconds": convert_to_float,
+    "tail_sampling": convert_to_bool,
+    "tail_sampling_budget": convert_to_int,
+    "tail_sampling_percentile": convert_to_float,
+    "tail_sampling_thresholds": convert_latency_thresholds,
 }
 
 
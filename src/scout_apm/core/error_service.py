@@ -1,6 +1,5 @@
 # coding=utf-8
 
-import json
 import logging
 import os
 import threading
@@ -14,6 +13,8 @@ from scout_apm.compat import (
     urljoin,
     urllib3_cert_pool_manager,
 )
+from scout_apm.core import json_backend
+from scout_apm.core.command_queue import CommandQueue
 from scout_apm.core.config import scout_config
 from scout_apm.core.threading import SingletonThread
 
@@ -23,10 +24,18 @@ SECOND = 1
 logger = logging.getLogger(__name__)
 
 
+def estimate_size(error):
+    """
+    Roughly estimate the encoded size of an error in bytes, from the length
+    of its trace, without encoding it.
+    """
+    return 1000 + 100 * len(error.get("trace") or ())
+
+
 class ErrorServiceThread(SingletonThread):
     _instance_lock = threading.Lock()
     _stop_event = threading.Event()
-    _queue = queue.Queue(maxsize=500)
+    _queue = CommandQueue(maxsize=500, size_of=estimate_size)
 
     @classmethod
     def _on_stop(cls):
@@ -38,12 +47,15 @@ class ErrorServiceThread(SingletonThread):
             logger.debug("ErrorServiceThread full for stop: %r", exc, exc_info=exc)
             pass
 
+    @classmethod
+    def _after_fork_in_child(cls):
+        super(ErrorServiceThread, cls)._after_fork_in_child()
+        cls._queue.reset_after_fork()
+
     @classmethod
     def send(cls, error):
-        try:
-            cls._queue.put(error, False)
-        except queue.Full as exc:
-            logger.debug("ErrorServiceThread full for send: %r", exc, exc_info=exc)
+        if not cls._queue.offer(error):
+            logger.debug("ErrorServiceThread queue full, dropped an error.")
 
         cls.ensure_started()
 
@@ -68,7 +80,13 @@ class ErrorServiceThread(SingletonThread):
         return queue_empty
 
     def run(self):
+        self._queue.configure(
+            maxsize=scout_config.value("errors_queue_size"),
+            max_bytes=scout_config.value("errors_queue_bytes"),
+            overflow=scout_config.value("errors_queue_overflow"),
+        )
         batch_size = scout_config.value("errors_batch_size") or 1
+        self.dumps = json_backend.get_dumps(scout_config.value("json_backend"))
         http = urllib3_cert_pool_manager()
         try:
             while True:
@@ -99,14 +117,14 @@ class ErrorServiceThread(SingletonThread):
 
     def _send(self, http, errors):
         try:
-            data = json.dumps(
+            data = self.dumps(
                 {
                     "notifier": "scout_apm_python",
                     "environment": scout_config.value("environment"),
                     "root": scout_config.value("application_root"),
                     "problems": errors,
                 }
-            ).encode("utf-8")
+            )
         except (ValueError, TypeError) as exc:
             logger.debug(
                 "Exception when serializing error message: %r", exc, exc_info=exc
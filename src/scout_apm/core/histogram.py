@@ -0,0 +1,77 @@
+# coding=utf-8
+
+# Each power of two range of values is split into 2 ** (SUB_BUCKET_BITS - 1)
+# buckets, so a bucket's width is under 1 / 16th (about 6%) of its values.
+# Values below 2 ** SUB_BUCKET_BITS get a bucket each.
+SUB_BUCKET_BITS = 5
+_SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+_HALF_SUB_BUCKETS = _SUB_BUCKETS >> 1
+
+
+def bucket_index(value):
+    """
+    Return the index of the bucket for a non-negative integer value.
+    """
+    if value < _SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return shift * _HALF_SUB_BUCKETS + (value >> shift)
+
+
+def bucket_lower_bound(index):
+    """
+    Return the lowest value that falls in a bucket.
+    """
+    if index < _SUB_BUCKETS:
+        return index
+    shift = (index >> (SUB_BUCKET_BITS - 1)) - 1
+    return (index - shift * _HALF_SUB_BUCKETS) << shift
+
+
+class Histogram(object):
+    """
+    A log-linear histogram of non-negative integers, like HdrHistogram: exact
+    counts in buckets of bounded relative width, stored sparsely, so it takes
+    a few hundred bytes for typical latencies whatever their number.
+
+    Not thread safe.
+    """
+
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        # Bucket index -> count
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value):
+        index = bucket_index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percentile):
+        """
+        Return the lower bound of the bucket holding the given percentile of
+        the values, or 0 if there are none.
+        """
+        rank = self.count * percentile / 100.0
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return bucket_lower_bound(index)
+        return 0
+
+    def buckets(self):
+        """
+        Return a list of [lower bound, count] pairs for the non-empty buckets.
+        """
+        return [
+            [bucket_lower_bound(index), self.counts[index]]
+            for index in sorted(self.counts)
+        ]
@@ -0,0 +1,41 @@
+# coding=utf-8
+
+import itertools
+import os
+from uuid import uuid4
+
+# IDs keep the UUID4 text format the core agent expects, but instead of
+# calling uuid4() for every request and span, each process picks a random
+# prefix once and fills the last 12 hex digits from a counter.
+_COUNTER_MASK = (1 << 48) - 1
+
+_prefix = ""
+_counter = itertools.count()
+
+
+def _reseed():
+    global _prefix, _counter
+    random_hex = uuid4().hex
+    _prefix = "{}-{}-{}-{}-".format(
+        random_hex[:8], random_hex[8:12], random_hex[12:16], random_hex[16:20]
+    )
+    _counter = itertools.count()
+
+
+def _next_suffix():
+    # next() on itertools.count is atomic under the GIL, so no lock is needed.
+    return "%012x" % (next(_counter) & _COUNTER_MASK)
+
+
+def new_request_id():
+    return "req-" + _prefix + _next_suffix()
+
+
+def new_span_id():
+    return "span-" + _prefix + _next_suffix()
+
+
+_reseed()
+# A forked child must not hand out the same IDs as its parent.
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reseed)
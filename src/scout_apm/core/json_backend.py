@@ -0,0 +1,135 @@
+# coding=utf-8
+
+import json
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+# Third party encoders tried in this order when json_backend is "auto".
+AUTO_BACKENDS = ("orjson", "ujson")
+
+# Exact types that every backend encodes as json.dumps() does. Subclasses,
+# such as enums, are left to json.dumps().
+_SCALARS = frozenset([str, int, bool, type(None)])
+
+
+def _is_plain(obj):
+    """
+    Return whether obj holds only str keyed dicts, lists and tuples of
+    strings, integers, finite floats, booleans and None. Third party
+    encoders give anything else a different value than json.dumps() does,
+    or encode what it rejects: orjson and msgspec write NaN and infinity as
+    null, ujson encodes Decimals, and msgspec and orjson encode datetimes,
+    bytes or UUIDs.
+    """
+    kind = type(obj)
+    if kind in _SCALARS:
+        return True
+    if kind is float:
+        return math.isfinite(obj)
+    if kind is dict:
+        for key, value in obj.items():
+            if type(key) is not str or not _is_plain(value):
+                return False
+        return True
+    if kind is list or kind is tuple:
+        for item in obj:
+            if not _is_plain(item):
+                return False
+        return True
+    return False
+
+
+def stdlib_dumps(obj):
+    return json.dumps(obj).encode("utf-8")
+
+
+def _checked(encode, errors):
+    """
+    Wrap a third party encode function to hand anything but plain data, or
+    that it fails on, such as integers over 64 bits, to json.dumps().
+    """
+
+    def dumps(obj):
+        try:
+            plain = _is_plain(obj)
+        except RecursionError:
+            # Deeply nested or circular, which json.dumps() reports.
+            plain = False
+        if not plain:
+            return stdlib_dumps(obj)
+        try:
+            return encode(obj)
+        except errors:
+            return stdlib_dumps(obj)
+
+    return dumps
+
+
+def _orjson_dumps():
+    import orjson
+
+    return _checked(orjson.dumps, (TypeError,))
+
+
+def _msgspec_dumps():
+    import msgspec
+
+    return _checked(
+        msgspec.json.Encoder().encode,
+        (TypeError, ValueError, OverflowError, msgspec.EncodeError),
+    )
+
+
+def _ujson_dumps():
+    import ujson
+
+    ujson_dumps = ujson.dumps
+
+    def encode(obj):
+        return ujson_dumps(obj, escape_forward_slashes=False).encode("utf-8")
+
+    return _checked(encode, (TypeError, ValueError, OverflowError))
+
+
+BACKENDS = {
+    "json": lambda: stdlib_dumps,
+    "msgspec": _msgspec_dumps,
+    "orjson": _orjson_dumps,
+    "ujson": _ujson_dumps,
+}
+
+
+def get_dumps(name="auto"):
+    """
+    Return a function that encodes an object to JSON bytes with the named
+    backend: "auto", "json", "orjson", "msgspec" or "ujson".
+
+    "auto" picks the first installed third party encoder, falling back to
+    the standard library. Whichever backend is used, the output decodes to
+    the same value as json.dumps() gives: third party encoders are only
+    handed plain data (see _is_plain()), and anything else, or anything
+    they refuse, such as integers over 64 bits, is encoded by json.dumps().
+    So non-finite floats are written as NaN and Infinity, and objects
+    json.dumps() can't encode (datetimes, bytes, Decimals, arbitrary
+    classes) raise TypeError, with every backend.
+    """
+    name = (name or "auto").lower()
+    if name == "auto":
+        candidates = AUTO_BACKENDS
+    elif name in BACKENDS:
+        candidates = (name,)
+    else:
+        logger.warning("Unknown json_backend %r, using json.", name)
+        candidates = ()
+
+    for candidate in candidates:
+        try:
+            return BACKENDS[candidate]()
+        except ImportError:
+            if name != "auto":
+                logger.warning(
+                    "json_backend %r is not installed, using json.", candidate
+                )
+    return stdlib_dumps
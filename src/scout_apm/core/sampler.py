@@ -1,7 +1,55 @@
 # coding=utf-8
 
 import random
-from typing import Dict, Optional, Tuple
+from functools import lru_cache
+from typing import Iterable, Optional, Tuple
+
+from scout_apm.core.adaptive_sampler import AdaptiveSampler
+
+# Number of operations whose sample rates Sampler remembers
+RATE_CACHE_SIZE = 1024
+
+
+class PrefixTrie:
+    """
+    Maps string prefixes to values, finding the value of the longest prefix
+    of a name in time proportional to the name's length, however many
+    prefixes there are.
+    """
+
+    __slots__ = ("children", "value", "has_value")
+
+    def __init__(self, items: Iterable[Tuple[str, object]] = ()):
+        self.children = {}
+        self.value = None
+        self.has_value = False
+        for prefix, value in items:
+            self.add(prefix, value)
+
+    def add(self, prefix: str, value: object) -> None:
+        node = self
+        for char in prefix:
+            child = node.children.get(char)
+            if child is None:
+                child = node.children[char] = PrefixTrie()
+            node = child
+        node.value = value
+        node.has_value = True
+
+    def longest_prefix_value(self, name: str, default: object = None) -> object:
+        """
+        Return the value of the longest prefix of name, or default if none
+        of the prefixes match.
+        """
+        node = self
+        value = node.value if node.has_value else default
+        for char in name:
+            node = node.children.get(char)
+            if node is None:
+                break
+            if node.has_value:
+                value = node.value
+        return value
 
 
 class Sampler:
@@ -12,6 +60,11 @@ class Sampler:
     - Loading and managing sampling configuration
     - Pattern matching for operations (endpoints and jobs)
     - Making sampling decisions based on operation type and patterns
+    - Adapting sample rates to a target throughput, if configured
+
+    Patterns are compiled into prefix tries, the longest matching pattern
+    winning, and the rates worked out for each operation are kept in an LRU
+    cache, so hot operations cost a lookup however many patterns there are.
     """
 
     # Constants for operation type detection
@@ -35,6 +88,27 @@ class Sampler:
         self.ignore_jobs = set(config.value("ignore_jobs"))
         self.endpoint_sample_rate = config.value("endpoint_sample_rate")
         self.job_sample_rate = config.value("job_sample_rate")
+        target = config.value("sample_target_per_second")
+        if target > 0:
+            self.adaptive_sampler = AdaptiveSampler(
+                target, per_operation=config.value("sample_target_per_operation")
+            )
+        else:
+            self.adaptive_sampler = None
+        self._sampling = self._any_sampling()
+        self._endpoint_patterns = PrefixTrie((self.sample_endpoints or {}).items())
+        self._job_patterns = PrefixTrie((self.sample_jobs or {}).items())
+        self._endpoint_ignores = PrefixTrie(
+            (prefix, True) for prefix in self.ignore_endpoints
+        )
+        self._job_ignores = PrefixTrie((prefix, True) for prefix in self.ignore_jobs)
+        self._rates = lru_cache(maxsize=RATE_CACHE_SIZE)(self._compile_rates)
+        if config.value("tail_sampling"):
+            from scout_apm.core.tail_sampler import TailSampler
+
+            self.tail_sampler = TailSampler(config)
+        else:
+            self.tail_sampler = None
 
     def _any_sampling(self):
         """
@@ -51,27 +125,9 @@ class Sampler:
             or self.ignore_jobs
             or self.endpoint_sample_rate is not None
             or self.job_sample_rate is not None
+            or self.adaptive_sampler is not None
         )
 
-    def _find_matching_rate(
-        self, name: str, patterns: Dict[str, float]
-    ) -> Optional[str]:
-        """
-        Finds the matching sample rate for a given operation name.
-
-        Args:
-            name: The operation name to match
-            patterns: Dictionary of pattern to sample rate mappings
-
-        Returns:
-            The sample rate for the matching pattern or None if no match found
-        """
-
-        for pattern, rate in patterns.items():
-            if name.startswith(pattern):
-                return rate
-        return None
-
     def _get_operation_type_and_name(
         self, operation: str
     ) -> Tuple[Optional[str], Optional[str]]:
@@ -92,12 +148,50 @@ class Sampler:
         else:
             return None, None
 
+    def _compile_rates(self, operation: str) -> Tuple[float, float]:
+        """
+        Works out the sample rates for an operation, which are cached.
+
+        Args:
+            operation: The operation string (e.g. "Controller/users/show")
+
+        Returns:
+            Tuple of the sample rate for the operation, and for it when the
+            transaction has been flagged as ignored
+        """
+        op_type, name = self._get_operation_type_and_name(operation)
+        if not op_type or not name:
+            return self.sample_rate, self.sample_rate
+        if op_type == "endpoint":
+            patterns = self._endpoint_patterns
+            ignore_prefixes = self.ignore_endpoints
+            ignores = self._endpoint_ignores
+            default_operation_rate = self.endpoint_sample_rate
+        else:
+            patterns = self._job_patterns
+            ignore_prefixes = self.ignore_jobs
+            ignores = self._job_ignores
+            default_operation_rate = self.job_sample_rate
+
+        matching_rate = patterns.longest_prefix_value(name)
+        if matching_rate is not None:
+            return matching_rate, matching_rate
+        if default_operation_rate is None:
+            # Fall back to global sample rate
+            default_operation_rate = self.sample_rate
+        if not ignore_prefixes:
+            # The ignore flag only applies alongside ignore patterns.
+            return default_operation_rate, default_operation_rate
+        if ignores.longest_prefix_value(name, False):
+            return 0, 0
+        return default_operation_rate, 0
+
     def get_effective_sample_rate(self, operation: str, is_ignored: bool) -> float:
         """
         Determines the effective sample rate for a given operation.
 
         Prioritization:
-        1. Sampling rate for specific endpoint or job
+        1. Sampling rate for the longest matching endpoint or job pattern
         2. Specified ignore pattern or flag for operation
         3. Global endpoint or job sample rate
         4. Global sample rate
@@ -109,28 +203,58 @@ class Sampler:
         Returns:
             Float between 0 and 1 representing sample rate
         """
-        op_type, name = self._get_operation_type_and_name(operation)
-        patterns = self.sample_endpoints if op_type == "endpoint" else self.sample_jobs
-        ignores = self.ignore_endpoints if op_type == "endpoint" else self.ignore_jobs
-        default_operation_rate = (
-            self.endpoint_sample_rate if op_type == "endpoint" else self.job_sample_rate
-        )
+        rate, ignored_rate = self._rates(operation)
+        return ignored_rate if is_ignored else rate
 
-        if not op_type or not name:
-            return self.sample_rate
-        matching_rate = self._find_matching_rate(name, patterns)
-        if matching_rate is not None:
-            return matching_rate
-        for prefix in ignores:
-            if name.startswith(prefix) or is_ignored:
-                return 0
-        if default_operation_rate is not None:
-            return default_operation_rate
+    def sample(
+        self,
+        operation: str,
+        is_ignored: bool,
+        duration: Optional[float] = None,
+        is_error: bool = False,
+    ) -> Optional[float]:
+        """
+        Decides whether to sample an operation.
+        If no sampling is enabled, always sample it.
 
-        # Fall back to global sample rate
-        return self.sample_rate
+        With a sample_target_per_second, the configured sample rates are
+        lowered as needed to meet the target.
 
-    def should_sample(self, operation: str, is_ignored: bool) -> bool:
+        Args:
+            operation: The operation string (e.g. "Controller/users/show"
+                   or "Job/mailer")
+            is_ignored: boolean for if the specific transaction is ignored
+            duration: How long the request took in seconds, once finished,
+                   for tail sampling
+            is_error: boolean for if the request was tagged with an error,
+                   for tail sampling
+
+        Returns:
+            The rate the operation was sampled at, or None if it wasn't
+        """
+        if not self._sampling:
+            return 1.0
+        rate = self.get_effective_sample_rate(operation, is_ignored)
+        if self.adaptive_sampler is not None and rate > 0:
+            rate = min(rate, self.adaptive_sampler.probability(operation))
+        if (
+            self.tail_sampler is not None
+            and duration is not None
+            and 0 < rate < 1
+            and self.tail_sampler.should_keep(operation, duration, is_error)
+        ):
+            return 1.0
+        if random.random() <= rate:
+            return rate
+        return None
+
+    def should_sample(
+        self,
+        operation: str,
+        is_ignored: bool,
+        duration: Optional[float] = None,
+        is_error: bool = False,
+    ) -> bool:
         """
         Determines if an operation should be sampled.
         If no sampling is enabled, always return True.
@@ -138,10 +262,13 @@ class Sampler:
         Args:
             operation: The operation string (e.g. "Controller/users/show"
                    or "Job/mailer")
+            is_ignored: boolean for if the specific transaction is ignored
+            duration: How long the request took in seconds, once finished,
+                   for tail sampling
+            is_error: boolean for if the request was tagged with an error,
+                   for tail sampling
 
         Returns:
             Boolean indicating whether to sample this operation
         """
-        if not self._any_sampling():
-            return True
-        return random.random() <= self.get_effective_sample_rate(operation, is_ignored)
+        return self.sample(operation, is_ignored, duration, is_error) is not None
@@ -14,8 +14,7 @@ class Cpu(object):
     human_name = "Process CPU"
 
     def __init__(self):
-        self.last_run = dt.datetime.now(dt.timezone.utc)
-        self.last_cpu_times = psutil.Process().cpu_times()
+        self.reset()
         self.num_processors = psutil.cpu_count()
         if self.num_processors is None:
             logger.debug("Could not determine CPU count - assuming there is one.")
@@ -71,6 +70,12 @@ class Cpu(object):
 
         return res
 
+    def reset(self):
+        """
+        Take the baseline that the next run() measures from.
+        """
+        self.save_times(dt.datetime.now(dt.timezone.utc), psutil.Process().cpu_times())
+
     def save_times(self, now, cpu_times):
         self.last_run = now
-        self.cpu_times = cpu_times
+        self.last_cpu_times = cpu_times
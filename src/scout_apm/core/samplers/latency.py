@@ -0,0 +1,93 @@
+# coding=utf-8
+
+import logging
+import threading
+
+from scout_apm.core.histogram import Histogram
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyHistograms(object):
+    """
+    Histograms of request durations in microseconds per operation, recorded
+    by TrackedRequest.finish() for every request, sampled or not, with the
+    latency_histograms setting on.
+
+    Up to MAX_OPERATIONS operations get their own histogram between runs of
+    the Latency sampler, and any more are recorded under OTHER_OPERATION, so
+    totals stay exact with bounded memory.
+    """
+
+    MAX_OPERATIONS = 500
+    OTHER_OPERATION = "Other"
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        # Operation -> Histogram
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def reset_after_fork(self):
+        """
+        Drop the histograms in a forked child, replacing the lock, which
+        another thread of the parent may have held at the fork. The
+        durations are the parent's to report.
+        """
+        self._reset()
+
+    def record(self, operation, duration_us):
+        with self._lock:
+            histogram = self.histograms.get(operation)
+            if histogram is None:
+                if len(self.histograms) >= self.MAX_OPERATIONS:
+                    operation = self.OTHER_OPERATION
+                    histogram = self.histograms.get(operation)
+                if histogram is None:
+                    histogram = self.histograms[operation] = Histogram()
+            histogram.record(duration_us)
+
+    def take(self):
+        """
+        Return the histograms recorded since the last call, starting afresh.
+        """
+        with self._lock:
+            histograms = self.histograms
+            self.histograms = {}
+        return histograms
+
+
+latency_histograms = LatencyHistograms()
+
+
+class Latency(object):
+    metric_type = "Scout"
+    metric_name = "Latency"
+    human_name = "Request Latency"
+
+    def run(self):
+        """
+        Report the number of requests for each operation since the last run,
+        with their total, maximum and percentile durations in microseconds,
+        and the non-empty buckets of their histogram, as [lower bound, count]
+        pairs, to merge with other processes'.
+        """
+        histograms = latency_histograms.take()
+        if not histograms:
+            return None
+        value = {
+            operation: {
+                "count": histogram.count,
+                "total_us": histogram.total,
+                "max_us": histogram.max,
+                "p50_us": histogram.percentile(50),
+                "p95_us": histogram.percentile(95),
+                "p99_us": histogram.percentile(99),
+                "buckets": histogram.buckets(),
+            }
+            for operation, histogram in histograms.items()
+        }
+        logger.debug("%s: %d operations", self.human_name, len(value))
+        return value
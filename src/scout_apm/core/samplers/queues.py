@@ -0,0 +1,40 @@
+# coding=utf-8
+
+import logging
+
+from scout_apm.core.agent.socket import CoreAgentSocketThread
+from scout_apm.core.error_service import ErrorServiceThread
+
+logger = logging.getLogger(__name__)
+
+
+class Queues(object):
+    metric_type = "Scout"
+    metric_name = "Queues"
+    human_name = "Queue Stats"
+
+    def run(self):
+        """
+        Report the items enqueued, dropped and sent by the core agent and
+        error service queues since the last run, and their current sizes.
+
+        When the socket thread pipelines commands, the core agent's stats
+        also have the commands awaiting a response and the times the
+        pipeline was full, so a stalled core agent shows up.
+        """
+        value = {
+            "core_agent": CoreAgentSocketThread._command_queue.stats(),
+            "errors": ErrorServiceThread._queue.stats(),
+        }
+        active = any(
+            stats["enqueued"] or stats["dropped"] or stats["size"]
+            for stats in value.values()
+        )
+        pipeline = CoreAgentSocketThread.pipeline_stats()
+        if pipeline is not None:
+            value["core_agent"].update(pipeline)
+            active = active or pipeline["in_flight"] or pipeline["full_waits"]
+        if not active:
+            return None
+        logger.debug("%s: %s", self.human_name, value)
+        return value
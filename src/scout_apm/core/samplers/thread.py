@@ -8,7 +8,9 @@ import threading
 from scout_apm.core.agent.commands import ApplicationEvent
 from scout_apm.core.agent.socket import CoreAgentSocketThread
 from scout_apm.core.samplers.cpu import Cpu
+from scout_apm.core.samplers.latency import Latency, latency_histograms
 from scout_apm.core.samplers.memory import Memory
+from scout_apm.core.samplers.queues import Queues
 from scout_apm.core.threading import SingletonThread
 
 logger = logging.getLogger(__name__)
@@ -18,9 +20,14 @@ class SamplersThread(SingletonThread):
     _instance_lock = threading.Lock()
     _stop_event = threading.Event()
 
+    @classmethod
+    def _after_fork_in_child(cls):
+        super(SamplersThread, cls)._after_fork_in_child()
+        latency_histograms.reset_after_fork()
+
     def run(self):
         logger.debug("Starting Samplers.")
-        instances = [Cpu(), Memory()]
+        instances = [Cpu(), Memory(), Queues(), Latency()]
 
         while True:
             for instance in instances:
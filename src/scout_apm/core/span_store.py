@@ -0,0 +1,222 @@
+# coding=utf-8
+
+import copy
+from array import array
+
+from scout_apm.core import clock
+
+# Tags added by Span.add_allocation_tags(), stored in their own columns.
+ALLOCATION_TAGS = ("allocations", "start_allocations", "stop_allocations")
+
+# Marks a missing parent in the parents column.
+MISSING = -1
+
+
+class SpanStore(object):
+    """
+    Compact storage for the completed spans of a TrackedRequest, used when
+    the 'compact_span_storage' setting is enabled.
+
+    Rather than keeping a Span object, tags dict and objtrace tuples alive
+    for every completed span, each field is appended to an array column.
+    Span IDs and operations are interned into per-store tables so repeated
+    values are stored once, and parents are referenced by their index in
+    the span ID table. Only spans with tags other than the allocation counts
+    keep a tuple of their tag items.
+    """
+
+    __slots__ = (
+        "_clock_anchor",
+        "_ids",
+        "_id_index",
+        "_operations",
+        "_operation_index",
+        "_span_ids",
+        "_parents",
+        "_operation_ids",
+        "_start_ns",
+        "_end_ns",
+        "_allocations",
+        "_start_allocations",
+        "_stop_allocations",
+        "_has_allocations",
+        "_tags",
+    )
+
+    def __init__(self, clock_anchor):
+        self._clock_anchor = clock_anchor
+        self._ids = []
+        # Span ID -> index in _ids, for parents that haven't been stored yet
+        self._id_index = {}
+        self._operations = []
+        self._operation_index = {}
+        self._span_ids = array("l")
+        self._parents = array("l")
+        self._operation_ids = array("l")
+        self._start_ns = array("q")
+        self._end_ns = array("q")
+        self._allocations = array("Q")
+        self._start_allocations = array("Q")
+        self._stop_allocations = array("Q")
+        self._has_allocations = array("B")
+        # Row number -> tuple of tag items, only for rows that have any
+        self._tags = {}
+
+    def __repr__(self):
+        return "<SpanStore(spans={}, operations={})>".format(
+            len(self), len(self._operations)
+        )
+
+    def __len__(self):
+        return len(self._start_ns)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("SpanStore index out of range")
+        return StoredSpan(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield StoredSpan(self, index)
+
+    def _add_id(self, span_id):
+        # Parents complete after their children, so a span's ID is usually
+        # already in the table if any of its children were stored.
+        index = self._id_index.pop(span_id, None)
+        if index is None:
+            index = len(self._ids)
+            self._ids.append(span_id)
+        return index
+
+    def _add_parent_id(self, span_id):
+        # Only IDs referenced as parents are indexed, which keeps the lookup
+        # table as small as the number of distinct parents.
+        index = self._id_index.get(span_id)
+        if index is None:
+            index = self._id_index[span_id] = len(self._ids)
+            self._ids.append(span_id)
+        return index
+
+    def _intern_operation(self, operation):
+        index = self._operation_index.get(operation)
+        if index is None:
+            index = self._operation_index[operation] = len(self._operations)
+            self._operations.append(operation)
+        return index
+
+    def append(self, span):
+        row = len(self._start_ns)
+        self._span_ids.append(self._add_id(span.span_id))
+        self._parents.append(
+            MISSING if span.parent is None else self._add_parent_id(span.parent)
+        )
+        self._operation_ids.append(self._intern_operation(span.operation))
+        self._start_ns.append(span._start_ns)
+        self._end_ns.append(span._end_ns)
+
+        tags = span.tags
+        if "allocations" in tags:
+            self._allocations.append(tags["allocations"])
+            self._start_allocations.append(tags["start_allocations"])
+            self._stop_allocations.append(tags["stop_allocations"])
+            self._has_allocations.append(1)
+            other_tags = tuple(
+                item for item in tags.items() if item[0] not in ALLOCATION_TAGS
+            )
+        else:
+            self._allocations.append(0)
+            self._start_allocations.append(0)
+            self._stop_allocations.append(0)
+            self._has_allocations.append(0)
+            other_tags = tuple(tags.items())
+        if other_tags:
+            self._tags[row] = other_tags
+
+    def copy(self):
+        store = SpanStore(self._clock_anchor)
+        for name in self.__slots__:
+            if name != "_clock_anchor":
+                setattr(store, name, copy.copy(getattr(self, name)))
+        return store
+
+    def span_id(self, index):
+        return self._ids[self._span_ids[index]]
+
+    def parent(self, index):
+        parent = self._parents[index]
+        return None if parent == MISSING else self._ids[parent]
+
+    def operation(self, index):
+        return self._operations[self._operation_ids[index]]
+
+    def tags(self, index):
+        tags = dict(self._tags.get(index, ()))
+        if self._has_allocations[index]:
+            tags["allocations"] = self._allocations[index]
+            tags["start_allocations"] = self._start_allocations[index]
+            tags["stop_allocations"] = self._stop_allocations[index]
+        return tags
+
+    def rows(self):
+        """
+        Yield (span_id, parent_id, operation, start_ns, end_ns, tag_items)
+        for each stored span, in completion order.
+        """
+        for index in range(len(self)):
+            yield (
+                self.span_id(index),
+                self.parent(index),
+                self.operation(index),
+                self._start_ns[index],
+                self._end_ns[index],
+                tuple(self.tags(index).items()),
+            )
+
+
+class StoredSpan(object):
+    """
+    Read-only view of one span in a SpanStore.
+    """
+
+    __slots__ = ("_store", "_index")
+
+    def __init__(self, store, index):
+        self._store = store
+        self._index = index
+
+    def __repr__(self):
+        return "<StoredSpan(span_id={}, operation={})>".format(
+            repr(self.span_id), repr(self.operation)
+        )
+
+    @property
+    def span_id(self):
+        return self._store.span_id(self._index)
+
+    @property
+    def parent(self):
+        return self._store.parent(self._index)
+
+    @property
+    def operation(self):
+        return self._store.operation(self._index)
+
+    @property
+    def tags(self):
+        return self._store.tags(self._index)
+
+    @property
+    def start_time(self):
+        store = self._store
+        return clock.ns_to_datetime(store._clock_anchor, store._start_ns[self._index])
+
+    @property
+    def end_time(self):
+        store = self._store
+        return clock.ns_to_datetime(store._clock_anchor, store._end_ns[self._index])
+
+    def duration(self):
+        store = self._store
+        return (store._end_ns[self._index] - store._start_ns[self._index]) / 1e9
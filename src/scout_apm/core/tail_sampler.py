@@ -0,0 +1,121 @@
+# coding=utf-8
+
+import threading
+import time
+from collections import deque
+
+from scout_apm.core.sampler import PrefixTrie
+
+
+class TokenBucket(object):
+    """
+    Allows up to rate events per second, in bursts of up to one second's
+    worth.
+    """
+
+    __slots__ = ("rate", "tokens", "updated", "_lock")
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        """
+        Take a token, returning whether there was one.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class RollingPercentile(object):
+    """
+    Tracks a percentile of an operation's recent durations, from a window of
+    the last WINDOW, recalculated every RECALCULATE_EVERY durations so that
+    adding one usually costs only a deque append.
+
+    It isn't locked: concurrent adds may recalculate a little more or less
+    often, which does no harm.
+    """
+
+    WINDOW = 200
+    RECALCULATE_EVERY = 50
+
+    __slots__ = ("percentile", "durations", "value", "_added")
+
+    def __init__(self, percentile):
+        self.percentile = percentile
+        self.durations = deque(maxlen=self.WINDOW)
+        # None until enough durations have been seen
+        self.value = None
+        self._added = 0
+
+    def add(self, duration):
+        self.durations.append(duration)
+        self._added += 1
+        if self._added >= self.RECALCULATE_EVERY:
+            self._added = 0
+            ordered = sorted(self.durations)
+            index = int(len(ordered) * self.percentile / 100.0)
+            self.value = ordered[min(index, len(ordered) - 1)]
+
+
+class TailSampler(object):
+    """
+    Decides in TrackedRequest.finish(), once a request's outcome is known,
+    whether it must be kept whatever the sample rate: if it was tagged with
+    an error, took longer than the tail_sampling_thresholds setting for its
+    endpoint or job, or took longer than the tail_sampling_percentile of
+    its operation's recent durations.
+
+    Requests kept this way are limited to tail_sampling_budget per second,
+    so a burst of errors can't flood the core agent. Past that, they're
+    sampled like any other.
+    """
+
+    # Operations whose durations are tracked for tail_sampling_percentile
+    MAX_OPERATIONS = 1000
+
+    def __init__(self, config):
+        self.thresholds = PrefixTrie(config.value("tail_sampling_thresholds").items())
+        self.percentile = config.value("tail_sampling_percentile")
+        budget = config.value("tail_sampling_budget")
+        self.budget = TokenBucket(budget) if budget > 0 else None
+        # Operation -> RollingPercentile
+        self.percentiles = {}
+
+    def should_keep(self, operation, duration, is_error):
+        """
+        Return whether a request for the operation (e.g.
+        "Controller/users/show") that took duration seconds must be kept.
+        """
+        keep = is_error or self._is_slow(operation, duration)
+        if keep and self.budget is not None:
+            return self.budget.take()
+        return keep
+
+    def _is_slow(self, operation, duration):
+        # Thresholds are set by name, without the "Controller/" or "Job/" prefix.
+        threshold = self.thresholds.longest_prefix_value(operation.partition("/")[2])
+        if threshold is not None and duration > threshold:
+            return True
+        if not self.percentile:
+            return False
+        percentile = self.percentiles.get(operation)
+        if percentile is None:
+            if len(self.percentiles) >= self.MAX_OPERATIONS:
+                return False
+            percentile = self.percentiles.setdefault(
+                operation, RollingPercentile(self.percentile)
+            )
+        # Compared before adding, so an outlier can't raise its own bar.
+        slow = percentile.value is not None and duration > percentile.value
+        percentile.add(duration)
+        return slow
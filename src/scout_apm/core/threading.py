@@ -1,5 +1,6 @@
 # coding=utf-8
 
+import os
 import threading
 
 
@@ -51,6 +52,34 @@ class SingletonThread(threading.Thread):
         """
         pass
 
+    @classmethod
+    def _after_fork_in_child(cls):
+        """
+        Reset the class's state in a forked child, where the thread isn't
+        running. Locks held by other threads of the parent at the moment of
+        the fork would stay held forever, so they're replaced rather than
+        reused. Subclasses extend this to reset their own locks and queues.
+        """
+        cls._instance = None
+        cls._instance_lock = threading.Lock()
+        cls._stop_event = threading.Event()
+
     def __init__(self, *args, **kwargs):
         super(SingletonThread, self).__init__(*args, **kwargs)
         self.daemon = True
+
+
+def _subclasses(cls):
+    for subclass in cls.__subclasses__():
+        yield subclass
+        for subclass_subclass in _subclasses(subclass):
+            yield subclass_subclass
+
+
+def _after_fork_in_child():
+    for subclass in _subclasses(SingletonThread):
+        subclass._after_fork_in_child()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
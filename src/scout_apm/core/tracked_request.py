@@ -1,18 +1,21 @@
 # coding=utf-8
 
-import datetime as dt
+import heapq
 import logging
+import os
 from contextlib import contextmanager
-from uuid import uuid4
+from types import MappingProxyType
 
-from scout_apm.core import backtrace, objtrace
+from scout_apm.core import backtrace, clock, ids, objtrace
 from scout_apm.core.agent.commands import BatchCommand
 from scout_apm.core.agent.socket import CoreAgentSocketThread
-from scout_apm.core.config import scout_config
+from scout_apm.core.config import ScoutConfig, scout_config
 from scout_apm.core.n_plus_one_tracker import NPlusOneTracker
 from scout_apm.core.sampler import Sampler
+from scout_apm.core.samplers.latency import latency_histograms
 from scout_apm.core.samplers.memory import get_rss_in_mb
 from scout_apm.core.samplers.thread import SamplersThread
+from scout_apm.core.span_store import SpanStore
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +28,7 @@ class TrackedRequest(object):
     """
 
     _sampler = None
+    _settings = None
 
     @classmethod
     def get_sampler(cls):
@@ -32,11 +36,19 @@ class TrackedRequest(object):
             cls._sampler = Sampler(scout_config)
         return cls._sampler
 
+    @classmethod
+    def get_settings(cls):
+        settings = cls._settings
+        if settings is None or settings.version != ScoutConfig.version:
+            settings = cls._settings = RequestSettings(scout_config)
+        return settings
+
     __slots__ = (
         "sampler",
         "request_id",
-        "start_time",
-        "end_time",
+        "_clock_anchor",
+        "_start_ns",
+        "_end_ns",
         "active_spans",
         "complete_spans",
         "tags",
@@ -45,7 +57,16 @@ class TrackedRequest(object):
         "n_plus_one_tracker",
         "hit_max",
         "sent",
+        "_handed_over",
         "operation",
+        "_flush_span_count",
+        "_flush_span_ns",
+        "_last_flush_ns",
+        "_flushed",
+        "_aggregate_keep",
+        "_span_run",
+        "_last_completed_parent",
+        "_head_sampled",
     )
 
     # Stop adding new spans at this point, to avoid exhausting memory
@@ -58,18 +79,32 @@ class TrackedRequest(object):
         return context.get_tracked_request()
 
     def __init__(self):
-        self.request_id = "req-" + str(uuid4())
-        self.start_time = dt.datetime.now(dt.timezone.utc)
-        self.end_time = None
+        self.request_id = ids.new_request_id()
+        self._clock_anchor = clock.anchor()
+        self._start_ns = self._clock_anchor[1]
+        self._end_ns = None
         self.active_spans = []
-        self.complete_spans = []
+        self.complete_spans = self._new_complete_spans()
         self.tags = {}
         self.is_real_request = False
         self._memory_start = get_rss_in_mb()
         self.n_plus_one_tracker = NPlusOneTracker()
         self.hit_max = False
         self.sent = False
+        # Whether tags and complete_spans are shared with the socket thread
+        self._handed_over = False
         self.operation = None
+        settings = self.get_settings()
+        self._flush_span_count = settings.flush_span_count
+        self._flush_span_ns = settings.flush_span_ns
+        self._last_flush_ns = self._start_ns
+        # None until spans are flushed early, then whether the request is sampled
+        self._flushed = None
+        self._aggregate_keep = settings.aggregate_keep
+        self._span_run = None
+        self._last_completed_parent = None
+        # None until sample_head() decides, then whether the request is sampled
+        self._head_sampled = None
         logger.debug("Starting request: %s", self.request_id)
 
     def __repr__(self):
@@ -78,7 +113,35 @@ class TrackedRequest(object):
             repr(self.request_id), repr(self.tags)
         )
 
+    @property
+    def start_time(self):
+        return clock.ns_to_datetime(self._clock_anchor, self._start_ns)
+
+    @start_time.setter
+    def start_time(self, value):
+        self._start_ns = clock.datetime_to_ns(self._clock_anchor, value)
+
+    @property
+    def end_time(self):
+        if self._end_ns is None:
+            return None
+        return clock.ns_to_datetime(self._clock_anchor, self._end_ns)
+
+    @end_time.setter
+    def end_time(self, value):
+        if value is None:
+            self._end_ns = None
+        else:
+            self._end_ns = clock.datetime_to_ns(self._clock_anchor, value)
+
+    def _new_complete_spans(self):
+        if self.get_settings().compact_span_storage:
+            return SpanStore(self._clock_anchor)
+        return []
+
     def tag(self, key, value):
+        if self._handed_over:
+            self._take_back()
         if key in self.tags:
             logger.debug(
                 "Overwriting previously set tag for request %s: %s",
@@ -86,6 +149,10 @@ class TrackedRequest(object):
                 key,
             )
         self.tags[key] = value
+        if key == "error" and self._head_sampled is False:
+            # Keep errored requests, recording spans from here on.
+            logger.debug("Keeping unsampled request with error: %s", self.request_id)
+            self._head_sampled = True
 
     def start_span(
         self,
@@ -94,12 +161,16 @@ class TrackedRequest(object):
         ignore_children=False,
         should_capture_backtrace=True,
     ):
+        if self._head_sampled is False:
+            self.active_spans.append(NULL_SPAN)
+            return NULL_SPAN
+
         parent = self.current_span()
         if parent is not None:
-            parent_id = parent.span_id
             if parent.ignore_children:
-                ignore = True
-                ignore_children = True
+                self.active_spans.append(NULL_SPAN)
+                return NULL_SPAN
+            parent_id = parent.span_id
         else:
             parent_id = None
 
@@ -109,8 +180,8 @@ class TrackedRequest(object):
                     "Hit the maximum number of spans, this trace will be incomplete."
                 )
                 self.hit_max = True
-            ignore = True
-            ignore_children = True
+            self.active_spans.append(NULL_SPAN)
+            return NULL_SPAN
 
         new_span = Span(
             request_id=self.request_id,
@@ -119,6 +190,7 @@ class TrackedRequest(object):
             ignore_children=ignore_children,
             parent=parent_id,
             should_capture_backtrace=should_capture_backtrace,
+            clock_anchor=self._clock_anchor,
         )
         self.active_spans.append(new_span)
         return new_span
@@ -131,12 +203,45 @@ class TrackedRequest(object):
         else:
             stopping_span.stop()
             if not stopping_span.ignore:
+                if self._handed_over:
+                    self._take_back()
                 stopping_span.annotate()
-                self.complete_spans.append(stopping_span)
+                if self._aggregate_keep is None:
+                    self.complete_spans.append(stopping_span)
+                else:
+                    self._aggregate_span(stopping_span)
+                if self._flush_span_count or self._flush_span_ns:
+                    self._maybe_flush_spans()
 
         if len(self.active_spans) == 0:
             self.finish()
 
+    def _aggregate_span(self, span):
+        """
+        Fold consecutive sibling leaf spans with the same operation and
+        statement into a SpanRun, instead of storing each one.
+        """
+        run = self._span_run
+        # Children complete just before their parent, so if the previous
+        # span's parent is this span, it has children and must be kept.
+        is_leaf = self._last_completed_parent != span.span_id
+        self._last_completed_parent = span.parent
+        key = (span.parent, span.operation, span.tags.get("db.statement"))
+        if run is not None:
+            if is_leaf and run.key == key:
+                run.add(span)
+                return
+            self._close_span_run()
+        if is_leaf:
+            self._span_run = SpanRun(key, span, self._aggregate_keep)
+        else:
+            self.complete_spans.append(span)
+
+    def _close_span_run(self):
+        if self._span_run is not None:
+            self._span_run.close(self.complete_spans)
+            self._span_run = None
+
     @contextmanager
     def span(self, *args, **kwargs):
         span = self.start_span(*args, **kwargs)
@@ -156,27 +261,131 @@ class TrackedRequest(object):
         from scout_apm.core.context import context
 
         logger.debug("Stopping request: %s", self.request_id)
-        if self.end_time is None:
-            self.end_time = dt.datetime.now(dt.timezone.utc)
+        first_finish = self._end_ns is None
+        if first_finish:
+            self._end_ns = clock.now_ns()
+        self._close_span_run()
 
         if self.is_real_request:
-            if not self.sent and self.get_sampler().should_sample(
-                self.operation, self.is_ignored()
+            if (
+                first_finish
+                and self.operation is not None
+                and self.get_settings().latency_histograms
+            ):
+                latency_histograms.record(
+                    self.operation, max(0, self._end_ns - self._start_ns) // 1000
+                )
+            if (
+                not self.sent
+                and not CoreAgentSocketThread.is_circuit_open()
+                and self._should_send()
             ):
                 self.tag("mem_delta", self._get_mem_delta())
+                # Hand the tags and spans over to the socket thread, which
+                # builds and encodes the payload from them.
                 self.sent = True
-                batch_command = BatchCommand.from_tracked_request(self)
-                if scout_config.value("log_payload_content"):
-                    logger.debug(
-                        "Sending request: %s. Payload: %s",
-                        self.request_id,
-                        batch_command.message(),
-                    )
-                else:
-                    logger.debug("Sending request: %s.", self.request_id)
-                CoreAgentSocketThread.send(batch_command)
+                self._handed_over = True
+                self.tags = MappingProxyType(self.tags)
+                logger.debug("Sending request: %s.", self.request_id)
+                CoreAgentSocketThread.send(
+                    BatchCommand.from_tracked_request(self, start=self._flushed is None)
+                )
             SamplersThread.ensure_started()
 
+        if logger.isEnabledFor(logging.DEBUG):
+            self._log_details()
+        context.clear_tracked_request(self)
+
+    def _take_back(self):
+        """
+        Copy the tags and completed spans before changing them, once they've
+        been handed over to the socket thread on finish. The socket thread
+        reads the originals without locking, so they must not change, but
+        late tags and spans are still recorded here.
+        """
+        self.tags = dict(self.tags)
+        self.complete_spans = self.complete_spans.copy()
+        self._handed_over = False
+
+    def sample_head(self):
+        """
+        With the head_sampling setting on, decide whether to sample the
+        request now, from its operation, rather than in finish(). Called by
+        integrations once the operation is known and its span started.
+
+        Spans started in an unsampled request are skipped, costing only a
+        push and pop of NULL_SPAN, so it pays for little more than timing.
+        Tagging it with "error" keeps it after all, with the spans recorded
+        from then on.
+        """
+        if self._head_sampled is not None or self._flushed is not None:
+            return
+        if not self.get_settings().head_sampling:
+            return
+        self._head_sampled = self._sample()
+        if not self._head_sampled:
+            logger.debug("Not sampling request: %s", self.request_id)
+
+    def _should_send(self):
+        if self._head_sampled is not None:
+            return self._head_sampled
+        if self._flushed is not None:
+            return self._flushed
+        if self._end_ns is None:
+            return self._sample()
+        return self._sample(
+            duration=(self._end_ns - self._start_ns) / 1e9,
+            is_error=bool(self.tags.get("error")),
+        )
+
+    def _sample(self, duration=None, is_error=False):
+        sampler = self.get_sampler()
+        rate = sampler.sample(self.operation, self.is_ignored(), duration, is_error)
+        if rate is None:
+            return False
+        if sampler.adaptive_sampler is not None:
+            # So counts from sampled requests can be scaled back up
+            self.tag("scout.sample_rate", rate)
+        return True
+
+    def _maybe_flush_spans(self):
+        # Nothing to do if finish() is about to send the rest anyway.
+        if not self.active_spans or not self.is_real_request or self.sent:
+            return
+        if (
+            self._flush_span_count
+            and len(self.complete_spans) >= self._flush_span_count
+        ) or (
+            self._flush_span_ns
+            and clock.now_ns() - self._last_flush_ns >= self._flush_span_ns
+        ):
+            self.flush_spans()
+
+    def flush_spans(self):
+        """
+        Send the spans completed so far to the core agent and release them,
+        so long running requests hold a bounded number of spans in memory.
+
+        The sampling decision is made at the first flush, using the
+        operation and tags known at that point.
+        """
+        self._close_span_run()
+        first_flush = self._flushed is None
+        if first_flush:
+            self._flushed = self._should_send()
+        if self._flushed and len(self.complete_spans):
+            logger.debug(
+                "Flushing %d spans for request: %s",
+                len(self.complete_spans),
+                self.request_id,
+            )
+            CoreAgentSocketThread.send(
+                BatchCommand.from_tracked_request(self, start=first_flush, finish=False)
+            )
+        self.complete_spans = self._new_complete_spans()
+        self._last_flush_ns = clock.now_ns()
+
+    def _log_details(self):
         details = " ".join(
             "{}={}".format(key, value)
             for key, value in [
@@ -192,7 +401,6 @@ class TrackedRequest(object):
             ]
         )
         logger.debug("Request %s %s", self.request_id, details)
-        context.clear_tracked_request(self)
 
     def _get_mem_delta(self):
         current_mem = get_rss_in_mb()
@@ -205,11 +413,44 @@ class TrackedRequest(object):
         return self.tags.get("ignore_transaction", False)
 
 
+class RequestSettings(object):
+    """
+    The settings read for every request, looked up once rather than for
+    each one, and again whenever ScoutConfig.version changes.
+    """
+
+    __slots__ = (
+        "version",
+        "compact_span_storage",
+        "flush_span_count",
+        "flush_span_ns",
+        "aggregate_keep",
+        "head_sampling",
+        "latency_histograms",
+        "deferred_backtraces",
+    )
+
+    def __init__(self, config):
+        # Read first, so a change while reading the rest invalidates them.
+        self.version = ScoutConfig.version
+        self.compact_span_storage = config.value("compact_span_storage")
+        self.flush_span_count = config.value("span_flush_count")
+        self.flush_span_ns = int(config.value("span_flush_seconds") * 1e9)
+        if config.value("aggregate_spans"):
+            self.aggregate_keep = config.value("aggregate_spans_keep")
+        else:
+            self.aggregate_keep = None
+        self.head_sampling = config.value("head_sampling")
+        self.latency_histograms = config.value("latency_histograms")
+        self.deferred_backtraces = config.value("deferred_backtraces")
+
+
 class Span(object):
     __slots__ = (
         "span_id",
-        "start_time",
-        "end_time",
+        "_clock_anchor",
+        "_start_ns",
+        "_end_ns",
         "request_id",
         "operation",
         "ignore",
@@ -229,10 +470,16 @@ class Span(object):
         ignore_children=False,
         parent=None,
         should_capture_backtrace=True,
+        clock_anchor=None,
     ):
-        self.span_id = "span-" + str(uuid4())
-        self.start_time = dt.datetime.now(dt.timezone.utc)
-        self.end_time = None
+        self.span_id = ids.new_span_id()
+        if clock_anchor is None:
+            clock_anchor = clock.anchor()
+            self._start_ns = clock_anchor[1]
+        else:
+            self._start_ns = clock.now_ns()
+        self._clock_anchor = clock_anchor
+        self._end_ns = None
         self.request_id = request_id
         self.operation = operation
         self.ignore = ignore
@@ -249,8 +496,29 @@ class Span(object):
             repr(self.span_id), repr(self.operation), repr(self.ignore), repr(self.tags)
         )
 
+    @property
+    def start_time(self):
+        return clock.ns_to_datetime(self._clock_anchor, self._start_ns)
+
+    @start_time.setter
+    def start_time(self, value):
+        self._start_ns = clock.datetime_to_ns(self._clock_anchor, value)
+
+    @property
+    def end_time(self):
+        if self._end_ns is None:
+            return None
+        return clock.ns_to_datetime(self._clock_anchor, self._end_ns)
+
+    @end_time.setter
+    def end_time(self, value):
+        if value is None:
+            self._end_ns = None
+        else:
+            self._end_ns = clock.datetime_to_ns(self._clock_anchor, value)
+
     def stop(self):
-        self.end_time = dt.datetime.now(dt.timezone.utc)
+        self._end_ns = clock.now_ns()
         self.end_objtrace_counts = objtrace.get_counts()
 
     def tag(self, key, value):
@@ -262,13 +530,11 @@ class Span(object):
 
     # In seconds
     def duration(self):
-        if self.end_time is not None:
-            return (self.end_time - self.start_time).total_seconds()
+        if self._end_ns is not None:
+            return (self._end_ns - self._start_ns) / 1e9
         else:
             # Current, running duration
-            return (
-                dt.datetime.now(tz=dt.timezone.utc) - self.start_time
-            ).total_seconds()
+            return (clock.now_ns() - self._start_ns) / 1e9
 
     # Add any interesting annotations to the span. Assumes that we are in the
     # process of stopping this span.
@@ -314,6 +580,9 @@ class Span(object):
         self.tag("stop_allocations", end_allocs)
 
     def capture_backtrace(self):
+        if TrackedRequest.get_settings().deferred_backtraces:
+            self.tag("stack", backtrace.capture_deferred_backtrace())
+            return
         # The core-agent will trim the full_path as necessary.
         self.tag(
             "stack",
@@ -326,3 +595,134 @@ class Span(object):
                 for frame in backtrace.capture_backtrace()
             ],
         )
+
+
+class SpanRun(object):
+    """
+    A run of consecutive sibling spans with the same operation and
+    statement, such as the queries of an N+1 loop, used when the
+    'aggregate_spans' setting is enabled.
+
+    The slowest 'keep' spans, preferring any with a captured backtrace such
+    as from NPlusOneTracker, are kept as they are. The rest are folded into
+    one aggregate span, reusing the first folded span, whose duration is
+    their total. It is tagged with the count and the total, min and max
+    durations (in seconds) of the whole run.
+    """
+
+    __slots__ = (
+        "key",
+        "keep",
+        "kept",
+        "count",
+        "total_ns",
+        "min_ns",
+        "max_ns",
+        "aggregate",
+        "folded_ns",
+    )
+
+    def __init__(self, key, span, keep):
+        self.key = key
+        self.keep = keep
+        # Min-heap of (priority, order, span) so the fastest is folded first
+        self.kept = []
+        self.count = 0
+        self.total_ns = 0
+        self.min_ns = None
+        self.max_ns = None
+        self.aggregate = None
+        self.folded_ns = 0
+        self.add(span)
+
+    def add(self, span):
+        duration_ns = span._end_ns - span._start_ns
+        self.count += 1
+        self.total_ns += duration_ns
+        if self.min_ns is None or duration_ns < self.min_ns:
+            self.min_ns = duration_ns
+        if self.max_ns is None or duration_ns > self.max_ns:
+            self.max_ns = duration_ns
+
+        priority = float("inf") if "stack" in span.tags else duration_ns
+        heapq.heappush(self.kept, (priority, self.count, span))
+        if len(self.kept) > self.keep:
+            _, _, span = heapq.heappop(self.kept)
+            if self.aggregate is None:
+                self.aggregate = span
+            self.folded_ns += span._end_ns - span._start_ns
+
+    def close(self, complete_spans):
+        for _, _, span in sorted(self.kept, key=lambda item: item[1]):
+            complete_spans.append(span)
+
+        aggregate = self.aggregate
+        if aggregate is not None:
+            aggregate._end_ns = aggregate._start_ns + self.folded_ns
+            statement = aggregate.tags.get("db.statement")
+            aggregate.tags = {
+                "aggregate.count": self.count,
+                "aggregate.total_duration": self.total_ns / 1e9,
+                "aggregate.min_duration": self.min_ns / 1e9,
+                "aggregate.max_duration": self.max_ns / 1e9,
+            }
+            if statement is not None:
+                aggregate.tags["db.statement"] = statement
+            complete_spans.append(aggregate)
+
+
+class NullSpan(object):
+    """
+    Stand-in for spans that will never be recorded: children of a span with
+    ignore_children=True, and spans started after MAX_COMPLETE_SPANS. One
+    shared instance is used, so these cost only a push and pop on the active
+    span stack. Writes are accepted and discarded.
+    """
+
+    __slots__ = ()
+
+    span_id = None
+    request_id = None
+    operation = None
+    parent = None
+    ignore = True
+    ignore_children = True
+    should_capture_backtrace = False
+    start_time = None
+    end_time = None
+    tags = MappingProxyType({})
+
+    def __repr__(self):
+        return "<NullSpan()>"
+
+    def __setattr__(self, name, value):
+        pass
+
+    def stop(self):
+        pass
+
+    def tag(self, key, value):
+        pass
+
+    def duration(self):
+        return 0.0
+
+    def annotate(self):
+        pass
+
+    def capture_backtrace(self):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+def _reset_after_fork():
+    TrackedRequest._sampler = None
+    TrackedRequest._settings = None
+
+
+# A forked child builds its own Sampler, rather than sharing whatever state
+# the parent's had when it forked, and reads its settings afresh.
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
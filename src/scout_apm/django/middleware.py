@@ -121,8 +121,10 @@ class ViewTimingMiddleware(object):
 
         span = tracked_request.current_span()
         if span is not None:
-            span.operation = get_controller_name(request)
-            tracked_request.operation = span.operation
+            operation = get_controller_name(request)
+            span.operation = operation
+            tracked_request.operation = operation
+            tracked_request.sample_head()
 
     def process_exception(self, request, exception):
         """
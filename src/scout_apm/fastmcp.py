@@ -3,6 +3,8 @@
 import logging
 
 import scout_apm.core
+from scout_apm.async_.core_agent import AsyncCoreAgentSocket
+from scout_apm.core.agent.socket import loop_socket
 from scout_apm.core.error import ErrorMonitor
 from scout_apm.core.tracked_request import TrackedRequest
 from scout_apm.core.web_requests import filter_element
@@ -29,6 +31,7 @@ class ScoutMiddleware(Middleware if Middleware is not None else object):
             super().__init__()
         installed = scout_apm.core.install()
         self._do_nothing = not installed
+        self._asyncio_transport = installed and AsyncCoreAgentSocket.enabled()
 
     async def on_call_tool(self, context, call_next):
         """
@@ -64,18 +67,26 @@ class ScoutMiddleware(Middleware if Middleware is not None else object):
             filtered_args = filter_element("", arguments)
             tracked_request.tag("arguments", str(filtered_args))
 
-        with tracked_request.span(operation=operation, should_capture_backtrace=False):
-            try:
-                result = await call_next(context)
-                return result
-            except Exception as exc:
-                tracked_request.tag("error", "true")
-                ErrorMonitor.send(
-                    (type(exc), exc, exc.__traceback__),
-                    custom_controller=operation,
-                    custom_params={"tool": tool_name, "arguments": arguments},
-                )
-                raise
+        if self._asyncio_transport:
+            token = loop_socket.set(AsyncCoreAgentSocket.instance())
+        try:
+            with tracked_request.span(
+                operation=operation, should_capture_backtrace=False
+            ):
+                try:
+                    result = await call_next(context)
+                    return result
+                except Exception as exc:
+                    tracked_request.tag("error", "true")
+                    ErrorMonitor.send(
+                        (type(exc), exc, exc.__traceback__),
+                        custom_controller=operation,
+                        custom_params={"tool": tool_name, "arguments": arguments},
+                    )
+                    raise
+        finally:
+            if self._asyncio_transport:
+                loop_socket.reset(token)
 
     def _tag_tool_metadata(self, tracked_request, tool):
         """
@@ -56,6 +56,7 @@ class ScoutApm(object):
             operation=operation, should_capture_backtrace=False
         ) as span:
             request._scout_view_span = span
+            tracked_request.sample_head()
 
             try:
                 response = wrapped(*args, **kwargs)
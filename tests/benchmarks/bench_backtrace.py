@@ -0,0 +1,89 @@
+# coding=utf-8
+"""
+Cost of capture_backtrace() at various stack depths, half of them library
+frames, comparing working out every frame's paths on each capture, as it
+used to do, with its cache of paths per code object, which skips library
+frames before building anything for them, and with the request thread's
+part of capture_deferred_backtrace(), for the deferred_backtraces setting.
+
+Run with: python -m tests.benchmarks.bench_backtrace
+"""
+
+import itertools
+import os
+import sysconfig
+
+from scout_apm.core import backtrace
+from tests.benchmarks.tools import measure, report
+
+NUMBER = 2000
+DEPTHS = [10, 50, 200]
+
+
+def uncached_capture():
+    paths = sysconfig.get_paths()
+    library_paths = {paths["purelib"], paths["platlib"]}
+    walker = (
+        frame
+        for frame in backtrace.backtrace_walker()
+        if not any(
+            frame["full_path"].startswith(exclusion) for exclusion in library_paths
+        )
+    )
+    return list(itertools.islice(walker, backtrace.LIMIT))
+
+
+def compile_caller(filename):
+    namespace = {}
+    code = compile(
+        "def call(depth, func):\n"
+        "    if depth <= 1:\n"
+        "        return func()\n"
+        "    return next_call(depth - 1, func)\n",
+        filename,
+        "exec",
+    )
+    exec(code, namespace)
+    return namespace
+
+
+# Calls alternate between user and library code, like an application
+# calling into a framework and back.
+user = compile_caller(os.path.abspath("app/views.py"))
+library = compile_caller(os.path.join(backtrace.LIBRARY_PATHS[0], "framework.py"))
+user["next_call"] = library["call"]
+library["next_call"] = user["call"]
+
+
+def main():
+    for depth in DEPTHS:
+        compare(depth)
+
+
+def compare(depth):
+    report(
+        "Stack depth {}".format(depth),
+        [
+            (
+                "uncached",
+                measure(lambda: user["call"](depth, uncached_capture), NUMBER),
+            ),
+            (
+                "capture_backtrace",
+                measure(
+                    lambda: user["call"](depth, backtrace.capture_backtrace), NUMBER
+                ),
+            ),
+            (
+                "capture_deferred_backtrace",
+                measure(
+                    lambda: user["call"](depth, backtrace.capture_deferred_backtrace),
+                    NUMBER,
+                ),
+            ),
+        ],
+    )
+
+
+if __name__ == "__main__":
+    main()
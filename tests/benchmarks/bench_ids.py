@@ -0,0 +1,42 @@
+# coding=utf-8
+"""
+Cost of generating IDs for a request with MAX_COMPLETE_SPANS spans, comparing
+uuid4() with the counter based generator in scout_apm.core.ids.
+
+Run with: python -m tests.benchmarks.bench_ids
+"""
+
+from uuid import uuid4
+
+from scout_apm.core import ids
+from scout_apm.core.tracked_request import TrackedRequest
+from tests.benchmarks.tools import measure, report
+
+NUMBER = 50
+SPANS = TrackedRequest.MAX_COMPLETE_SPANS
+
+
+def uuid4_ids():
+    request_id = "req-" + str(uuid4())
+    span_ids = ["span-" + str(uuid4()) for _ in range(SPANS)]
+    return request_id, span_ids
+
+
+def counter_ids():
+    request_id = ids.new_request_id()
+    span_ids = [ids.new_span_id() for _ in range(SPANS)]
+    return request_id, span_ids
+
+
+def main():
+    report(
+        "IDs for one request with {} spans".format(SPANS),
+        [
+            ("uuid4", measure(uuid4_ids, NUMBER)),
+            ("ids.new_span_id", measure(counter_ids, NUMBER)),
+        ],
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# coding=utf-8
+"""
+Time for producer threads to hand items to one consumer thread, through
+queue.Queue and through CommandQueue, as request threads do with
+CoreAgentSocketThread.send().
+
+Run with: python -m tests.benchmarks.bench_queue
+"""
+
+import threading
+import time
+
+from scout_apm.compat import queue
+from scout_apm.core.command_queue import CommandQueue
+from tests.benchmarks.tools import report
+
+ITEMS_PER_PRODUCER = 2000
+
+
+def stdlib_put(stdlib_queue):
+    def put(item):
+        try:
+            stdlib_queue.put(item, False)
+        except queue.Full:
+            pass
+
+    return put
+
+
+def handoff(producers, new_queue, put):
+    """
+    Return the time per item in microseconds for producers threads to each
+    put ITEMS_PER_PRODUCER items while a consumer takes them.
+    """
+    handoff_queue = new_queue()
+    put = put(handoff_queue)
+    start_barrier = threading.Barrier(producers + 1)
+    stop = threading.Event()
+
+    def produce():
+        start_barrier.wait()
+        for item in range(ITEMS_PER_PRODUCER):
+            put(item)
+
+    def consume():
+        # Stopped with an event rather than a sentinel item, which a full
+        # CommandQueue would refuse.
+        while not stop.is_set():
+            try:
+                handoff_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            handoff_queue.task_done()
+
+    consumer = threading.Thread(target=consume, daemon=True)
+    consumer.start()
+    threads = [threading.Thread(target=produce) for _ in range(producers)]
+    for thread in threads:
+        thread.start()
+    start_barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    consumer.join()
+    return elapsed / (producers * ITEMS_PER_PRODUCER) * 1e6
+
+
+def main():
+    for producers in (1, 8, 32, 64):
+        report(
+            "{} producer threads, {} items each".format(producers, ITEMS_PER_PRODUCER),
+            [
+                (
+                    "queue.Queue.put",
+                    handoff(producers, lambda: queue.Queue(500), stdlib_put),
+                ),
+                (
+                    "CommandQueue.offer",
+                    handoff(
+                        producers,
+                        lambda: CommandQueue(maxsize=500),
+                        lambda command_queue: command_queue.offer,
+                    ),
+                ),
+            ],
+        )
+
+
+if __name__ == "__main__":
+    main()
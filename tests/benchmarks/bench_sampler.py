@@ -0,0 +1,75 @@
+# coding=utf-8
+"""
+Cost of Sampler.get_effective_sample_rate() with hundreds of endpoint
+patterns and ignore prefixes, comparing a scan of the patterns in order,
+as Sampler used to do, with its prefix tries, and with its cache of rates
+per operation.
+
+Run with: python -m tests.benchmarks.bench_sampler
+"""
+
+from scout_apm.core.config import ScoutConfig
+from scout_apm.core.sampler import Sampler
+from tests.benchmarks.tools import measure, report
+
+NUMBER = 20000
+PATTERNS = 500
+OPERATIONS = [
+    # Matches a pattern near the end of the scan
+    "Controller/api/v1/resource{}/show".format(PATTERNS - 1),
+    # Matches nothing, so every pattern and ignore prefix is checked
+    "Controller/unmatched/endpoint",
+]
+
+
+def scan_rate(sampler, operation, is_ignored):
+    name = operation[len(Sampler.CONTROLLER_PREFIX) :]
+    for pattern, rate in sampler.sample_endpoints.items():
+        if name.startswith(pattern):
+            return rate
+    for prefix in sampler.ignore_endpoints:
+        if name.startswith(prefix) or is_ignored:
+            return 0
+    return sampler.endpoint_sample_rate
+
+
+def main():
+    config = ScoutConfig()
+    ScoutConfig.set(
+        sample_endpoints={
+            "api/v1/resource{}/".format(number): 0.5 for number in range(PATTERNS)
+        },
+        ignore_endpoints=["health{}".format(number) for number in range(PATTERNS)],
+        endpoint_sample_rate=0.7,
+    )
+    try:
+        sampler = Sampler(config)
+    finally:
+        ScoutConfig.reset_all()
+
+    for operation in OPERATIONS:
+        compare(sampler, operation)
+
+
+def compare(sampler, operation):
+    report(
+        "{} patterns, {} ignores: {}".format(PATTERNS, PATTERNS, operation),
+        [
+            ("scan", measure(lambda: scan_rate(sampler, operation, False), NUMBER)),
+            (
+                "prefix tries",
+                measure(lambda: sampler._compile_rates(operation), NUMBER),
+            ),
+            (
+                "get_effective_sample_rate",
+                measure(
+                    lambda: sampler.get_effective_sample_rate(operation, False),
+                    NUMBER,
+                ),
+            ),
+        ],
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# coding=utf-8
+"""
+Time to frame a finished 300 span request for the core agent, comparing
+json.dumps() of the message dict with the Serializer.
+
+Run with: python -m tests.benchmarks.bench_serializer
+"""
+
+import json
+import struct
+
+from scout_apm.core.agent.commands import BatchCommand
+from scout_apm.core.agent.serializer import Serializer
+from scout_apm.core.json_backend import get_dumps
+from scout_apm.core.tracked_request import TrackedRequest
+from tests.benchmarks.tools import measure, report
+
+SPANS = 300
+
+
+def build_command():
+    tracked_request = TrackedRequest()
+    tracked_request.tag("path", "/users/")
+    tracked_request.tag("user_ip", "127.0.0.1")
+    with tracked_request.span(operation="Controller/users.list"):
+        for index in range(SPANS - 1):
+            with tracked_request.span(
+                operation="SQL/Query", should_capture_backtrace=False
+            ) as span:
+                span.tag("db.statement", "SELECT * FROM users WHERE id = %s")
+                span.tag("allocations", index)
+    return BatchCommand.from_tracked_request(tracked_request)
+
+
+def json_dumps(command):
+    data = json.dumps(command.message()).encode("utf-8")
+    return struct.pack(">I", len(data)) + data
+
+
+def main():
+    command = build_command()
+    serializer = Serializer()
+
+    auto_serializer = Serializer(dumps=get_dumps("auto"))
+    message = command.message()
+    stdlib_dumps = get_dumps("json")
+    auto_dumps = get_dumps("auto")
+
+    def serialize():
+        serializer.frame(command).release()
+
+    def serialize_auto():
+        auto_serializer.frame(command).release()
+
+    frame = serializer.frame(command)
+    assert frame.tobytes() == json_dumps(command)
+    frame.release()
+    report(
+        "Framing a {} span BatchCommand".format(SPANS),
+        [
+            ("json.dumps(message())", measure(lambda: json_dumps(command), 50)),
+            ("Serializer.frame()", measure(serialize, 50)),
+            ("Serializer.frame(), json auto", measure(serialize_auto, 50)),
+        ],
+    )
+    report(
+        "Encoding the message dict of a {} span BatchCommand".format(SPANS),
+        [
+            ("json.dumps()", measure(lambda: stdlib_dumps(message), 50)),
+            ("json_backend auto", measure(lambda: auto_dumps(message), 50)),
+        ],
+    )
+
+
+if __name__ == "__main__":
+    main()
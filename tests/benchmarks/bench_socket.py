@@ -0,0 +1,80 @@
+# coding=utf-8
+"""
+Time for the core agent socket thread to send 2,000 finished requests to a
+fake core agent, waiting for each response, pipelining commands, and
+batching several requests into each frame. The fake core agent shares the
+process and its GIL, so it's much slower than the real one.
+
+Run with: python -m tests.benchmarks.bench_socket
+"""
+
+import datetime as dt
+import time
+
+from scout_apm.core.agent.commands import ApplicationEvent, BatchCommand
+from scout_apm.core.agent.socket import CoreAgentSocketThread
+from scout_apm.core.config import scout_config
+from scout_apm.core.tracked_request import TrackedRequest
+from tests.benchmarks.tools import report
+from tests.tools import FakeCoreAgent
+
+REQUESTS = 2000
+
+
+def request_batch():
+    tracked_request = TrackedRequest()
+    tracked_request.tag("path", "/")
+    with tracked_request.span(operation="Controller/home"):
+        with tracked_request.span(operation="SQL/Query") as span:
+            span.tag("db.statement", "SELECT 1")
+    return BatchCommand.from_tracked_request(tracked_request)
+
+
+def send_all(**config):
+    command = request_batch()
+    done = ApplicationEvent(
+        event_type="done",
+        event_value=1,
+        source="bench",
+        timestamp=dt.datetime.now(dt.timezone.utc),
+    )
+    with FakeCoreAgent() as agent:
+        scout_config.set(core_agent_socket_path=agent.socket_path, **config)
+        try:
+            CoreAgentSocketThread.ensure_started()
+            agent.wait_for_messages(1)
+            start = time.perf_counter()
+            for _ in range(REQUESTS):
+                # Stay under the queue's size limit
+                while CoreAgentSocketThread._command_queue.qsize() > 400:
+                    time.sleep(0.0001)
+                CoreAgentSocketThread.send(command)
+            CoreAgentSocketThread.send(done)
+            while "ApplicationEvent" not in agent.messages[-1]:
+                time.sleep(0.0001)
+            elapsed = time.perf_counter() - start
+        finally:
+            CoreAgentSocketThread.ensure_stopped()
+            scout_config.reset_all()
+    return elapsed / REQUESTS * 1e6
+
+
+def main():
+    report(
+        "Sending {} requests".format(REQUESTS),
+        [
+            ("wait for each response", send_all()),
+            ("pipeline_depth=64", send_all(core_agent_pipeline_depth=64)),
+            ("batch_max_requests=50", send_all(core_agent_batch_max_requests=50)),
+            (
+                "both",
+                send_all(
+                    core_agent_pipeline_depth=64, core_agent_batch_max_requests=50
+                ),
+            ),
+        ],
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# coding=utf-8
+"""
+Memory held by the completed spans of a 1,500 span request, comparing a list
+of Span objects with SpanStore.
+
+Run with: python -m tests.benchmarks.bench_span_store
+"""
+
+import gc
+import tracemalloc
+
+from scout_apm.core.config import scout_config
+from scout_apm.core.tracked_request import TrackedRequest
+
+SPANS = TrackedRequest.MAX_COMPLETE_SPANS - 1
+
+
+def build_request(compact):
+    scout_config.set(compact_span_storage=compact)
+    try:
+        tracked_request = TrackedRequest()
+    finally:
+        scout_config.reset_all()
+    tracked_request.start_span(operation="Job/bench")
+    for index in range(SPANS):
+        with tracked_request.span(operation="SQL/Query") as span:
+            span.tag("db.statement", "SELECT * FROM users WHERE id = %s")
+            span.tag("allocations", index)
+            span.tag("start_allocations", index)
+            span.tag("stop_allocations", index * 2)
+    return tracked_request
+
+
+def measure_memory(compact):
+    gc.collect()
+    tracemalloc.start()
+    tracked_request = build_request(compact)
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del tracked_request
+    return current, peak
+
+
+def main():
+    print("Memory for one request with {} spans".format(SPANS))  # noqa: T001,T201
+    for label, compact in [("list of Span", False), ("SpanStore", True)]:
+        current, peak = measure_memory(compact)
+        print(  # noqa: T001,T201
+            "  {:<32} {:>8.1f} KiB held  {:>8.1f} KiB peak".format(
+                label, current / 1024, peak / 1024
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# coding=utf-8
+"""
+Per-span timing overhead, comparing datetime based timing with the monotonic
+nanosecond clock used by Span, and the cost of starting and stopping a span
+with them, against a baseline patched to time spans with datetime.now() and
+give them uuid4() IDs, as TrackedRequest used to.
+
+Run with: python -m tests.benchmarks.bench_spans
+"""
+
+import datetime as dt
+from unittest import mock
+from uuid import uuid4
+
+from scout_apm.core import clock, ids
+from scout_apm.core.tracked_request import TrackedRequest
+from tests.benchmarks.tools import measure, report
+
+NUMBER = 20000
+_EPOCH = dt.datetime(1970, 1, 1, tzinfo=dt.timezone.utc)
+_ONE_MICROSECOND = dt.timedelta(microseconds=1)
+
+
+def datetime_span_timing():
+    # What Span.__init__, Span.stop and Span.duration used to do.
+    start_time = dt.datetime.now(dt.timezone.utc)
+    end_time = dt.datetime.now(dt.timezone.utc)
+    return (end_time - start_time).total_seconds()
+
+
+def monotonic_span_timing():
+    start_ns = clock.now_ns()
+    end_ns = clock.now_ns()
+    return (end_ns - start_ns) / 1e9
+
+
+def datetime_now_ns():
+    # Costs a datetime.now() and a subtraction, as the datetime based timing
+    # did, but returns nanoseconds for the current code.
+    return (dt.datetime.now(dt.timezone.utc) - _EPOCH) // _ONE_MICROSECOND * 1000
+
+
+def uuid4_span_id():
+    return "span-" + str(uuid4())
+
+
+def main():
+    report(
+        "Span timing (start, stop, duration)",
+        [
+            ("datetime.now", measure(datetime_span_timing, NUMBER)),
+            ("perf_counter_ns", measure(monotonic_span_timing, NUMBER)),
+        ],
+    )
+
+    tracked_request = TrackedRequest()
+    # Keep a root span open so stop_span() doesn't finish the request.
+    tracked_request.start_span(operation="Controller/bench")
+
+    def start_stop_span():
+        tracked_request.start_span(operation="SQL/Query")
+        tracked_request.stop_span()
+        del tracked_request.complete_spans[:]
+
+    with mock.patch.object(clock, "now_ns", datetime_now_ns), mock.patch.object(
+        ids, "new_span_id", uuid4_span_id
+    ):
+        baseline = measure(start_stop_span, NUMBER)
+    report(
+        "TrackedRequest.start_span + stop_span",
+        [
+            ("datetime.now + uuid4 baseline", baseline),
+            ("current", measure(start_stop_span, NUMBER)),
+        ],
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+# coding=utf-8
+
+import timeit
+
+
+def measure(func, number, repeat=5):
+    """
+    Return the best per-call time of func in microseconds.
+    """
+    timer = timeit.Timer(func)
+    best = min(timer.repeat(repeat=repeat, number=number))
+    return best / number * 1e6
+
+
+def report(title, results):
+    """
+    Print a table of (label, microseconds) results, relative to the first one.
+    """
+    print(title)  # noqa: T001,T201
+    baseline = results[0][1]
+    for label, micros in results:
+        print(  # noqa: T001,T201
+            "  {:<32} {:>10.3f} us  {:>6.2f}x".format(label, micros, baseline / micros)
+        )
@@ -193,6 +193,7 @@ def short_timeouts():
 def stop_and_empty_core_agent_socket():
     yield
     scout_apm_core_socket.CoreAgentSocketThread.ensure_stopped()
+    scout_apm_core_socket.CoreAgentSocketThread._circuit.record_success()
     command_queue = scout_apm_core_socket.CoreAgentSocketThread._command_queue
     while not command_queue.empty():
         command_queue.get()
@@ -18,6 +18,7 @@ from webtest import TestApp
 
 from scout_apm.compat import datetime_to_timestamp, kwargs_only
 from scout_apm.core.config import scout_config
+from scout_apm.core.tracked_request import TrackedRequest
 from scout_apm.django.instruments.huey import ensure_huey_instrumented
 from scout_apm.django.instruments.sql import ensure_sql_instrumented
 from scout_apm.django.instruments.template import ensure_templates_instrumented
@@ -154,6 +155,20 @@ def test_home_ignored(tracked_requests):
     assert tracked_requests == []
 
 
+def test_head_sampling(tracked_requests):
+    # Don't use a Sampler cached with other settings.
+    with mock.patch.object(TrackedRequest, "_sampler", None), app_with_scout(
+        SCOUT_HEAD_SAMPLING=True, SCOUT_SAMPLE_RATE=0
+    ) as app:
+        response = TestApp(app).get("/")
+
+    assert response.status_int == 200
+    assert len(tracked_requests) == 1
+    tracked_request = tracked_requests[0]
+    assert not tracked_request.sent
+    assert tracked_request.operation == "Controller/tests.integration.django_app.home"
+
+
 @parametrize_filtered_params
 def test_filtered_params(params, expected_path, tracked_requests):
     with app_with_scout() as app:
@@ -8,7 +8,9 @@ from webtest import TestApp
 
 from scout_apm.api import Config
 from scout_apm.compat import datetime_to_timestamp, kwargs_only
+from scout_apm.core.tracked_request import TrackedRequest
 from scout_apm.flask import ScoutApm
+from tests.compat import mock
 from tests.integration.util import (
     parametrize_filtered_params,
     parametrize_queue_time_header_name,
@@ -196,6 +198,37 @@ def test_server_error(tracked_requests):
     assert tracked_request.operation == "Controller/tests.integration.test_flask.crash"
 
 
+def test_head_sampling(tracked_requests):
+    config = {"SCOUT_HEAD_SAMPLING": True, "SCOUT_SAMPLE_RATE": 0}
+    # Don't use a Sampler cached with other settings.
+    with mock.patch.object(TrackedRequest, "_sampler", None), app_with_scout(
+        config=config
+    ) as app:
+        response = TestApp(app).get("/")
+
+    assert response.status_int == 200
+    assert len(tracked_requests) == 1
+    tracked_request = tracked_requests[0]
+    assert not tracked_request.sent
+    assert len(tracked_request.complete_spans) == 1
+
+
+def test_head_sampling_keeps_server_error(tracked_requests):
+    config = {
+        "PROPAGATE_EXCEPTIONS": False,
+        "SCOUT_HEAD_SAMPLING": True,
+        "SCOUT_SAMPLE_RATE": 0,
+    }
+    with mock.patch.object(TrackedRequest, "_sampler", None), app_with_scout(
+        config=config
+    ) as app:
+        response = TestApp(app).get("/crash/", expect_errors=True)
+
+    assert response.status_int == 500
+    assert len(tracked_requests) == 1
+    assert tracked_requests[0].sent
+
+
 def test_return_error(tracked_requests):
     with app_with_scout() as app:
         response = TestApp(app).get("/return-error/", expect_errors=True)
@@ -16,8 +16,10 @@ from starlette.responses import PlainTextResponse
 from starlette.routing import Route
 
 from scout_apm.api import Config
+from scout_apm.async_.core_agent import AsyncCoreAgentSocket
 from scout_apm.async_.starlette import ScoutMiddleware
 from scout_apm.compat import datetime_to_timestamp
+from tests.compat import mock
 from tests.integration.util import (
     parametrize_filtered_params,
     parametrize_queue_time_header_name,
@@ -506,3 +508,36 @@ async def test_return_unauthorized_not_tagged_as_error(tracked_requests):
     assert tracked_request.tags["path"] == "/return-unauthorized/"
     # 401 must NOT be tagged as an error — only 5xx responses are errors
     assert "error" not in tracked_request.tags
+
+
+@pytest.mark.asyncio
+async def test_asyncio_transport(tracked_requests):
+    with app_with_scout(
+        scout_config={"core_agent_asyncio_transport": True}
+    ) as app, mock.patch.object(AsyncCoreAgentSocket, "send") as mock_send:
+        communicator = ApplicationCommunicator(app, asgi_http_scope(path="/"))
+        await communicator.send_input({"type": "http.request"})
+        await communicator.receive_output()
+        await communicator.receive_output()
+
+    assert len(tracked_requests) == 1
+    (command,), _ = mock_send.call_args
+    assert command.request.request_id == tracked_requests[0].request_id
+
+
+@pytest.mark.asyncio
+async def test_asyncio_transport_closed_on_shutdown(tracked_requests):
+    with app_with_scout(
+        scout_config={"core_agent_asyncio_transport": True}
+    ) as app, mock.patch.object(
+        AsyncCoreAgentSocket, "close", autospec=True
+    ) as mock_close:
+        async_socket = AsyncCoreAgentSocket.instance()
+        communicator = ApplicationCommunicator(app, {"type": "lifespan"})
+        await communicator.send_input({"type": "lifespan.startup"})
+        await communicator.receive_output()
+        await communicator.send_input({"type": "lifespan.shutdown"})
+        response = await communicator.receive_output()
+
+    assert response == {"type": "lifespan.shutdown.complete"}
+    mock_close.assert_called_once_with(async_socket, 2.0)
@@ -1,6 +1,10 @@
 # coding=utf-8
 
+import json
+import socket
+import struct
 import sys
+import threading
 from contextlib import contextmanager
 
 try:
@@ -89,3 +93,126 @@ def asgi_http_scope(headers=None, **kwargs):
     }
     scope.update(kwargs)
     return scope
+
+
+class FakeCoreAgent(object):
+    """
+    Accept core agent socket connections on localhost and record the
+    decoded JSON of every frame received, replying to each one.
+    """
+
+    def __init__(self, port=0):
+        self.messages = []
+        self.connections = 0
+        self._open_connections = []
+        # Clear to hold back responses
+        self.respond = threading.Event()
+        self.respond.set()
+        self._condition = threading.Condition()
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(("127.0.0.1", port))
+        self._server.listen(8)
+        self.port = self._server.getsockname()[1]
+        self.socket_path = "tcp://127.0.0.1:{}".format(self.port)
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.daemon = True
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.respond.set()
+        # Shutting down wakes up accept(), so nothing more is accepted.
+        try:
+            self._server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._server.close()
+
+    def _serve(self):
+        while True:
+            try:
+                connection, _ = self._server.accept()
+            except OSError:
+                return
+            with self._condition:
+                self.connections += 1
+                self._open_connections.append(connection)
+            thread = threading.Thread(target=self._handle, args=(connection,))
+            thread.daemon = True
+            thread.start()
+
+    def drop_connections(self):
+        """
+        Close every connection accepted so far, as a restarting core agent
+        would.
+        """
+        with self._condition:
+            connections, self._open_connections = self._open_connections, []
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _recv_exactly(self, connection, size):
+        data = b""
+        while len(data) < size:
+            chunk = connection.recv(size - len(data))
+            if not chunk:
+                raise EOFError
+            data += chunk
+        return data
+
+    def _handle(self, connection):
+        # Reply from another thread, so frames keep being read while
+        # responses are held back.
+        pending = threading.Semaphore(0)
+        responder = threading.Thread(target=self._respond, args=(connection, pending))
+        responder.daemon = True
+        responder.start()
+        try:
+            self._receive(connection, pending)
+        finally:
+            # Wakes up the responder to see the closed connection.
+            connection.close()
+            pending.release()
+
+    def _receive(self, connection, pending):
+        while True:
+            try:
+                header = self._recv_exactly(connection, 4)
+                body = self._recv_exactly(connection, struct.unpack(">I", header)[0])
+            except (EOFError, OSError):
+                return
+            with self._condition:
+                self.messages.append(json.loads(body.decode("utf-8")))
+                self._condition.notify_all()
+            pending.release()
+
+    def _respond(self, connection, pending):
+        response = b'{"Ok": {}}'
+        while True:
+            pending.acquire()
+            self.respond.wait()
+            try:
+                connection.sendall(struct.pack(">I", len(response)) + response)
+            except OSError:
+                return
+
+    def wait_for_messages(self, count, timeout=2.0, name=None):
+        """
+        Wait until at least count messages, or count named name, were
+        received, and return them all.
+        """
+
+        def received():
+            if name is None:
+                return len(self.messages) >= count
+            return sum(1 for message in self.messages if name in message) >= count
+
+        with self._condition:
+            self._condition.wait_for(received, timeout)
+            return list(self.messages)
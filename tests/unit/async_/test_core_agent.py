@@ -0,0 +1,235 @@
+# coding=utf-8
+
+import asyncio
+import datetime as dt
+import gc
+import weakref
+
+import pytest
+
+from scout_apm.async_.core_agent import AsyncCoreAgentSocket
+from scout_apm.core.agent.circuit_breaker import Backoff, CircuitBreaker
+from scout_apm.core.agent.commands import ApplicationEvent, BatchCommand
+from scout_apm.core.agent.socket import CoreAgentSocketThread, loop_socket
+from scout_apm.core.config import scout_config
+from scout_apm.core.samplers.thread import SamplersThread
+from scout_apm.core.tracked_request import TrackedRequest
+from tests.tools import FakeCoreAgent
+
+
+@pytest.fixture
+def core_agent():
+    with FakeCoreAgent() as agent:
+        scout_config.set(
+            core_agent_socket_path=agent.socket_path,
+            core_agent_asyncio_transport=True,
+            key="abcdefghijklmnopqrst",
+            name="Test App",
+        )
+        try:
+            yield agent
+        finally:
+            SamplersThread.ensure_stopped()
+            scout_config.reset_all()
+
+
+def application_event(value):
+    return ApplicationEvent(
+        event_type="test",
+        event_value=value,
+        source="test",
+        timestamp=dt.datetime.now(dt.timezone.utc),
+    )
+
+
+async def wait_for_messages(agent, count, name=None):
+    """
+    Wait for count messages, or for count named name, returning them all.
+    FakeCoreAgent.wait_for_messages() would block the loop.
+    """
+    for _ in range(200):
+        if name is None:
+            received = len(agent.messages)
+        else:
+            received = sum(1 for message in agent.messages if name in message)
+        if received >= count:
+            break
+        await asyncio.sleep(0.01)
+    return agent.messages
+
+
+@pytest.mark.asyncio
+async def test_register_and_send(core_agent):
+    async_socket = AsyncCoreAgentSocket.instance()
+    assert AsyncCoreAgentSocket.instance() is async_socket
+
+    for value in range(3):
+        async_socket.send(application_event(value))
+    await async_socket.close()
+
+    register, *events = await wait_for_messages(core_agent, 4)
+    assert register["Register"]["app"] == "Test App"
+    assert register["Register"]["key"] == "abcdefghijklmnopqrst"
+    assert [e["ApplicationEvent"]["event_value"] for e in events] == [0, 1, 2]
+    assert core_agent.connections == 1
+
+
+@pytest.mark.asyncio
+async def test_loop_socket_takes_sends(core_agent):
+    async_socket = AsyncCoreAgentSocket.instance()
+    token = loop_socket.set(async_socket)
+    try:
+        tracked_request = TrackedRequest()
+        tracked_request.is_real_request = True
+        with tracked_request.span(operation="Controller/home"):
+            pass
+    finally:
+        loop_socket.reset(token)
+
+    assert async_socket.queue.qsize() == 1
+    # The samplers thread may have queued events of its own there.
+    assert not any(
+        isinstance(command, BatchCommand)
+        for command, _ in list(CoreAgentSocketThread._command_queue.queue)
+    )
+    await async_socket.close()
+    messages = await wait_for_messages(core_agent, 1, name="BatchCommand")
+    # Anything else came from the samplers thread, over its own connection.
+    (batch,) = [m for m in messages if "BatchCommand" in m]
+    commands = batch["BatchCommand"]["commands"]
+    assert commands[0]["StartRequest"]["request_id"] == tracked_request.request_id
+
+
+@pytest.mark.asyncio
+async def test_loop_socket_ignores_thread_circuit(core_agent, monkeypatch):
+    monkeypatch.setattr(
+        CoreAgentSocketThread, "_circuit", CircuitBreaker(Backoff(100, 100))
+    )
+    CoreAgentSocketThread._circuit.record_failure()
+    async_socket = AsyncCoreAgentSocket.instance()
+    token = loop_socket.set(async_socket)
+    try:
+        assert not CoreAgentSocketThread.is_circuit_open()
+        tracked_request = TrackedRequest()
+        tracked_request.is_real_request = True
+        with tracked_request.span(operation="Controller/home"):
+            pass
+    finally:
+        loop_socket.reset(token)
+
+    assert CoreAgentSocketThread.is_circuit_open()
+    assert async_socket.queue.qsize() == 1
+    await async_socket.close()
+
+
+@pytest.mark.asyncio
+async def test_loop_socket_circuit(core_agent):
+    core_agent.__exit__(None, None, None)
+    async_socket = AsyncCoreAgentSocket.instance()
+    async_socket.circuit.backoff.base = 100
+    async_socket.send(application_event(0))
+    await asyncio.sleep(0.05)
+
+    token = loop_socket.set(async_socket)
+    try:
+        assert CoreAgentSocketThread.is_circuit_open()
+        tracked_request = TrackedRequest()
+        tracked_request.is_real_request = True
+        with tracked_request.span(operation="Controller/home"):
+            pass
+    finally:
+        loop_socket.reset(token)
+
+    assert not CoreAgentSocketThread.is_circuit_open()
+    # Only the event sent before the connection failed
+    assert async_socket.queue.qsize() == 1
+    await async_socket.close(timeout=0.01)
+
+
+@pytest.mark.asyncio
+async def test_reconnects(core_agent):
+    port = core_agent.port
+    core_agent.__exit__(None, None, None)
+    async_socket = AsyncCoreAgentSocket.instance()
+    async_socket.send(application_event(0))
+    await asyncio.sleep(0.05)
+    assert not async_socket.connected
+
+    with FakeCoreAgent(port=port) as agent:
+        await async_socket.close()
+        messages = await wait_for_messages(agent, 2)
+
+    assert "Register" in messages[0]
+    assert messages[1]["ApplicationEvent"]["event_value"] == 0
+
+
+@pytest.mark.asyncio
+async def test_queue_full(core_agent):
+    scout_config.set(core_agent_queue_size=1)
+    async_socket = AsyncCoreAgentSocket.instance()
+
+    async_socket.send(application_event(0))
+    async_socket.send(application_event(1))
+
+    assert async_socket.dropped == 1
+    await async_socket.close()
+
+
+@pytest.mark.asyncio
+async def test_close_without_sending(core_agent):
+    await AsyncCoreAgentSocket.instance().close()
+
+    assert core_agent.connections == 0
+
+
+def test_instance_collected_with_loop():
+    async def get_instance():
+        return weakref.ref(AsyncCoreAgentSocket.instance())
+
+    instances = [asyncio.run(get_instance()) for _ in range(5)]
+    gc.collect()
+
+    assert all(instance() is None for instance in instances)
+
+
+def test_queued_commands_written_at_loop_shutdown(core_agent):
+    async def send():
+        AsyncCoreAgentSocket.instance().send(application_event(0))
+
+    asyncio.run(send())
+
+    messages = core_agent.wait_for_messages(2)
+    assert messages[1]["ApplicationEvent"]["event_value"] == 0
+
+
+@pytest.mark.asyncio
+async def test_close_instance(core_agent):
+    async_socket = AsyncCoreAgentSocket.instance()
+    async_socket.send(application_event(0))
+
+    await AsyncCoreAgentSocket.close_instance()
+
+    assert async_socket.task is None
+    messages = await wait_for_messages(core_agent, 2)
+    assert messages[1]["ApplicationEvent"]["event_value"] == 0
+
+
+def test_enabled():
+    assert not AsyncCoreAgentSocket.enabled()
+    scout_config.set(core_agent_asyncio_transport=True)
+    try:
+        assert AsyncCoreAgentSocket.enabled()
+    finally:
+        scout_config.reset_all()
+
+
+def test_not_enabled_for_shm(caplog):
+    scout_config.set(
+        core_agent_asyncio_transport=True, core_agent_socket_path="shm:///tmp/rings"
+    )
+    try:
+        assert not AsyncCoreAgentSocket.enabled()
+    finally:
+        scout_config.reset_all()
+
+    assert "doesn't support the shm transport" in caplog.records[0].message
@@ -0,0 +1,80 @@
+# coding=utf-8
+
+from scout_apm.core.agent.circuit_breaker import Backoff, CircuitBreaker
+from tests.compat import mock
+
+
+def upper_bound(low, high):
+    return high
+
+
+def test_backoff_doubles_up_to_maximum():
+    backoff = Backoff(1, 5)
+
+    with mock.patch("random.uniform", side_effect=upper_bound):
+        delays = [backoff.next_delay() for _ in range(5)]
+
+    assert delays == [1, 2, 4, 5, 5]
+
+
+def test_backoff_jitter():
+    backoff = Backoff(1, 60)
+    for _ in range(4):
+        backoff.next_delay()
+
+    for _ in range(100):
+        delay = backoff.next_delay()
+        assert 8 <= delay <= 16
+        backoff.attempts = 4
+
+
+def test_backoff_reset():
+    backoff = Backoff(1, 60)
+    backoff.next_delay()
+    backoff.next_delay()
+
+    backoff.reset()
+
+    with mock.patch("random.uniform", side_effect=upper_bound):
+        assert backoff.next_delay() == 1
+
+
+def test_circuit_closed():
+    circuit = CircuitBreaker(Backoff(1, 60))
+
+    assert circuit.state == CircuitBreaker.CLOSED
+    assert not circuit.is_open()
+
+
+def test_circuit_opens_on_failure():
+    circuit = CircuitBreaker(Backoff(1, 60))
+
+    with mock.patch("random.uniform", side_effect=upper_bound):
+        assert circuit.record_failure() == 1
+        assert circuit.record_failure(scale=10) == 20
+
+    assert circuit.failures == 2
+    assert circuit.state == CircuitBreaker.OPEN
+    assert circuit.is_open()
+
+
+def test_circuit_half_open_after_delay():
+    circuit = CircuitBreaker(Backoff(1, 60))
+
+    with mock.patch("time.monotonic", return_value=100.0):
+        circuit.record_failure()
+    with mock.patch("time.monotonic", return_value=101.0):
+        assert circuit.state == CircuitBreaker.HALF_OPEN
+        assert not circuit.is_open()
+
+
+def test_circuit_closes_on_success():
+    circuit = CircuitBreaker(Backoff(1, 60))
+    circuit.record_failure()
+    circuit.record_failure()
+
+    circuit.record_success()
+
+    assert circuit.state == CircuitBreaker.CLOSED
+    assert not circuit.is_open()
+    assert circuit.backoff.attempts == 0
@@ -6,6 +6,7 @@ import logging
 import pytest
 
 from scout_apm.core.agent import commands
+from scout_apm.core.span_store import SpanStore
 from scout_apm.core.tracked_request import TrackedRequest
 from tests.tools import skip_if_objtrace_not_extension
 
@@ -420,3 +421,19 @@ def test_batch_command_from_tracked_request_with_span_no_objtrace():
     assert message_commands[6] == {
         "FinishRequest": {"request_id": REQUEST_ID, "timestamp": END_TIME_STR}
     }
+
+
+def test_batch_command_from_tracked_request_span_store():
+    tracked_request = TrackedRequest()
+    with tracked_request.span(operation="parent"):
+        with tracked_request.span(operation="child") as child:
+            child.tag("foo", "bar")
+    expected = commands.BatchCommand.from_tracked_request(tracked_request).message()
+
+    store = SpanStore(tracked_request._clock_anchor)
+    for span in tracked_request.complete_spans:
+        store.append(span)
+    tracked_request.complete_spans = store
+    command = commands.BatchCommand.from_tracked_request(tracked_request)
+
+    assert command.message() == expected
@@ -33,6 +33,19 @@ class TestCoreAgentManager(object):
 
         assert result == ["--tcp", "127.0.0.1:7894"]
 
+    def test_launch_shm(self):
+        scout_config.set(core_agent_socket_path="shm:///dev/shm/scout_apm")
+
+        try:
+            manager = CoreAgentManager()
+            with mock.patch.object(manager, "verify") as mock_verify:
+                result = manager.launch()
+        finally:
+            scout_config.reset_all()
+
+        assert result is False
+        mock_verify.assert_not_called()
+
     def test_log_level(self):
         scout_config.set(core_agent_log_level="foo")
 
@@ -220,3 +233,13 @@ class TestGetSocketPath(object):
             assert get_socket_path().is_tcp
         finally:
             scout_config.reset_all()
+
+    def test_shm(self):
+        scout_config.set(core_agent_socket_path="shm:///dev/shm/scout_apm")
+        try:
+            socket_path = get_socket_path()
+            assert socket_path.is_shm
+            assert not socket_path.is_tcp
+            assert socket_path.shm_path == "/dev/shm/scout_apm"
+        finally:
+            scout_config.reset_all()
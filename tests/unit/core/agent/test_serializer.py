@@ -0,0 +1,191 @@
+# coding=utf-8
+
+import datetime as dt
+import json
+import struct
+
+import pytest
+
+from scout_apm.core import json_backend
+from scout_apm.core.agent import commands
+from scout_apm.core.agent.serializer import Serializer
+from scout_apm.core.config import scout_config
+from scout_apm.core.tracked_request import TrackedRequest
+
+
+def unframe(view):
+    data = bytes(view)
+    view.release()
+    (size,) = struct.unpack(">I", data[:4])
+    assert size == len(data) - 4
+    return data[4:]
+
+
+def expected(command):
+    return json.dumps(command.message()).encode("utf-8")
+
+
+def make_tracked_request():
+    tracked_request = TrackedRequest()
+    tracked_request.tag("path", "/café/")
+    tracked_request.tag("count", 3)
+    with tracked_request.span(operation="Controller/parent"):
+        for index in range(3):
+            with tracked_request.span(
+                operation="SQL/Query", should_capture_backtrace=False
+            ) as span:
+                span.tag("db.statement", 'SELECT "x" FROM y WHERE z = %s')
+                span.tag("params", [index, None, 1.5, {"a": True}])
+    return tracked_request
+
+
+def test_frame_tracked_request():
+    tracked_request = make_tracked_request()
+    command = commands.BatchCommand.from_tracked_request(tracked_request)
+
+    assert unframe(Serializer().frame(command)) == expected(command)
+
+
+def test_frame_deferred_backtraces():
+    scout_config.set(deferred_backtraces=True)
+    try:
+        tracked_request = TrackedRequest()
+        with tracked_request.span(operation="Controller/parent"):
+            for _ in range(3):
+                with tracked_request.span(operation="SQL/Query") as span:
+                    span.capture_backtrace()
+    finally:
+        scout_config.reset_all()
+    command = commands.BatchCommand.from_tracked_request(tracked_request)
+
+    data = unframe(Serializer().frame(command))
+
+    assert data == expected(command)
+    message = json.loads(data)
+    stacks = [
+        item["TagSpan"]["value"]
+        for item in message["BatchCommand"]["commands"]
+        if "TagSpan" in item and item["TagSpan"]["tag"] == "stack"
+    ]
+    assert len(stacks) == 3
+    assert stacks[0][0]["function"] == "capture_deferred_backtrace"
+    assert stacks[0][-1] == stacks[1][-1]
+
+
+def test_frame_partial_batches():
+    tracked_request = make_tracked_request()
+    serializer = Serializer()
+
+    for start, finish in [(True, False), (False, False), (False, True)]:
+        command = commands.BatchCommand.from_tracked_request(
+            tracked_request, start=start, finish=finish
+        )
+        assert unframe(serializer.frame(command)) == expected(command)
+
+
+def test_frame_empty_batch():
+    tracked_request = TrackedRequest()
+    tracked_request.finish()
+    command = commands.BatchCommand.from_tracked_request(
+        tracked_request, start=False, finish=False
+    )
+
+    assert unframe(Serializer().frame(command)) == b'{"BatchCommand": {"commands": []}}'
+
+
+@pytest.mark.parametrize("microsecond", [0, 1, 999999])
+def test_frame_timestamps(microsecond):
+    tracked_request = TrackedRequest()
+    tracked_request.finish()
+    tracked_request.start_time = dt.datetime(
+        2018, 12, 1, 17, 4, 34, microsecond, tzinfo=dt.timezone.utc
+    )
+    command = commands.BatchCommand.from_tracked_request(tracked_request)
+
+    assert unframe(Serializer().frame(command)) == expected(command)
+
+
+def test_frame_other_commands():
+    command = commands.ApplicationEvent(
+        event_type="test",
+        event_value={"a": 1},
+        source="test",
+        timestamp=dt.datetime.now(dt.timezone.utc),
+    )
+
+    assert unframe(Serializer().frame(command)) == expected(command)
+
+
+def test_frame_non_serializable_tag():
+    tracked_request = TrackedRequest()
+    tracked_request.tag("bad", object())
+    tracked_request.finish()
+    command = commands.BatchCommand.from_tracked_request(tracked_request)
+    serializer = Serializer()
+
+    with pytest.raises(TypeError):
+        serializer.frame(command)
+    # The buffer is reusable after a failure
+    tracked_request.tags.clear()
+    command = commands.BatchCommand.from_tracked_request(tracked_request)
+    assert unframe(serializer.frame(command)) == expected(command)
+
+
+def test_caches_are_bounded():
+    class SmallSerializer(Serializer):
+        __slots__ = ()
+        MAX_CACHE_SIZE = 2
+
+    serializer = SmallSerializer()
+    for _ in range(3):
+        tracked_request = make_tracked_request()
+        command = commands.BatchCommand.from_tracked_request(tracked_request)
+        assert unframe(serializer.frame(command)) == expected(command)
+
+    assert len(serializer._strings) <= 2
+
+
+def test_frame_with_json_backend():
+    pytest.importorskip("orjson")
+    tracked_request = make_tracked_request()
+    command = commands.BatchCommand.from_tracked_request(tracked_request)
+    serializer = Serializer(dumps=json_backend.get_dumps("orjson"))
+
+    assert json.loads(unframe(serializer.frame(command))) == command.message()
+
+
+def test_batch_of_several_requests():
+    first = commands.BatchCommand.from_tracked_request(make_tracked_request())
+    second = commands.BatchCommand.from_tracked_request(make_tracked_request())
+    serializer = Serializer()
+
+    serializer.start_batch()
+    serializer.add_request(first.request)
+    serializer.add_request(second.request)
+    data = unframe(serializer.end_batch())
+
+    expected_commands = (
+        first.message()["BatchCommand"]["commands"]
+        + second.message()["BatchCommand"]["commands"]
+    )
+    assert data == json.dumps({"BatchCommand": {"commands": expected_commands}}).encode(
+        "utf-8"
+    )
+
+
+def test_batch_skips_request_that_fails():
+    good = commands.BatchCommand.from_tracked_request(make_tracked_request())
+    tracked_request = TrackedRequest()
+    tracked_request.tag("bad", object())
+    tracked_request.finish()
+    bad = commands.BatchCommand.from_tracked_request(tracked_request)
+    serializer = Serializer()
+
+    serializer.start_batch()
+    serializer.add_request(good.request)
+    size = serializer.size
+    with pytest.raises(TypeError):
+        serializer.add_request(bad.request)
+    assert serializer.size == size
+
+    assert unframe(serializer.end_batch()) == expected(good)
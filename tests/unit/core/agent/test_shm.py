@@ -0,0 +1,205 @@
+# coding=utf-8
+
+import datetime as dt
+import os
+import socket
+import struct
+import threading
+
+import pytest
+
+from scout_apm.core.agent.commands import ApplicationEvent
+from scout_apm.core.agent.manager import SocketPath
+from scout_apm.core.agent.shm import ShmRelay, ShmRing, ShmSocket, main, ring_path
+from scout_apm.core.agent.socket import CoreAgentSocketThread
+from scout_apm.core.config import scout_config
+from tests.compat import mock
+from tests.tools import FakeCoreAgent
+
+
+def frame(payload):
+    return struct.pack(">I", len(payload)) + payload
+
+
+@pytest.fixture
+def ring(tmp_path):
+    ring = ShmRing.create(str(tmp_path / "test.ring"), capacity=32)
+    try:
+        yield ring
+    finally:
+        ring.close()
+
+
+def test_write_and_read(ring):
+    assert ring.read() is None
+    assert ring.write(frame(b"one"))
+    assert ring.write(memoryview(bytearray(frame(b"two"))))
+
+    assert ring.pending() == 14
+    assert ring.read() == frame(b"one")
+    assert ring.read() == frame(b"two")
+    assert ring.read() is None
+    assert ring.pending() == 0
+
+
+def test_wraps_around(ring):
+    for number in range(10):
+        payload = b"%010d" % number
+        assert ring.write(frame(payload))
+        assert ring.read() == frame(payload)
+
+
+def test_write_times_out_when_full(ring):
+    assert ring.write(frame(b"x" * 24))
+
+    assert not ring.write(frame(b"y"), timeout=0.01)
+    assert ring.read() == frame(b"x" * 24)
+    assert ring.write(frame(b"y"), timeout=0.01)
+
+
+def test_write_too_large(ring):
+    with pytest.raises(ValueError):
+        ring.write(frame(b"x" * 29))
+
+
+def test_consumer_sees_producer_writes(ring):
+    consumer = ShmRing(ring.path)
+    try:
+        ring.write(frame(b"one"))
+        assert consumer.read() == frame(b"one")
+        assert consumer.pid == os.getpid()
+        # The producer sees the room freed.
+        assert ring.pending() == 0
+    finally:
+        consumer.close()
+
+
+def test_create_keeps_unread_frames(ring):
+    ring.write(frame(b"one"))
+
+    reopened = ShmRing.create(ring.path, capacity=32)
+    try:
+        assert reopened.read() == frame(b"one")
+    finally:
+        reopened.close()
+
+
+def test_create_replaces_other_capacity(ring):
+    ring.write(frame(b"one"))
+
+    replaced = ShmRing.create(ring.path, capacity=64)
+    try:
+        assert replaced.capacity == 64
+        assert replaced.read() is None
+    finally:
+        replaced.close()
+
+
+def test_open_invalid(tmp_path):
+    path = tmp_path / "bad.ring"
+    path.write_bytes(b"\x00" * 256)
+
+    with pytest.raises(ValueError):
+        ShmRing(str(path))
+
+
+def test_socket(tmp_path):
+    shm_socket = ShmSocket(capacity=32)
+    with pytest.raises(OSError):
+        shm_socket.sendall(frame(b"one"))
+
+    shm_socket.connect(str(tmp_path / "rings"))
+    shm_socket.settimeout(0.01)
+    shm_socket.sendall(frame(b"one"))
+    with pytest.raises(OSError):
+        shm_socket.sendall(frame(b"x" * 40))
+    with pytest.raises(socket.timeout):
+        shm_socket.sendall(frame(b"x" * 24))
+    shm_socket.shutdown(socket.SHUT_RDWR)
+    shm_socket.close()
+
+    ring = ShmRing(ring_path(str(tmp_path / "rings")))
+    try:
+        assert ring.read() == frame(b"one")
+    finally:
+        ring.close()
+
+
+def test_relay_removes_rings_of_exited_processes(tmp_path):
+    ring = ShmRing.create(ring_path(str(tmp_path)), capacity=32)
+    ring.close()
+    relay = ShmRelay(str(tmp_path), SocketPath("tcp://127.0.0.1:1"))
+
+    with mock.patch("os.kill", side_effect=ProcessLookupError):
+        assert relay.drain() == 0
+
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_relay_registers_again_after_reconnecting(tmp_path):
+    ring = ShmRing.create(ring_path(str(tmp_path)), capacity=1024)
+    with FakeCoreAgent() as agent:
+        relay = ShmRelay(str(tmp_path), SocketPath(agent.socket_path))
+        try:
+            assert ring.write(frame(b'{"Register":{"app":"test"}}'))
+            assert ring.write(frame(b'{"ApplicationEvent":{"event_value":0}}'))
+            assert relay.drain() == 2
+            agent.wait_for_messages(2)
+
+            agent.drop_connections()
+            for value in (1, 2):
+                payload = '{"ApplicationEvent":{"event_value":%d}}' % value
+                assert ring.write(frame(payload.encode("utf-8")))
+            # The frame sent as the connection drops is lost.
+            assert relay.drain() == 1
+            messages = agent.wait_for_messages(4)
+        finally:
+            relay.close()
+            ring.close()
+
+    assert messages == [
+        {"Register": {"app": "test"}},
+        {"ApplicationEvent": {"event_value": 0}},
+        {"Register": {"app": "test"}},
+        {"ApplicationEvent": {"event_value": 2}},
+    ]
+    assert agent.connections == 2
+
+
+def test_send_over_shm(tmp_path):
+    directory = str(tmp_path / "rings")
+    stop_event = threading.Event()
+    with FakeCoreAgent() as agent:
+        relay = ShmRelay(directory, SocketPath(agent.socket_path))
+        relay_thread = threading.Thread(target=relay.run, args=(stop_event,))
+        relay_thread.start()
+        scout_config.set(
+            core_agent_socket_path="shm://" + directory, core_agent_pipeline_depth=8
+        )
+        try:
+            for value in range(3):
+                CoreAgentSocketThread.send(
+                    ApplicationEvent(
+                        event_type="test",
+                        event_value=value,
+                        source="test",
+                        timestamp=dt.datetime.now(dt.timezone.utc),
+                    )
+                )
+            messages = agent.wait_for_messages(4)
+        finally:
+            CoreAgentSocketThread.ensure_stopped()
+            stop_event.set()
+            relay_thread.join()
+            relay.close()
+            scout_config.reset_all()
+
+    assert "Register" in messages[0]
+    assert [m["ApplicationEvent"]["event_value"] for m in messages[1:]] == [0, 1, 2]
+    assert agent.connections == 1
+    assert relay.forwarded == 4
+
+
+def test_main(tmp_path):
+    with mock.patch.object(ShmRelay, "run", side_effect=KeyboardInterrupt):
+        main([str(tmp_path), "tcp://127.0.0.1:1"])
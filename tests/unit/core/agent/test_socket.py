@@ -0,0 +1,356 @@
+# coding=utf-8
+
+import datetime as dt
+import logging
+import time
+
+import pytest
+
+from scout_apm.core.agent import socket as socket_module
+from scout_apm.core.agent.commands import ApplicationEvent, BatchCommand
+from scout_apm.core.agent.socket import CoreAgentSocketThread
+from scout_apm.core.config import scout_config
+from scout_apm.core.samplers.thread import SamplersThread
+from scout_apm.core.tracked_request import TrackedRequest
+from tests.tools import FakeCoreAgent
+
+
+@pytest.fixture
+def core_agent():
+    with FakeCoreAgent() as agent:
+        scout_config.set(
+            core_agent_socket_path=agent.socket_path,
+            key="abcdefghijklmnopqrst",
+            name="Test App",
+        )
+        # Stop any thread started by samplers with the previous settings.
+        CoreAgentSocketThread.ensure_stopped()
+        try:
+            yield agent
+        finally:
+            SamplersThread.ensure_stopped()
+            CoreAgentSocketThread.ensure_stopped()
+            scout_config.reset_all()
+
+
+def finished_request():
+    tracked_request = TrackedRequest()
+    tracked_request.is_real_request = True
+    tracked_request.tag("path", "/")
+    with tracked_request.span(operation="Controller/home"):
+        pass
+    return tracked_request
+
+
+def wait_for_batch(agent):
+    """
+    Return the first BatchCommand received. The samplers thread, started by
+    finishing a request, may send events around it.
+    """
+    messages = agent.wait_for_messages(1, name="BatchCommand")
+    return next(message for message in messages if "BatchCommand" in message)
+
+
+def test_register_and_send(core_agent):
+    CoreAgentSocketThread.send(
+        ApplicationEvent(
+            event_type="test",
+            event_value=1,
+            source="test",
+            timestamp=dt.datetime.now(dt.timezone.utc),
+        )
+    )
+
+    register, event = core_agent.wait_for_messages(2)
+    assert register["Register"]["app"] == "Test App"
+    assert register["Register"]["key"] == "abcdefghijklmnopqrst"
+    assert event["ApplicationEvent"]["event_type"] == "test"
+
+
+def test_send_request(core_agent):
+    tracked_request = finished_request()
+
+    batch = wait_for_batch(core_agent)
+    commands = batch["BatchCommand"]["commands"]
+    # Allocation TagSpans depend on the objtrace extension
+    assert [list(c)[0] for c in commands if "TagSpan" not in c] == [
+        "StartRequest",
+        "TagRequest",
+        "TagRequest",
+        "StartSpan",
+        "StopSpan",
+        "FinishRequest",
+    ]
+    assert {command["request_id"] for c in commands for command in c.values()} == {
+        tracked_request.request_id
+    }
+
+
+def test_send_request_without_changes_after_finish(core_agent):
+    tracked_request = finished_request()
+    tracked_request.tag("late", True)
+    with tracked_request.span(operation="Late/span"):
+        pass
+
+    batch = wait_for_batch(core_agent)
+    commands = batch["BatchCommand"]["commands"]
+    assert tracked_request.tags["late"] is True
+    assert len(tracked_request.complete_spans) == 2
+    assert [c["TagRequest"]["tag"] for c in commands if "TagRequest" in c] == [
+        "path",
+        "mem_delta",
+    ]
+    assert [c["StartSpan"]["operation"] for c in commands if "StartSpan" in c] == [
+        "Controller/home"
+    ]
+
+
+def test_send_request_logged_payload(core_agent, caplog):
+    scout_config.set(log_payload_content=True)
+    tracked_request = finished_request()
+    wait_for_batch(core_agent)
+    CoreAgentSocketThread.ensure_stopped()
+
+    payloads = [
+        message
+        for name, level, message in caplog.record_tuples
+        if name == "scout_apm.core.agent.socket"
+        and level == logging.DEBUG
+        and message.startswith(
+            "Sending request: {}. Payload: ".format(tracked_request.request_id)
+        )
+    ]
+    assert len(payloads) == 1
+    assert payloads[0].count("'StartRequest'") == 1
+    assert payloads[0].count("'TagRequest'") == 2
+    assert payloads[0].count("'StartSpan'") == 1
+    assert payloads[0].count("'FinishRequest'") == 1
+
+
+def application_event(value):
+    return ApplicationEvent(
+        event_type="test",
+        event_value=value,
+        source="test",
+        timestamp=dt.datetime.now(dt.timezone.utc),
+    )
+
+
+def test_pipelined_send(core_agent):
+    scout_config.set(core_agent_pipeline_depth=8)
+    for value in range(50):
+        CoreAgentSocketThread.send(application_event(value))
+
+    messages = core_agent.wait_for_messages(51)
+    assert CoreAgentSocketThread.wait_until_drained()
+    assert [m["ApplicationEvent"]["event_value"] for m in messages[1:]] == list(
+        range(50)
+    )
+    assert core_agent.connections == 1
+    reader = CoreAgentSocketThread._instance.reader
+    assert reader.sent == 51
+    for _ in range(100):
+        if reader.in_flight == 0:
+            break
+        time.sleep(0.01)
+    assert reader.received == 51
+
+
+def test_pipelined_send_waits_for_responses(core_agent, monkeypatch):
+    monkeypatch.setattr(socket_module, "SECOND", 1)
+    scout_config.set(core_agent_pipeline_depth=2)
+    core_agent.respond.clear()
+    for value in range(3):
+        CoreAgentSocketThread.send(application_event(value))
+
+    time.sleep(0.2)
+    # The register command and the first event fill the window.
+    assert len(core_agent.messages) == 2
+    reader = CoreAgentSocketThread._instance.reader
+    assert reader.in_flight == 2
+    assert reader.full_waits == 1
+    assert CoreAgentSocketThread.pipeline_stats() == {"in_flight": 2, "full_waits": 1}
+    assert CoreAgentSocketThread.pipeline_stats() == {"in_flight": 2, "full_waits": 0}
+
+    core_agent.respond.set()
+    assert len(core_agent.wait_for_messages(4)) == 4
+    assert core_agent.connections == 1
+
+
+def test_pipelined_send_reconnects_without_responses(core_agent):
+    scout_config.set(core_agent_pipeline_depth=1)
+    core_agent.respond.clear()
+    CoreAgentSocketThread.send(application_event(0))
+
+    # The register command takes the only slot, and the event gives up
+    # waiting for it after a (shortened) timeout.
+    messages = core_agent.wait_for_messages(2)
+    assert "Register" in messages[1]
+    assert core_agent.connections == 2
+
+
+def queue_request_batch():
+    tracked_request = TrackedRequest()
+    tracked_request.finish()
+    command = BatchCommand.from_tracked_request(tracked_request)
+    CoreAgentSocketThread._command_queue.put(command, False)
+    return tracked_request.request_id
+
+
+def batch_request_ids(message):
+    return [
+        command["StartRequest"]["request_id"]
+        for command in message["BatchCommand"]["commands"]
+        if "StartRequest" in command
+    ]
+
+
+def test_batched_requests(core_agent):
+    scout_config.set(core_agent_batch_max_requests=3)
+    request_ids = [queue_request_batch() for _ in range(4)]
+    CoreAgentSocketThread._command_queue.put(application_event(1), False)
+    last_request_id = queue_request_batch()
+    CoreAgentSocketThread.ensure_started()
+
+    messages = core_agent.wait_for_messages(5)
+    assert CoreAgentSocketThread.wait_until_drained()
+    assert len(messages) == 5
+    assert batch_request_ids(messages[1]) == request_ids[:3]
+    assert batch_request_ids(messages[2]) == request_ids[3:]
+    assert messages[3]["ApplicationEvent"]["event_value"] == 1
+    assert batch_request_ids(messages[4]) == [last_request_id]
+
+
+def test_batched_requests_max_bytes(core_agent):
+    scout_config.set(core_agent_batch_max_requests=10, core_agent_batch_max_bytes=1)
+    request_ids = [queue_request_batch() for _ in range(2)]
+    CoreAgentSocketThread.ensure_started()
+
+    messages = core_agent.wait_for_messages(3)
+    assert [batch_request_ids(message) for message in messages[1:]] == [
+        [request_id] for request_id in request_ids
+    ]
+
+
+def test_batched_requests_skip_unserializable(core_agent):
+    scout_config.set(core_agent_batch_max_requests=10)
+    first_request_id = queue_request_batch()
+    tracked_request = TrackedRequest()
+    tracked_request.tag("bad", object())
+    tracked_request.finish()
+    CoreAgentSocketThread._command_queue.put(
+        BatchCommand.from_tracked_request(tracked_request), False
+    )
+    last_request_id = queue_request_batch()
+    CoreAgentSocketThread.ensure_started()
+
+    messages = core_agent.wait_for_messages(2)
+    assert CoreAgentSocketThread.wait_until_drained()
+    assert batch_request_ids(messages[1]) == [first_request_id, last_request_id]
+    assert core_agent.connections == 1
+
+
+def test_queue_configured_from_settings(core_agent):
+    scout_config.set(
+        core_agent_queue_size=10,
+        core_agent_queue_bytes=1000,
+        core_agent_queue_overflow="drop_oldest",
+    )
+    command_queue = CoreAgentSocketThread._command_queue
+    try:
+        CoreAgentSocketThread.send(application_event(1))
+        core_agent.wait_for_messages(2)
+
+        assert command_queue.maxsize == 10
+        assert command_queue.max_bytes == 1000
+        assert command_queue.overflow == "drop_oldest"
+    finally:
+        command_queue.configure(maxsize=500, max_bytes=0, overflow="drop_newest")
+
+
+def test_spool_while_core_agent_unreachable(core_agent, tmp_path):
+    port = core_agent.port
+    core_agent.__exit__(None, None, None)
+    scout_config.set(core_agent_spool_dir=str(tmp_path))
+    for value in range(3):
+        CoreAgentSocketThread.send(application_event(value))
+
+    assert CoreAgentSocketThread.wait_until_drained()
+    spool = CoreAgentSocketThread._instance.spool
+    for _ in range(100):
+        if spool.spooled == 3:
+            break
+        time.sleep(0.01)
+    assert spool.spooled == 3
+
+    with FakeCoreAgent(port=port) as agent:
+        messages = agent.wait_for_messages(4)
+
+        assert "Register" in messages[0]
+        assert [m["ApplicationEvent"]["event_value"] for m in messages[1:]] == [
+            0,
+            1,
+            2,
+        ]
+        assert spool.replayed == 3
+        assert len(spool) == 0
+
+        CoreAgentSocketThread.send(application_event(3))
+        messages = agent.wait_for_messages(5)
+        assert messages[4]["ApplicationEvent"]["event_value"] == 3
+        CoreAgentSocketThread.ensure_stopped()
+
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_no_spool_by_default(core_agent):
+    CoreAgentSocketThread.send(application_event(1))
+    core_agent.wait_for_messages(2)
+
+    assert CoreAgentSocketThread._instance.spool is None
+
+
+def wait_for_thread_to_stop():
+    for _ in range(500):
+        instance = CoreAgentSocketThread._instance
+        if instance is None or not instance.is_alive():
+            return
+        time.sleep(0.01)
+    raise AssertionError("CoreAgentSocketThread still running")
+
+
+def test_circuit_opens_while_core_agent_unreachable(core_agent, monkeypatch):
+    port = core_agent.port
+    core_agent.__exit__(None, None, None)
+    circuit = CoreAgentSocketThread._circuit
+    # Stay open for 50 to 100 (shortened) seconds.
+    monkeypatch.setattr(circuit.backoff, "base", 100)
+    CoreAgentSocketThread.send(application_event(0))
+
+    wait_for_thread_to_stop()
+    assert circuit.state == circuit.OPEN
+    assert CoreAgentSocketThread.is_circuit_open()
+
+    CoreAgentSocketThread.send(application_event(1))
+    # Only the first event, which the thread never got to
+    assert CoreAgentSocketThread._command_queue.qsize() == 1
+    assert not CoreAgentSocketThread._instance.is_alive()
+
+    with FakeCoreAgent(port=port) as agent:
+        # Half open, as if the delay had passed
+        circuit.record_failure(scale=0)
+        CoreAgentSocketThread.send(application_event(2))
+
+        messages = agent.wait_for_messages(3)
+        assert [m["ApplicationEvent"]["event_value"] for m in messages[1:]] == [0, 2]
+        assert circuit.state == circuit.CLOSED
+
+
+def test_finish_skipped_while_circuit_open(core_agent, monkeypatch):
+    monkeypatch.setattr(CoreAgentSocketThread._circuit.backoff, "base", 100)
+    CoreAgentSocketThread._circuit.record_failure(scale=socket_module.SECOND)
+
+    tracked_request = finished_request()
+
+    assert not tracked_request.sent
+    assert CoreAgentSocketThread._command_queue.qsize() == 0
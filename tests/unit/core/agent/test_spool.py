@@ -0,0 +1,128 @@
+# coding=utf-8
+
+import os
+import struct
+
+import pytest
+
+from scout_apm.core.agent.spool import Spool, spool_path
+from tests.compat import mock
+
+
+def frame(payload):
+    return struct.pack(">I", len(payload)) + payload
+
+
+def pop_all(spool):
+    frames = []
+    while True:
+        popped = spool.pop()
+        if popped is None:
+            return frames
+        frames.append(popped)
+
+
+@pytest.fixture
+def spool(tmp_path):
+    spool = Spool(str(tmp_path / "test.spool"), capacity=100, max_age=60.0)
+    try:
+        yield spool
+    finally:
+        spool.close()
+
+
+def test_append_and_pop(spool):
+    assert spool.append(frame(b"one"))
+    assert spool.append(memoryview(bytearray(frame(b"two"))))
+
+    assert len(spool) == 2
+    assert pop_all(spool) == [frame(b"one"), frame(b"two")]
+    assert len(spool) == 0
+    assert spool.spooled == 2
+    assert spool.replayed == 2
+
+
+def test_wraps_around(spool):
+    # Each record takes 8 + 4 + 18 = 30 bytes, so three fit.
+    payloads = [b"%018d" % number for number in range(5)]
+    for payload in payloads[:3]:
+        spool.append(frame(payload))
+    assert spool.pop() == frame(payloads[0])
+
+    # Written at the start of the file, in the room freed by the pop.
+    spool.append(frame(payloads[3]))
+    # Overwrites the oldest record.
+    spool.append(frame(payloads[4]))
+
+    assert spool.dropped == 1
+    assert pop_all(spool) == [frame(payload) for payload in payloads[2:]]
+    assert spool.append(frame(payloads[0]))
+    assert pop_all(spool) == [frame(payloads[0])]
+
+
+def test_drops_oldest_when_full(spool):
+    payloads = [b"%018d" % number for number in range(5)]
+    for payload in payloads:
+        assert spool.append(frame(payload))
+
+    assert spool.dropped == 2
+    assert pop_all(spool) == [frame(payload) for payload in payloads[2:]]
+
+
+def test_oversized_frame_rejected(spool):
+    spool.append(frame(b"small"))
+
+    assert not spool.append(frame(b"x" * 100))
+    assert spool.dropped == 1
+    assert pop_all(spool) == [frame(b"small")]
+
+
+def test_expired_frames_skipped(spool):
+    with mock.patch("time.monotonic", return_value=1000.0):
+        spool.append(frame(b"old"))
+    with mock.patch("time.monotonic", return_value=1050.0):
+        spool.append(frame(b"new"))
+
+    with mock.patch("time.monotonic", return_value=1070.0):
+        assert pop_all(spool) == [frame(b"new")]
+    assert spool.expired == 1
+
+
+def test_header(spool):
+    spool.append(frame(b"one"))
+
+    with open(spool.path, "rb") as spool_file:
+        header = spool_file.read(40)
+    assert struct.unpack(">4sIQQQQ", header) == (b"SCSP", 1, 0, 15, 0, 1)
+
+
+def test_close_removes_file(spool):
+    spool.close()
+
+    assert not os.path.exists(spool.path)
+    spool.close()
+
+
+def test_append_after_fork_ignored(spool):
+    with mock.patch("os.getpid", return_value=spool.pid + 1):
+        assert not spool.append(frame(b"one"))
+    assert len(spool) == 0
+
+
+def test_open(tmp_path):
+    directory = tmp_path / "spool"
+
+    spool = Spool.open(str(directory), capacity=100, max_age=60.0)
+    try:
+        assert spool.path == spool_path(str(directory))
+        assert spool.path.endswith("scout-apm-{}.spool".format(os.getpid()))
+    finally:
+        spool.close()
+
+
+def test_open_failure(tmp_path, caplog):
+    path = tmp_path / "file"
+    path.write_text("not a directory")
+
+    assert Spool.open(str(path), capacity=100, max_age=60.0) is None
+    assert caplog.records[0].message.startswith("Could not open core agent spool")
@@ -98,3 +98,12 @@ def test_run_undetermined_cpus(caplog):
     _, level, message = record_tuples[1]
     assert level == logging.DEBUG
     assert message.startswith("Process CPU: {}".format(result))
+
+
+def test_run_after_negative_last_cpu_times():
+    cpu = Cpu()
+    cpu.last_cpu_times = psutil.Process().cpu_times()._replace(user=1e12, system=1e12)
+
+    assert cpu.run() is None
+    # The baseline was reset, as after a fork, so the next run measures.
+    assert cpu.run() is not None
@@ -0,0 +1,47 @@
+# coding=utf-8
+
+import pytest
+
+from scout_apm.core.samplers.latency import (
+    Latency,
+    LatencyHistograms,
+    latency_histograms,
+)
+
+
+@pytest.fixture(autouse=True)
+def reset_histograms():
+    latency_histograms.take()
+    yield
+    latency_histograms.take()
+
+
+def test_run_idle():
+    assert Latency().run() is None
+
+
+def test_run():
+    latency_histograms.record("Controller/home", 1000)
+    latency_histograms.record("Controller/home", 3000)
+    latency_histograms.record("Job/mail", 10)
+
+    result = Latency().run()
+
+    assert result["Controller/home"]["count"] == 2
+    assert result["Controller/home"]["total_us"] == 4000
+    assert result["Controller/home"]["max_us"] == 3000
+    assert result["Controller/home"]["p50_us"] == 992
+    assert result["Controller/home"]["buckets"] == [[992, 1], [2944, 1]]
+    assert result["Job/mail"]["buckets"] == [[10, 1]]
+    assert Latency().run() is None
+
+
+def test_operations_bounded():
+    histograms = LatencyHistograms()
+    for number in range(LatencyHistograms.MAX_OPERATIONS + 10):
+        histograms.record("Controller/{}".format(number), 100)
+
+    taken = histograms.take()
+
+    assert len(taken) == LatencyHistograms.MAX_OPERATIONS + 1
+    assert taken[LatencyHistograms.OTHER_OPERATION].count == 10
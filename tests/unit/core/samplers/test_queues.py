@@ -0,0 +1,60 @@
+# coding=utf-8
+
+import pytest
+
+from scout_apm.core.agent.socket import CoreAgentSocketThread
+from scout_apm.core.error_service import ErrorServiceThread
+from scout_apm.core.samplers.queues import Queues
+
+
+@pytest.fixture(autouse=True)
+def reset_stats():
+    CoreAgentSocketThread._command_queue.stats()
+    ErrorServiceThread._queue.stats()
+    yield
+    CoreAgentSocketThread._command_queue.stats()
+    ErrorServiceThread._queue.stats()
+
+
+def test_run_idle():
+    assert Queues().run() is None
+
+
+def test_run():
+    CoreAgentSocketThread._command_queue.offer(None)
+
+    result = Queues().run()
+
+    assert result["core_agent"]["enqueued"] == 1
+    assert result["core_agent"]["size"] == 1
+    assert result["errors"] == {
+        "enqueued": 0,
+        "dropped": 0,
+        "sent": 0,
+        "size": 0,
+        "bytes": 0,
+    }
+
+
+def test_run_pipeline_stats(monkeypatch):
+    monkeypatch.setattr(
+        CoreAgentSocketThread,
+        "pipeline_stats",
+        lambda: {"in_flight": 8, "full_waits": 0},
+    )
+
+    result = Queues().run()
+
+    assert result["core_agent"]["in_flight"] == 8
+    assert result["core_agent"]["full_waits"] == 0
+    assert result["core_agent"]["enqueued"] == 0
+
+
+def test_run_pipeline_idle(monkeypatch):
+    monkeypatch.setattr(
+        CoreAgentSocketThread,
+        "pipeline_stats",
+        lambda: {"in_flight": 0, "full_waits": 0},
+    )
+
+    assert Queues().run() is None
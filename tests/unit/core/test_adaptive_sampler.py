@@ -0,0 +1,109 @@
+# coding=utf-8
+
+import pytest
+
+from scout_apm.core.adaptive_sampler import AdaptiveSampler, RateEstimator
+from scout_apm.core.config import ScoutConfig
+from scout_apm.core.sampler import Sampler
+from tests.compat import mock
+
+
+def end_window(estimator, seconds=1.0):
+    estimator._start -= seconds
+
+
+def test_probability_one_until_first_window_over():
+    estimator = RateEstimator(10)
+    for _ in range(100):
+        assert estimator.arrive() == 1.0
+    assert estimator.per_second is None
+
+
+def test_probability_meets_target():
+    estimator = RateEstimator(10)
+    for _ in range(99):
+        estimator.arrive()
+    end_window(estimator)
+
+    assert estimator.arrive() == pytest.approx(0.1, rel=0.01)
+    assert estimator.per_second == pytest.approx(100, rel=0.01)
+
+
+def test_probability_one_under_target():
+    estimator = RateEstimator(10)
+    for _ in range(4):
+        estimator.arrive()
+    end_window(estimator)
+
+    assert estimator.arrive() == 1.0
+
+
+def test_estimate_smoothed_across_windows():
+    estimator = RateEstimator(10)
+    for _ in range(99):
+        estimator.arrive()
+    end_window(estimator)
+    estimator.arrive()
+    for _ in range(299):
+        estimator.arrive()
+    end_window(estimator)
+    estimator.arrive()
+
+    assert estimator.per_second == pytest.approx(200, rel=0.01)
+    assert estimator.probability == pytest.approx(0.05, rel=0.01)
+
+
+def test_recalculation_skipped_while_locked():
+    estimator = RateEstimator(10)
+    for _ in range(99):
+        estimator.arrive()
+    end_window(estimator)
+    with estimator._lock:
+        assert estimator.arrive() == 1.0
+
+
+def test_per_operation():
+    sampler = AdaptiveSampler(10, per_operation=True)
+    for _ in range(99):
+        sampler.probability("Controller/busy")
+    end_window(sampler.estimators["Controller/busy"])
+
+    assert sampler.probability("Controller/busy") == pytest.approx(0.1, rel=0.01)
+    assert sampler.probability("Controller/quiet") == 1.0
+
+
+def test_per_operation_bounded():
+    sampler = AdaptiveSampler(10, per_operation=True)
+    for number in range(AdaptiveSampler.MAX_OPERATIONS + 10):
+        sampler.probability("Controller/{}".format(number))
+
+    assert len(sampler.estimators) == AdaptiveSampler.MAX_OPERATIONS
+    assert sampler.estimator._count == 10
+
+
+@pytest.fixture
+def config():
+    config = ScoutConfig()
+    ScoutConfig.set(sample_target_per_second=10, sample_endpoints={"health": 0})
+    yield config
+    ScoutConfig.reset_all()
+
+
+def test_sampler_lowers_rate(config):
+    sampler = Sampler(config)
+    estimator = sampler.adaptive_sampler.estimator
+    for _ in range(99):
+        sampler.sample("Controller/home", False)
+    end_window(estimator)
+
+    with mock.patch("random.random", return_value=0.05):
+        assert sampler.sample("Controller/home", False) == pytest.approx(0.1, rel=0.01)
+    with mock.patch("random.random", return_value=0.5):
+        assert sampler.sample("Controller/home", False) is None
+
+
+def test_sampler_keeps_lower_configured_rate(config):
+    sampler = Sampler(config)
+
+    assert not sampler.should_sample("Controller/health", False)
+    assert sampler.adaptive_sampler.estimator._count == 0
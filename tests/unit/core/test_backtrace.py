@@ -33,13 +33,10 @@ def test_capture_backtrace():
 
     assert stack[0]["file"] == "scout_apm/core/backtrace.py"
     assert stack[0]["full_path"].endswith("/scout_apm/core/backtrace.py")
-    assert stack[0]["function"] == "filter_frames"
-    assert stack[1]["file"] == "scout_apm/core/backtrace.py"
-    assert stack[1]["full_path"].endswith("/scout_apm/core/backtrace.py")
-    assert stack[1]["function"] == "capture_backtrace"
-    assert stack[2]["file"] == "tests/unit/core/test_backtrace.py"
-    assert stack[2]["full_path"].endswith("/tests/unit/core/test_backtrace.py")
-    assert stack[2]["function"] == "test_capture_backtrace"
+    assert stack[0]["function"] == "capture_backtrace"
+    assert stack[1]["file"] == "tests/unit/core/test_backtrace.py"
+    assert stack[1]["full_path"].endswith("/tests/unit/core/test_backtrace.py")
+    assert stack[1]["function"] == "test_capture_backtrace"
 
 
 def test_capture_backtrace_limit():
@@ -53,6 +50,95 @@ def test_capture_backtrace_limit():
     assert len(stack) == backtrace.LIMIT
 
 
+def library_function(callback):
+    """
+    Return a function calling callback, compiled as if from a library.
+    """
+    namespace = {"callback": callback, "__name__": "library"}
+    code = compile(
+        "def call():\n    return callback()\n",
+        os.path.join(backtrace.LIBRARY_PATHS[0], "library.py"),
+        "exec",
+    )
+    exec(code, namespace)
+    return namespace["call"]
+
+
+def test_capture_backtrace_skips_library_frames():
+    stack = library_function(backtrace.capture_backtrace)()
+
+    assert [frame["function"] for frame in stack[:2]] == [
+        "capture_backtrace",
+        "test_capture_backtrace_skips_library_frames",
+    ]
+
+
+def test_code_info_cached():
+    frame = get_tb().tb_frame
+    backtrace._code_info.clear()
+
+    info = backtrace.code_info(frame)
+
+    assert info == (False,) + backtrace.filepaths(frame)
+    assert backtrace._code_info[frame.f_code] is info
+    assert backtrace.code_info(frame) is info
+
+
+def test_code_info_cache_cleared_when_full(monkeypatch):
+    monkeypatch.setattr(backtrace, "CODE_INFO_CACHE_SIZE", 2)
+    backtrace._code_info.clear()
+
+    backtrace.capture_backtrace()
+
+    assert len(backtrace._code_info) <= 2
+
+
+def test_capture_deferred_backtrace():
+    deferred = backtrace.capture_deferred_backtrace()
+
+    assert all(isinstance(lineno, int) for _, lineno in deferred.frames)
+    stack = deferred.resolve()
+    assert stack[0]["file"].endswith("/scout_apm/core/backtrace.py")
+    assert stack[0]["function"] == "capture_deferred_backtrace"
+    assert stack[1]["file"].endswith("/tests/unit/core/test_backtrace.py")
+    assert stack[1]["function"] == "test_capture_deferred_backtrace"
+    assert (
+        stack[1]["line"] == test_capture_deferred_backtrace.__code__.co_firstlineno + 1
+    )
+
+
+def test_deferred_backtrace_skips_library_frames():
+    deferred = library_function(backtrace.capture_deferred_backtrace)()
+
+    assert [frame["function"] for frame in deferred.resolve()[:2]] == [
+        "capture_deferred_backtrace",
+        "test_deferred_backtrace_skips_library_frames",
+    ]
+
+
+def test_deferred_backtrace_limit():
+    def capture_recursive_bottom(limit):
+        if limit <= 1:
+            return backtrace.capture_deferred_backtrace()
+        else:
+            return capture_recursive_bottom(limit - 1)
+
+    deferred = capture_recursive_bottom(backtrace.LIMIT * 2)
+
+    assert len(deferred.frames) > backtrace.LIMIT * 2
+    assert len(deferred.resolve()) == backtrace.LIMIT
+
+
+def test_deferred_backtrace_resolve_shares_table():
+    deferreds = [backtrace.capture_deferred_backtrace() for _ in range(2)]
+    table = {}
+
+    first, second = [deferred.resolve(table) for deferred in deferreds]
+
+    assert first == second
+    assert all(a is b for a, b in zip(first, second))
+
+
 def test_filter_frames():
     """Verify the frames from the library paths are excluded."""
     paths = sysconfig.get_paths()
@@ -0,0 +1,33 @@
+# coding=utf-8
+
+import datetime as dt
+
+from scout_apm.core import clock
+
+
+def test_anchor():
+    before = dt.datetime.now(dt.timezone.utc)
+    wall, ns = clock.anchor()
+    after = dt.datetime.now(dt.timezone.utc)
+
+    assert before <= wall <= after
+    assert isinstance(ns, int)
+
+
+def test_ns_to_datetime():
+    clock_anchor = (dt.datetime(2020, 1, 1, tzinfo=dt.timezone.utc), 1000)
+
+    assert clock.ns_to_datetime(clock_anchor, 1000) == clock_anchor[0]
+    assert clock.ns_to_datetime(clock_anchor, 1000 + 1500000) == dt.datetime(
+        2020, 1, 1, 0, 0, 0, 1500, tzinfo=dt.timezone.utc
+    )
+
+
+def test_datetime_to_ns_round_trip():
+    clock_anchor = clock.anchor()
+    value = dt.datetime(2018, 12, 1, 17, 4, 34, 78797, tzinfo=dt.timezone.utc)
+
+    ns = clock.datetime_to_ns(clock_anchor, value)
+
+    assert ns < clock_anchor[1]
+    assert clock.ns_to_datetime(clock_anchor, ns) == value
@@ -0,0 +1,237 @@
+# coding=utf-8
+
+import logging
+import threading
+
+import pytest
+
+from scout_apm.compat import queue
+from scout_apm.core.command_queue import DROP_NEWEST, DROP_OLDEST, SAMPLE, CommandQueue
+from tests.compat import mock
+
+
+def drain(command_queue):
+    items = []
+    while True:
+        try:
+            items.append(command_queue.get_nowait())
+        except queue.Empty:
+            return items
+
+
+def test_offer_and_get():
+    command_queue = CommandQueue(maxsize=3, size_of=len)
+
+    assert command_queue.offer("a")
+    assert command_queue.offer("bb")
+    assert command_queue.qsize() == 2
+    assert command_queue.bytes == 3
+    assert drain(command_queue) == ["a", "bb"]
+    assert command_queue.bytes == 0
+
+
+def test_put_and_get():
+    command_queue = CommandQueue(maxsize=1, size_of=len)
+    command_queue.put("abc", False)
+
+    assert command_queue.bytes == 3
+    with pytest.raises(queue.Full):
+        command_queue.put("d", False)
+    assert command_queue.get() == "abc"
+    assert command_queue.bytes == 0
+
+
+def test_get_timeout():
+    command_queue = CommandQueue()
+
+    with pytest.raises(queue.Empty):
+        command_queue.get(timeout=0.01)
+    with pytest.raises(queue.Empty):
+        command_queue.get_nowait()
+
+
+def test_get_wakes_for_item_from_other_thread():
+    command_queue = CommandQueue()
+    # Leave the consumer waiting on an empty queue
+    with pytest.raises(queue.Empty):
+        command_queue.get_nowait()
+
+    thread = threading.Timer(0.01, command_queue.offer, args=("a",))
+    thread.start()
+    try:
+        assert command_queue.get(timeout=2.0) == "a"
+    finally:
+        thread.join()
+
+
+def test_many_producers():
+    command_queue = CommandQueue(maxsize=0, size_of=len)
+    received = []
+
+    def consume():
+        while True:
+            item = command_queue.get(timeout=2.0)
+            if item is None:
+                return
+            received.append(item)
+            command_queue.task_done()
+
+    def produce(name):
+        for _ in range(100):
+            command_queue.offer(name)
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    producers = [
+        threading.Thread(target=produce, args=("p{}".format(i),)) for i in range(32)
+    ]
+    for producer in producers:
+        producer.start()
+    for producer in producers:
+        producer.join()
+    command_queue.put(None)
+    consumer.join()
+
+    assert len(received) == 3200
+    assert command_queue.stats() == {
+        "enqueued": 3201,
+        "dropped": 0,
+        "sent": 3200,
+        "size": 0,
+        "bytes": 0,
+    }
+
+
+def test_drop_newest():
+    command_queue = CommandQueue(maxsize=2, overflow=DROP_NEWEST)
+
+    assert command_queue.offer(1)
+    assert command_queue.offer(2)
+    assert not command_queue.offer(3)
+    assert drain(command_queue) == [1, 2]
+    assert command_queue.stats()["dropped"] == 1
+
+
+def test_drop_oldest():
+    command_queue = CommandQueue(maxsize=2, overflow=DROP_OLDEST)
+
+    for item in range(5):
+        assert command_queue.offer(item)
+    assert drain(command_queue) == [3, 4]
+    assert command_queue.stats()["dropped"] == 3
+
+
+def test_sample():
+    command_queue = CommandQueue(maxsize=2, overflow=SAMPLE)
+    command_queue.offer(1)
+    command_queue.offer(2)
+
+    # Keep with probability 2 / 3, replacing the item at index 0
+    with mock.patch("random.random", return_value=0.6), mock.patch(
+        "random.randrange", return_value=0
+    ):
+        assert command_queue.offer(3)
+    # Keep with probability 2 / 4
+    with mock.patch("random.random", return_value=0.5):
+        assert not command_queue.offer(4)
+
+    assert drain(command_queue) == [2, 3]
+    assert command_queue.stats()["dropped"] == 2
+
+
+def test_sample_restarts_when_not_full():
+    command_queue = CommandQueue(maxsize=1, overflow=SAMPLE)
+    command_queue.offer(1)
+    with mock.patch("random.random", return_value=0.9):
+        assert not command_queue.offer(2)
+        assert not command_queue.offer(3)
+    drain(command_queue)
+    command_queue.offer(4)
+
+    with mock.patch("random.random", return_value=0.49):
+        assert command_queue.offer(5)
+    assert drain(command_queue) == [5]
+
+
+def test_max_bytes():
+    command_queue = CommandQueue(maxsize=0, max_bytes=5, size_of=len)
+
+    assert command_queue.offer("abc")
+    assert not command_queue.offer("abc")
+    assert command_queue.offer("ab")
+    assert command_queue.bytes == 5
+
+
+def test_max_bytes_drop_oldest():
+    command_queue = CommandQueue(
+        maxsize=0, max_bytes=5, overflow=DROP_OLDEST, size_of=len
+    )
+    command_queue.offer("a")
+    command_queue.offer("bb")
+    command_queue.offer("cc")
+
+    assert command_queue.offer("ddd")
+    assert drain(command_queue) == ["cc", "ddd"]
+
+
+def test_oversized_item_accepted_when_empty():
+    command_queue = CommandQueue(maxsize=0, max_bytes=5, size_of=len)
+
+    assert command_queue.offer("abcdefgh")
+    assert not command_queue.offer("a")
+
+
+def test_none_has_no_size():
+    command_queue = CommandQueue(size_of=len)
+    command_queue.put(None, False)
+
+    assert command_queue.bytes == 0
+
+
+def test_stats():
+    command_queue = CommandQueue(maxsize=2, size_of=len)
+    command_queue.offer("a")
+    command_queue.offer("b")
+    command_queue.offer("c")
+    command_queue.get()
+    command_queue.task_done()
+
+    assert command_queue.stats() == {
+        "enqueued": 2,
+        "dropped": 1,
+        "sent": 1,
+        "size": 1,
+        "bytes": 1,
+    }
+    assert command_queue.stats() == {
+        "enqueued": 0,
+        "dropped": 0,
+        "sent": 0,
+        "size": 1,
+        "bytes": 1,
+    }
+
+
+def test_configure():
+    command_queue = CommandQueue(maxsize=1)
+
+    command_queue.configure(maxsize=2, max_bytes=10, overflow=DROP_OLDEST)
+
+    assert command_queue.maxsize == 2
+    assert command_queue.max_bytes == 10
+    assert command_queue.overflow == DROP_OLDEST
+
+
+def test_configure_unknown_overflow(caplog):
+    command_queue = CommandQueue()
+
+    command_queue.configure(maxsize=1, max_bytes=0, overflow="drop_everything")
+
+    assert command_queue.overflow == DROP_NEWEST
+    assert caplog.record_tuples == [
+        (
+            "scout_apm.core.command_queue",
+            logging.WARNING,
+            "Unknown queue overflow policy 'drop_everything', using 'drop_newest'.",
+        )
+    ]
@@ -34,6 +34,20 @@ def test_unset_config_value_from_python():
     assert ScoutConfig().value("revision_sha") == ""  # from defaults
 
 
+def test_version_changes():
+    version = ScoutConfig.version
+    ScoutConfig.set(revision_sha="foobar")
+    assert ScoutConfig.version > version
+
+    version = ScoutConfig.version
+    ScoutConfig.unset("revision_sha")
+    assert ScoutConfig.version > version
+
+    version = ScoutConfig.version
+    ScoutConfig.reset_all()
+    assert ScoutConfig.version > version
+
+
 def test_override_triple(caplog):
     triple = "unknown-unknown-linux-musl"
     ScoutConfig.set(core_agent_triple=triple)
@@ -199,6 +213,27 @@ def test_float_conversion_from_python(original, converted):
         ScoutConfig.reset_all()
 
 
+def test_int_conversion_from_env():
+    config = ScoutConfig()
+    with mock.patch.dict(os.environ, {"SCOUT_SPAN_FLUSH_COUNT": "100"}):
+        value = config.value("span_flush_count")
+    assert isinstance(value, int)
+    assert value == 100
+
+
+@pytest.mark.parametrize(
+    "original, converted",
+    [("0", 0), ("250", 250), (10, 10), ("x", 0), (None, 0)],
+)
+def test_int_conversion_from_python(original, converted):
+    ScoutConfig.set(span_flush_count=original)
+    config = ScoutConfig()
+    try:
+        assert config.value("span_flush_count") == converted
+    finally:
+        ScoutConfig.reset_all()
+
+
 def test_list_conversion_from_env():
     config = ScoutConfig()
     with mock.patch.dict(os.environ, {"SCOUT_DISABLED_INSTRUMENTS": "pymongo, redis"}):
@@ -315,6 +350,25 @@ def test_endpoint_sampling_conversion_from_python(original, converted):
         ScoutConfig.reset_all()
 
 
+@pytest.mark.parametrize(
+    "original, converted",
+    [
+        ("/users:0.5, reports:2", {"users": 0.5, "reports": 2.0}),
+        ({"/users": "0.5", "reports": 2}, {"users": 0.5, "reports": 2.0}),
+        ("/users:0.5,bad", {"users": 0.5}),
+        ("", {}),
+        (object(), {}),
+    ],
+)
+def test_latency_thresholds_conversion_from_python(original, converted):
+    ScoutConfig.set(tail_sampling_thresholds=original)
+    config = ScoutConfig()
+    try:
+        assert config.value("tail_sampling_thresholds") == converted
+    finally:
+        ScoutConfig.reset_all()
+
+
 def test_job_sampling_conversion_from_env():
     config = ScoutConfig()
     with mock.patch.dict(os.environ, {"SCOUT_SAMPLE_JOBS": "job1:30,job2:70"}):
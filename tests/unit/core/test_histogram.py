@@ -0,0 +1,42 @@
+# coding=utf-8
+
+import pytest
+
+from scout_apm.core.histogram import Histogram, bucket_index, bucket_lower_bound
+
+
+@pytest.mark.parametrize("value", [0, 1, 31, 32, 33, 63, 64, 1000, 123456789])
+def test_bucket_bounds(value):
+    lower_bound = bucket_lower_bound(bucket_index(value))
+
+    assert lower_bound <= value
+    assert value - lower_bound <= value / 16
+    assert bucket_index(lower_bound) == bucket_index(value)
+
+
+def test_bucket_indexes_increase():
+    indexes = [bucket_index(value) for value in range(10000)]
+
+    assert indexes == sorted(indexes)
+    assert len(set(indexes)) < 200
+
+
+def test_record():
+    histogram = Histogram()
+    for value in [10, 10, 1000]:
+        histogram.record(value)
+
+    assert histogram.count == 3
+    assert histogram.total == 1020
+    assert histogram.max == 1000
+    assert histogram.buckets() == [[10, 2], [992, 1]]
+
+
+def test_percentile():
+    histogram = Histogram()
+    for value in range(1, 101):
+        histogram.record(value * 1000)
+
+    assert histogram.percentile(50) == pytest.approx(50000, rel=1 / 16)
+    assert histogram.percentile(99) == pytest.approx(99000, rel=1 / 16)
+    assert Histogram().percentile(50) == 0
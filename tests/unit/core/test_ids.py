@@ -0,0 +1,60 @@
+# coding=utf-8
+
+import os
+import re
+import uuid
+
+import pytest
+
+from scout_apm.core import ids
+
+UUID_REGEX = re.compile(
+    r"^[0-9a-f]{8}-[0-9a-f]{4}-4[0-9a-f]{3}-[89ab][0-9a-f]{3}-[0-9a-f]{12}$"
+)
+
+
+def test_new_request_id_format():
+    request_id = ids.new_request_id()
+
+    assert request_id.startswith("req-")
+    assert UUID_REGEX.match(request_id[len("req-") :])
+    assert uuid.UUID(request_id[len("req-") :]).version == 4
+
+
+def test_new_span_id_format():
+    span_id = ids.new_span_id()
+
+    assert span_id.startswith("span-")
+    assert UUID_REGEX.match(span_id[len("span-") :])
+
+
+def test_ids_are_unique():
+    generated = {ids.new_span_id() for _ in range(10000)}
+
+    assert len(generated) == 10000
+
+
+def test_reseed_changes_prefix():
+    before = ids.new_span_id()
+    ids._reseed()
+    after = ids.new_span_id()
+
+    assert before[:29] != after[:29]
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="Requires os.fork")
+def test_forked_child_gets_new_prefix():
+    parent_id = ids.new_span_id()
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover
+        os.close(read_fd)
+        os.write(write_fd, ids.new_span_id().encode("utf-8"))
+        os._exit(0)
+
+    os.close(write_fd)
+    child_id = os.read(read_fd, 100).decode("utf-8")
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+
+    assert child_id[:29] != parent_id[:29]
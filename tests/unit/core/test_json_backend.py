@@ -0,0 +1,119 @@
+# coding=utf-8
+
+import datetime as dt
+import json
+import logging
+import uuid
+from decimal import Decimal
+
+import pytest
+
+from scout_apm.core import json_backend
+
+BACKENDS = sorted(json_backend.BACKENDS)
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request):
+    if request.param != "json":
+        pytest.importorskip(request.param)
+    return request.param
+
+
+@pytest.fixture
+def dumps(backend):
+    return json_backend.get_dumps(backend)
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        {"BatchCommand": {"commands": [{"StartRequest": {"request_id": "req-1"}}]}},
+        {"str": "BØØM! /  ", "int": 1, "float": 1.5, "none": None},
+        {"nested": [[1, 2], (3, 4), {"a": [True, False]}]},
+        {1: "int key", None: "none key", False: "bool key"},
+        {"big": 2**70},
+    ],
+)
+def test_dumps_matches_stdlib(dumps, value):
+    assert json.loads(dumps(value)) == json.loads(json.dumps(value))
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        float("nan"),
+        {"duration": float("inf"), "ratio": [float("-inf"), float("nan")]},
+    ],
+)
+def test_dumps_non_finite_floats_like_stdlib(dumps, value):
+    assert dumps(value) == json.dumps(value).encode("utf-8")
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        {"datetime": dt.datetime(2020, 1, 1)},
+        {"date": dt.date(2020, 1, 1)},
+        {"bytes": b"abc"},
+        {"decimal": Decimal("1.5")},
+        {"uuid": uuid.UUID(int=1)},
+        {"object": object()},
+        [[{"nested": Decimal("1.5")}]],
+    ],
+)
+def test_dumps_rejects_what_stdlib_rejects(dumps, value):
+    with pytest.raises(TypeError):
+        dumps(value)
+
+
+def test_dumps_circular_like_stdlib(dumps):
+    value = []
+    value.append(value)
+
+    with pytest.raises(ValueError):
+        dumps(value)
+
+
+def test_get_dumps_json():
+    assert json_backend.get_dumps("json") is json_backend.stdlib_dumps
+
+
+def test_get_dumps_auto_falls_back_to_stdlib(monkeypatch):
+    monkeypatch.setattr(json_backend, "AUTO_BACKENDS", ())
+
+    assert json_backend.get_dumps("auto") is json_backend.stdlib_dumps
+    assert json_backend.get_dumps(None) is json_backend.stdlib_dumps
+
+
+def test_get_dumps_auto_orjson():
+    pytest.importorskip("orjson")
+
+    assert json_backend.get_dumps("auto")({"a": 1}) == b'{"a":1}'
+
+
+def test_get_dumps_unknown(caplog):
+    assert json_backend.get_dumps("simplejson") is json_backend.stdlib_dumps
+    assert caplog.record_tuples == [
+        (
+            "scout_apm.core.json_backend",
+            logging.WARNING,
+            "Unknown json_backend 'simplejson', using json.",
+        )
+    ]
+
+
+def test_get_dumps_not_installed(monkeypatch, caplog):
+    def missing():
+        raise ImportError("No module named 'orjson'")
+
+    monkeypatch.setitem(json_backend.BACKENDS, "orjson", missing)
+
+    assert json_backend.get_dumps("ORJSON") is json_backend.stdlib_dumps
+    assert caplog.record_tuples == [
+        (
+            "scout_apm.core.json_backend",
+            logging.WARNING,
+            "json_backend 'orjson' is not installed, using json.",
+        )
+    ]
@@ -5,7 +5,7 @@ from unittest import mock
 import pytest
 
 from scout_apm.core.config import ScoutConfig
-from scout_apm.core.sampler import Sampler
+from scout_apm.core.sampler import RATE_CACHE_SIZE, PrefixTrie, Sampler
 
 
 @pytest.fixture
@@ -168,3 +168,59 @@ def test_prefix_matching_precedence(config):
 
     # VIP users API should always be sampled
     assert sampler.should_sample("Controller/api/users/vip/list", False) is True
+
+
+def test_prefix_matching_precedence_regardless_of_order(config):
+    config.set(
+        sample_endpoints={
+            "api": 0,
+            "api/users": 0.50,
+            "api/users/vip": 1.0,
+        }
+    )
+    sampler = Sampler(config)
+
+    assert sampler.get_effective_sample_rate("Controller/api/status", False) == 0
+    assert sampler.get_effective_sample_rate("Controller/api/users/1", False) == 0.50
+    assert sampler.get_effective_sample_rate("Controller/api/users/vip", False) == 1.0
+
+
+def test_ignored_flag(sampler):
+    assert sampler.get_effective_sample_rate("Controller/unspecified", True) == 0
+    assert sampler.get_effective_sample_rate("Controller/unspecified", False) == 0.70
+    # A specific rate overrides the flag
+    assert sampler.get_effective_sample_rate("Controller/users", True) == 1.0
+
+
+def test_ignored_flag_without_ignore_patterns(config):
+    config.set(ignore_endpoints=[], ignore=[])
+    sampler = Sampler(config)
+
+    assert sampler.get_effective_sample_rate("Controller/unspecified", True) == 0.70
+
+
+def test_rates_cached(sampler):
+    sampler.get_effective_sample_rate("Controller/test/endpoint", False)
+    sampler.get_effective_sample_rate("Controller/test/endpoint", True)
+
+    info = sampler._rates.cache_info()
+    assert info.hits == 1
+    assert info.misses == 1
+
+
+def test_rates_cache_bounded(sampler):
+    for number in range(RATE_CACHE_SIZE + 10):
+        sampler.get_effective_sample_rate(
+            "Controller/unspecified/{}".format(number), False
+        )
+
+    assert sampler._rates.cache_info().currsize == RATE_CACHE_SIZE
+
+
+def test_prefix_trie_longest_prefix_value():
+    trie = PrefixTrie([("a", 1), ("abc", 2), ("", 0)])
+
+    assert trie.longest_prefix_value("xyz") == 0
+    assert trie.longest_prefix_value("ab") == 1
+    assert trie.longest_prefix_value("abcd") == 2
+    assert PrefixTrie().longest_prefix_value("abc", "default") == "default"
@@ -0,0 +1,113 @@
+# coding=utf-8
+
+import pytest
+
+from scout_apm.core.config import scout_config
+from scout_apm.core.span_store import SpanStore
+from scout_apm.core.tracked_request import Span, TrackedRequest
+
+
+@pytest.fixture
+def compact_tracked_request():
+    scout_config.set(compact_span_storage=True)
+    request = TrackedRequest()
+    try:
+        yield request
+    finally:
+        request.finish()
+        scout_config.reset_all()
+
+
+def test_tracked_request_uses_span_store(compact_tracked_request):
+    assert isinstance(compact_tracked_request.complete_spans, SpanStore)
+
+
+def test_tracked_request_uses_list_by_default(tracked_request):
+    assert isinstance(tracked_request.complete_spans, list)
+
+
+def test_append_and_read_back(compact_tracked_request):
+    with compact_tracked_request.span(operation="Controller/parent") as parent:
+        for _ in range(3):
+            with compact_tracked_request.span(operation="SQL/Query") as child:
+                child.tag("db.statement", "SELECT 1")
+
+    store = compact_tracked_request.complete_spans
+    assert len(store) == 4
+    assert repr(store) == "<SpanStore(spans=4, operations=2)>"
+
+    first = store[0]
+    assert first.operation == "SQL/Query"
+    assert first.parent == parent.span_id
+    assert first.tags["db.statement"] == "SELECT 1"
+    assert first.start_time <= first.end_time
+    assert first.duration() >= 0.0
+    assert repr(first).startswith("<StoredSpan(")
+
+    last = store[-1]
+    assert last.span_id == parent.span_id
+    assert last.parent is None
+    assert last.operation == "Controller/parent"
+    assert [span.operation for span in store] == ["SQL/Query"] * 3 + [
+        "Controller/parent"
+    ]
+
+
+def test_index_out_of_range():
+    store = SpanStore(clock_anchor=Span()._clock_anchor)
+
+    with pytest.raises(IndexError):
+        store[0]
+
+
+def test_allocation_tags_stored_in_columns():
+    span = Span(operation="child")
+    span.stop()
+    span.tag("foo", "bar")
+    span.tag("allocations", 10)
+    span.tag("start_allocations", 5)
+    span.tag("stop_allocations", 15)
+    store = SpanStore(span._clock_anchor)
+
+    store.append(span)
+
+    assert store._tags[0] == (("foo", "bar"),)
+    assert store[0].tags == {
+        "foo": "bar",
+        "allocations": 10,
+        "start_allocations": 5,
+        "stop_allocations": 15,
+    }
+
+
+def test_rows(compact_tracked_request):
+    with compact_tracked_request.span(operation="parent") as span:
+        span.tag("foo", "bar")
+
+    rows = list(compact_tracked_request.complete_spans.rows())
+
+    assert len(rows) == 1
+    span_id, parent, operation, start_ns, end_ns, tag_items = rows[0]
+    assert span_id == span.span_id
+    assert parent is None
+    assert operation == "parent"
+    assert start_ns == span._start_ns
+    assert end_ns == span._end_ns
+    assert ("foo", "bar") in tag_items
+
+
+def test_copy():
+    first = Span(operation="SQL/Query")
+    first.tag("db.statement", "SELECT 1")
+    first.stop()
+    store = SpanStore(clock_anchor=first._clock_anchor)
+    store.append(first)
+    copied = store.copy()
+    second = Span(operation="SQL/Other", parent=first.span_id)
+    second.stop()
+    copied.append(second)
+
+    assert [span.operation for span in store] == ["SQL/Query"]
+    assert [span.operation for span in copied] == ["SQL/Query", "SQL/Other"]
+    assert copied[0].tags == store[0].tags
+    assert copied[1].parent == first.span_id
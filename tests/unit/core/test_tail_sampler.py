@@ -0,0 +1,121 @@
+# coding=utf-8
+
+import pytest
+
+from scout_apm.core.config import ScoutConfig
+from scout_apm.core.sampler import Sampler
+from scout_apm.core.tail_sampler import RollingPercentile, TailSampler, TokenBucket
+from tests.compat import mock
+
+
+@pytest.fixture
+def config():
+    config = ScoutConfig()
+    ScoutConfig.set(
+        sample_rate=0.05,
+        tail_sampling=True,
+        tail_sampling_budget=0,
+        tail_sampling_thresholds={"slow": 1.0, "slow/but/ok": 5.0},
+    )
+    yield config
+    ScoutConfig.reset_all()
+
+
+def test_token_bucket():
+    bucket = TokenBucket(2)
+
+    assert bucket.take()
+    assert bucket.take()
+    assert not bucket.take()
+
+
+def test_token_bucket_refills():
+    bucket = TokenBucket(2)
+    bucket.tokens = 0.0
+    bucket.updated -= 1.0
+
+    assert bucket.take()
+    assert bucket.take()
+    assert not bucket.take()
+
+
+def test_rolling_percentile():
+    percentile = RollingPercentile(90)
+    for duration in range(RollingPercentile.RECALCULATE_EVERY - 1):
+        percentile.add(duration)
+    assert percentile.value is None
+
+    percentile.add(RollingPercentile.RECALCULATE_EVERY - 1)
+
+    assert percentile.value == 45
+
+
+def test_keeps_errors(config):
+    tail_sampler = TailSampler(config)
+
+    assert tail_sampler.should_keep("Controller/fast", 0.1, True)
+    assert not tail_sampler.should_keep("Controller/fast", 0.1, False)
+
+
+def test_keeps_over_threshold(config):
+    tail_sampler = TailSampler(config)
+
+    assert tail_sampler.should_keep("Controller/slow/page", 1.5, False)
+    assert not tail_sampler.should_keep("Controller/slow/page", 0.5, False)
+    # The longest matching threshold applies.
+    assert not tail_sampler.should_keep("Controller/slow/but/ok", 1.5, False)
+    assert tail_sampler.should_keep("Job/slow", 1.5, False)
+
+
+def test_keeps_over_percentile(config):
+    config.set(tail_sampling_percentile=90)
+    tail_sampler = TailSampler(config)
+    for _ in range(RollingPercentile.RECALCULATE_EVERY):
+        assert not tail_sampler.should_keep("Controller/fast", 0.1, False)
+
+    assert tail_sampler.should_keep("Controller/fast", 0.2, False)
+    assert not tail_sampler.should_keep("Controller/other", 0.2, False)
+
+
+def test_percentile_operations_bounded(config):
+    config.set(tail_sampling_percentile=90)
+    tail_sampler = TailSampler(config)
+    for number in range(TailSampler.MAX_OPERATIONS + 10):
+        tail_sampler.should_keep("Controller/{}".format(number), 0.1, False)
+
+    assert len(tail_sampler.percentiles) == TailSampler.MAX_OPERATIONS
+
+
+def test_budget(config):
+    config.set(tail_sampling_budget=2)
+    tail_sampler = TailSampler(config)
+
+    kept = [tail_sampler.should_keep("Controller/fast", 0.1, True) for _ in range(5)]
+
+    assert kept == [True, True, False, False, False]
+
+
+def test_sampler_keeps_errors(config):
+    sampler = Sampler(config)
+
+    with mock.patch("random.random", return_value=0.5):
+        assert sampler.should_sample("Controller/fast", False, 0.1, True)
+        assert not sampler.should_sample("Controller/fast", False, 0.1, False)
+        # Not once the request is known, as when flushing spans early
+        assert not sampler.should_sample("Controller/fast", False)
+
+
+def test_sampler_respects_zero_rate(config):
+    config.set(sample_endpoints={"health": 0})
+    sampler = Sampler(config)
+
+    assert not sampler.should_sample("Controller/health", False, 2.0, True)
+
+
+def test_sampler_without_tail_sampling(config):
+    config.set(tail_sampling=False)
+    sampler = Sampler(config)
+
+    assert sampler.tail_sampler is None
+    with mock.patch("random.random", return_value=0.5):
+        assert not sampler.should_sample("Controller/fast", False, 2.0, True)
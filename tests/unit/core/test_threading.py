@@ -1,10 +1,15 @@
 # coding=utf-8
 
+import os
 import threading
 
 import pytest
 
+from scout_apm.core.agent.socket import CoreAgentSocketThread
+from scout_apm.core.error_service import ErrorServiceThread
+from scout_apm.core.samplers.latency import latency_histograms
 from scout_apm.core.threading import SingletonThread
+from scout_apm.core.tracked_request import TrackedRequest
 
 
 class ExampleThread(SingletonThread):
@@ -86,3 +91,110 @@ def test_ensure_stopped_whilst_holding_lock():
         # Imitate another thread in the process of finishign stopping -
         # ensure_stopped should still return due to its early check
         ExampleThread.ensure_stopped()
+
+
+def check_reset_after_fork():
+    """
+    Run in a forked child: check the state the parent's threads were busy
+    with has been replaced, returning a list of problems.
+    """
+    problems = []
+    if ExampleThread._instance is not None:
+        problems.append("ExampleThread instance kept")
+    if not ExampleThread._instance_lock.acquire(timeout=1.0):
+        problems.append("ExampleThread lock held")
+    for name, command_queue in [
+        ("core agent", CoreAgentSocketThread._command_queue),
+        ("errors", ErrorServiceThread._queue),
+    ]:
+        if command_queue.qsize():
+            problems.append("{} queue not emptied".format(name))
+        if not command_queue._lock.acquire(timeout=1.0):
+            problems.append("{} queue lock held".format(name))
+            continue
+        command_queue._lock.release()
+        command_queue.put({})
+        if command_queue.get(timeout=1.0) != {}:
+            problems.append("{} queue unusable".format(name))
+    if TrackedRequest._sampler is not None:
+        problems.append("Sampler kept")
+    if TrackedRequest._settings is not None:
+        problems.append("Request settings kept")
+    if latency_histograms.histograms:
+        problems.append("Latency histograms kept")
+    return problems
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="Requires os.fork")
+@pytest.mark.filterwarnings("ignore:.*fork.*:DeprecationWarning")
+def test_fork_under_load():
+    TrackedRequest.get_sampler()
+    TrackedRequest.get_settings()
+    stop = threading.Event()
+
+    def restart():
+        while not stop.is_set():
+            ExampleThread.ensure_started()
+            ExampleThread.ensure_stopped()
+
+    def record():
+        while not stop.is_set():
+            latency_histograms.record("Controller/home", 1000)
+
+    def produce(command_queue):
+        while not stop.is_set():
+            command_queue.offer({})
+            try:
+                command_queue.get_nowait()
+            except Exception:
+                pass
+
+    threads = [
+        threading.Thread(target=restart),
+        threading.Thread(target=record),
+    ] + [
+        threading.Thread(target=produce, args=(command_queue,))
+        for command_queue in [
+            CoreAgentSocketThread._command_queue,
+            CoreAgentSocketThread._command_queue,
+            ErrorServiceThread._queue,
+        ]
+    ]
+    # Tracers, like coverage's, take locks of their own in the threads they
+    # trace, which the children could inherit held.
+    trace = threading.gettrace()
+    threading.settrace(None)
+    for thread in threads:
+        thread.start()
+    try:
+        for _ in range(10):
+            read_fd, write_fd = os.pipe()
+            pid = os.fork()
+            if pid == 0:  # pragma: no cover
+                os.close(read_fd)
+                try:
+                    message = "\n".join(check_reset_after_fork())
+                except Exception as exc:
+                    message = repr(exc)
+                os.write(write_fd, message.encode("utf-8"))
+                os._exit(0)
+
+            os.close(write_fd)
+            with os.fdopen(read_fd, "rb") as reader:
+                message = reader.read().decode("utf-8")
+            os.waitpid(pid, 0)
+
+            assert message == ""
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        for command_queue in [
+            CoreAgentSocketThread._command_queue,
+            ErrorServiceThread._queue,
+        ]:
+            while not command_queue.empty():
+                command_queue.get_nowait()
+            command_queue.stats()
+        latency_histograms.take()
+        threading.settrace(trace)
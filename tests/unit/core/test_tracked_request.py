@@ -5,9 +5,10 @@ import logging
 
 import pytest
 
-from scout_apm.core import objtrace
+from scout_apm.core import backtrace, objtrace
 from scout_apm.core.config import scout_config
-from scout_apm.core.tracked_request import TrackedRequest
+from scout_apm.core.samplers.latency import latency_histograms
+from scout_apm.core.tracked_request import NULL_SPAN, TrackedRequest
 from tests.compat import copy_context, mock
 from tests.tools import (
     skip_if_missing_context_vars,
@@ -36,6 +37,25 @@ def reset_config():
         TrackedRequest._sampler = None
 
 
+def test_settings_cached(reset_config):
+    settings = TrackedRequest.get_settings()
+
+    assert TrackedRequest.get_settings() is settings
+    assert settings.flush_span_count == 0
+    assert settings.aggregate_keep is None
+
+
+def test_settings_read_again_after_config_change(reset_config):
+    TrackedRequest.get_settings()
+    scout_config.set(span_flush_count=5, aggregate_spans=True)
+
+    settings = TrackedRequest.get_settings()
+
+    assert settings.flush_span_count == 5
+    assert settings.aggregate_keep == 5
+    assert TrackedRequest()._flush_span_count == 5
+
+
 def test_tracked_request_repr(tracked_request):
     assert repr(tracked_request).startswith("<TrackedRequest(")
 
@@ -154,6 +174,23 @@ def test_start_span_ignores_children(tracked_request):
     assert "parent" == tracked_request.complete_spans[0].operation
 
 
+def test_ignored_children_share_null_span(tracked_request):
+    with tracked_request.span(operation="parent", ignore_children=True):
+        with tracked_request.span(operation="child") as child:
+            assert child is NULL_SPAN
+            assert tracked_request.current_span() is NULL_SPAN
+            child.tag("foo", "bar")
+            child.operation = "renamed"
+            with tracked_request.span(operation="grandchild") as grandchild:
+                assert grandchild is NULL_SPAN
+            assert tracked_request.current_span() is NULL_SPAN
+
+    assert child.tags == {}
+    assert child.operation is None
+    assert child.duration() == 0.0
+    assert [span.operation for span in tracked_request.complete_spans] == ["parent"]
+
+
 @mock.patch("scout_apm.core.tracked_request.TrackedRequest.MAX_COMPLETE_SPANS", new=1)
 def test_start_span_at_max_ignores_span(caplog, tracked_request):
     tracked_request.start_span(operation="parent")
@@ -161,6 +198,7 @@ def test_start_span_at_max_ignores_span(caplog, tracked_request):
     tracked_request.stop_span()
     child2 = tracked_request.start_span(operation="child2")
 
+    assert child2 is NULL_SPAN
     assert child2.ignore
     assert child2.ignore_children
     assert caplog.record_tuples == [
@@ -172,6 +210,27 @@ def test_start_span_at_max_ignores_span(caplog, tracked_request):
     ]
 
 
+def test_span_times_share_request_clock_anchor(tracked_request):
+    span = tracked_request.start_span(operation="myoperation")
+    tracked_request.stop_span()
+
+    assert span._clock_anchor is tracked_request._clock_anchor
+    assert isinstance(span._start_ns, int)
+    assert isinstance(span._end_ns, int)
+    assert tracked_request.start_time <= span.start_time <= span.end_time
+    assert span.end_time <= tracked_request.end_time
+    assert span.duration() == (span._end_ns - span._start_ns) / 1e9
+
+
+def test_span_end_time_none_until_stopped(tracked_request):
+    span = tracked_request.start_span(operation="myoperation")
+    try:
+        assert span.end_time is None
+        assert span.duration() >= 0.0
+    finally:
+        tracked_request.stop_span()
+
+
 def test_span_captures_backtrace(tracked_request):
     span = tracked_request.start_span(operation="Sql/Work")
     # Pretend it was started 1 second ago
@@ -191,6 +250,18 @@ def test_should_capture_backtrace_default_true(tracked_request):
     assert all(set(i.keys()) == {"file", "line", "function"} for i in stack)
 
 
+def test_deferred_backtraces(tracked_request, reset_config):
+    scout_config.set(deferred_backtraces=True)
+    span = tracked_request.start_span(operation="Something")
+    span.start_time -= dt.timedelta(seconds=2)
+
+    tracked_request.stop_span()
+
+    stack = span.tags["stack"]
+    assert isinstance(stack, backtrace.DeferredBacktrace)
+    assert all(set(i.keys()) == {"file", "line", "function"} for i in stack.resolve())
+
+
 def test_should_capture_backtrace_false(tracked_request):
     span = tracked_request.start_span("Something", should_capture_backtrace=False)
     # Trigger 'slow' condition
@@ -255,42 +326,6 @@ def test_finish_log_request_info(tracked_request, caplog):
     ) in caplog.record_tuples
 
 
-def test_finish_log_request_info_with_logged_payload(
-    tracked_request, caplog, reset_config
-):
-    scout_config.set(log_payload_content=True)
-    tracked_request.is_real_request = True
-    tracked_request.start_span(operation="Something")
-    tracked_request.stop_span()
-
-    # Find the logged message.
-    actual_message = None
-    for module, level, message in caplog.record_tuples:
-        if module == "scout_apm.core.tracked_request" and level == logging.DEBUG:
-            if message.startswith(
-                "Sending request: {}. Payload: ".format(tracked_request.request_id)
-            ):
-                actual_message = message
-                break
-    assert actual_message
-    # Verify the counts of the spans and the request id.
-    assert actual_message.count("'StartRequest'") == 1
-    assert actual_message.count("'FinishRequest'") == 1
-    assert actual_message.count("'TagRequest'") == 1
-    assert actual_message.count("'StartSpan'") == 1
-    assert actual_message.count("'StopSpan'") == 1
-    if objtrace.is_extension:
-        assert actual_message.count("'TagSpan'") == 3
-        total_requests = 8
-    else:
-        assert actual_message.count("'TagSpan'") == 0
-        total_requests = 5
-    # Verify each request id in the payload is the tracked request's.
-    assert actual_message.count("'request_id'") == total_requests
-    # The actual request id is also included in the log message after Sending request:
-    assert actual_message.count(tracked_request.request_id) == total_requests + 1
-
-
 def test_finish_clears_context():
     tracked_request_1 = TrackedRequest.instance()
     tracked_request_1.is_real_request = True
@@ -368,6 +403,32 @@ def test_request_only_sent_once(tracked_request, caplog):
     )
 
 
+def test_changes_after_send_dont_touch_handed_over_data(tracked_request):
+    tracked_request.is_real_request = True
+    with mock.patch(
+        "scout_apm.core.tracked_request.CoreAgentSocketThread.send"
+    ) as mock_send:
+        with tracked_request.span(operation="Something"):
+            pass
+        (command,), _ = mock_send.call_args
+        snapshot = command.request
+
+        with pytest.raises(TypeError):
+            tracked_request.tags["direct"] = True
+        tracked_request.tag("late", True)
+        with tracked_request.span(operation="Late"):
+            pass
+
+    assert mock_send.call_count == 1
+    assert set(snapshot.tags) == {"mem_delta"}
+    assert [span.operation for span in snapshot.spans] == ["Something"]
+    assert set(tracked_request.tags) == {"mem_delta", "late"}
+    assert [span.operation for span in tracked_request.complete_spans] == [
+        "Something",
+        "Late",
+    ]
+
+
 def test_sampler_behavior(tracked_request):
     """Test that sampler is only created when first needed and shared across requests"""
     assert TrackedRequest._sampler is None
@@ -398,8 +459,8 @@ def test_sampler_behavior(tracked_request):
 )
 def test_finish_sampling_behavior(tracked_request, operation, is_real, expected_calls):
     """Test that sampling only occurs under the right conditions"""
-    mock_sampler = mock.Mock()
-    mock_sampler.should_sample.return_value = True
+    mock_sampler = mock.Mock(adaptive_sampler=None)
+    mock_sampler.sample.return_value = 1.0
     TrackedRequest._sampler = mock_sampler
 
     tracked_request.operation = operation
@@ -408,4 +469,348 @@ def test_finish_sampling_behavior(tracked_request, operation, is_real, expected_
 
     tracked_request.finish()
 
-    assert mock_sampler.should_sample.call_count == expected_calls
+    assert mock_sampler.sample.call_count == expected_calls
+
+
+@pytest.fixture
+def flush_every_two_spans(reset_config):
+    scout_config.set(span_flush_count=2)
+    with mock.patch(
+        "scout_apm.core.tracked_request.CoreAgentSocketThread.send"
+    ) as mock_send:
+        yield mock_send
+
+
+def sent_command_types(mock_send):
+    return [
+        [type(command).__name__ for command in call[0][0].commands]
+        for call in mock_send.call_args_list
+    ]
+
+
+def test_flush_spans_on_count(flush_every_two_spans):
+    tracked_request = TrackedRequest()
+    tracked_request.is_real_request = True
+    tracked_request.start_span(operation="Job/long")
+    for _ in range(5):
+        with tracked_request.span(
+            operation="SQL/Query", should_capture_backtrace=False
+        ):
+            pass
+        assert len(tracked_request.complete_spans) < 2
+    tracked_request.stop_span()
+
+    batches = sent_command_types(flush_every_two_spans)
+    assert len(batches) == 3
+    assert batches[0][0] == "StartRequest"
+    assert batches[0].count("StartSpan") == 2
+    assert "FinishRequest" not in batches[0]
+    assert "StartRequest" not in batches[1]
+    assert batches[1].count("StartSpan") == 2
+    assert "StartRequest" not in batches[2]
+    assert batches[2].count("StartSpan") == 2
+    assert "TagRequest" in batches[2]
+    assert batches[2][-1] == "FinishRequest"
+    assert tracked_request.sent
+
+
+def test_flush_spans_not_sampled(flush_every_two_spans):
+    scout_config.set(sample_rate=0)
+    tracked_request = TrackedRequest()
+    tracked_request.is_real_request = True
+    tracked_request.operation = "Job/long"
+    tracked_request.start_span(operation="Job/long")
+    for _ in range(5):
+        with tracked_request.span(
+            operation="SQL/Query", should_capture_backtrace=False
+        ):
+            pass
+    tracked_request.stop_span()
+
+    assert flush_every_two_spans.call_count == 0
+    assert not tracked_request.sent
+
+
+def test_flush_spans_skipped_for_unreal_requests(flush_every_two_spans):
+    tracked_request = TrackedRequest()
+    tracked_request.start_span(operation="Job/long")
+    for _ in range(3):
+        with tracked_request.span(
+            operation="SQL/Query", should_capture_backtrace=False
+        ):
+            pass
+    tracked_request.stop_span()
+
+    assert flush_every_two_spans.call_count == 0
+
+
+@pytest.fixture
+def head_sampling(reset_config):
+    scout_config.set(head_sampling=True, sample_rate=0)
+    with mock.patch(
+        "scout_apm.core.tracked_request.CoreAgentSocketThread.send"
+    ) as mock_send:
+        yield mock_send
+
+
+def start_head_sampled_request():
+    tracked_request = TrackedRequest()
+    tracked_request.is_real_request = True
+    tracked_request.operation = "Controller/home"
+    tracked_request.start_span(operation="Controller/home")
+    tracked_request.sample_head()
+    return tracked_request
+
+
+def test_sample_head_disabled_by_default(tracked_request):
+    tracked_request.operation = "Controller/home"
+    tracked_request.sample_head()
+
+    assert tracked_request._head_sampled is None
+
+
+def test_sample_head_not_sampled(head_sampling):
+    tracked_request = start_head_sampled_request()
+    span = tracked_request.start_span(operation="SQL/Query")
+    tracked_request.stop_span()
+    tracked_request.stop_span()
+
+    assert span is NULL_SPAN
+    assert len(tracked_request.complete_spans) == 1
+    assert head_sampling.call_count == 0
+    assert not tracked_request.sent
+
+
+def test_sample_head_sampled(head_sampling):
+    scout_config.set(sample_rate=1)
+    tracked_request = start_head_sampled_request()
+    with mock.patch.object(TrackedRequest, "get_sampler", side_effect=AssertionError):
+        # Not asked again in finish()
+        with tracked_request.span(operation="SQL/Query") as span:
+            pass
+        tracked_request.stop_span()
+
+    assert span is not NULL_SPAN
+    assert head_sampling.call_count == 1
+    assert tracked_request.sent
+
+
+def test_sample_head_error_keeps_request(head_sampling):
+    tracked_request = start_head_sampled_request()
+    skipped_span = tracked_request.start_span(operation="SQL/Query")
+    tracked_request.stop_span()
+    tracked_request.tag("error", "true")
+    with tracked_request.span(operation="Template/Render") as span:
+        pass
+    tracked_request.stop_span()
+
+    assert skipped_span is NULL_SPAN
+    assert span is not NULL_SPAN
+    assert head_sampling.call_count == 1
+    (command,), _ = head_sampling.call_args
+    operations = [
+        c.operation for c in command.commands if type(c).__name__ == "StartSpan"
+    ]
+    assert sorted(operations) == ["Controller/home", "Template/Render"]
+
+
+def test_tail_sampling_keeps_errors(reset_config):
+    scout_config.set(sample_rate=0.01, tail_sampling=True)
+    with mock.patch(
+        "scout_apm.core.tracked_request.CoreAgentSocketThread.send"
+    ) as mock_send, mock.patch("random.random", return_value=0.5):
+        for error in [False, True]:
+            tracked_request = TrackedRequest()
+            tracked_request.is_real_request = True
+            tracked_request.operation = "Controller/home"
+            with tracked_request.span(operation="Controller/home"):
+                if error:
+                    tracked_request.tag("error", "true")
+
+            assert tracked_request.sent is error
+
+    assert mock_send.call_count == 1
+
+
+def test_adaptive_sampling_tags_sample_rate(reset_config):
+    scout_config.set(sample_rate=0.5, sample_target_per_second=1000)
+    with mock.patch(
+        "scout_apm.core.tracked_request.CoreAgentSocketThread.send"
+    ), mock.patch("random.random", return_value=0.1):
+        tracked_request = TrackedRequest()
+        tracked_request.is_real_request = True
+        tracked_request.operation = "Controller/home"
+        with tracked_request.span(operation="Controller/home"):
+            pass
+
+    assert tracked_request.tags["scout.sample_rate"] == 0.5
+
+
+def test_sample_rate_not_tagged_without_adaptive_sampling(reset_config):
+    scout_config.set(sample_rate=0.5)
+    with mock.patch(
+        "scout_apm.core.tracked_request.CoreAgentSocketThread.send"
+    ), mock.patch("random.random", return_value=0.1):
+        tracked_request = TrackedRequest()
+        tracked_request.is_real_request = True
+        tracked_request.operation = "Controller/home"
+        with tracked_request.span(operation="Controller/home"):
+            pass
+
+    assert tracked_request.sent
+    assert "scout.sample_rate" not in tracked_request.tags
+
+
+def test_latency_histograms_record_unsampled_requests(reset_config):
+    scout_config.set(sample_rate=0, latency_histograms=True)
+    latency_histograms.take()
+    tracked_request = TrackedRequest()
+    tracked_request.is_real_request = True
+    tracked_request.operation = "Controller/home"
+    with tracked_request.span(operation="Controller/home"):
+        pass
+    tracked_request.finish()
+
+    histograms = latency_histograms.take()
+    assert not tracked_request.sent
+    assert list(histograms) == ["Controller/home"]
+    assert histograms["Controller/home"].count == 1
+
+
+def test_latency_histograms_disabled_by_default(tracked_request):
+    latency_histograms.take()
+    tracked_request.is_real_request = True
+    tracked_request.operation = "Controller/home"
+    tracked_request.finish()
+
+    assert latency_histograms.take() == {}
+
+
+def test_flush_spans_on_age(reset_config):
+    scout_config.set(span_flush_seconds=0.000001)
+    tracked_request = TrackedRequest()
+    tracked_request.is_real_request = True
+    tracked_request.start_span(operation="Job/long")
+    with mock.patch(
+        "scout_apm.core.tracked_request.CoreAgentSocketThread.send"
+    ) as mock_send:
+        with tracked_request.span(
+            operation="SQL/Query", should_capture_backtrace=False
+        ):
+            pass
+        assert mock_send.call_count == 1
+        assert len(tracked_request.complete_spans) == 0
+        tracked_request.stop_span()
+    assert mock_send.call_count == 2
+
+
+@pytest.fixture
+def aggregate_spans(reset_config):
+    scout_config.set(aggregate_spans=True, aggregate_spans_keep=3)
+    tracked_request = TrackedRequest()
+    try:
+        yield tracked_request
+    finally:
+        tracked_request.finish()
+
+
+def run_queries(tracked_request, statements):
+    for statement in statements:
+        with tracked_request.span(
+            operation="SQL/Query", should_capture_backtrace=False
+        ) as span:
+            span.tag("db.statement", statement)
+
+
+def test_aggregate_spans_disabled_by_default(tracked_request):
+    tracked_request.start_span(operation="Controller/parent")
+    run_queries(tracked_request, ["SELECT 1"] * 10)
+
+    assert len(tracked_request.complete_spans) == 10
+
+
+def test_aggregate_spans_folds_run(aggregate_spans):
+    tracked_request = aggregate_spans
+    with tracked_request.span(operation="Controller/parent") as parent:
+        run_queries(tracked_request, ["SELECT 1"] * 20)
+
+    spans = tracked_request.complete_spans
+    assert [span.operation for span in spans] == ["SQL/Query"] * 4 + [
+        "Controller/parent"
+    ]
+    kept, aggregate = spans[:3], spans[3]
+    assert all(span.parent == parent.span_id for span in spans[:4])
+    assert all("aggregate.count" not in span.tags for span in kept)
+    assert aggregate.tags["aggregate.count"] == 20
+    assert aggregate.tags["db.statement"] == "SELECT 1"
+    assert (
+        aggregate.tags["aggregate.min_duration"]
+        <= aggregate.tags["aggregate.max_duration"]
+        <= aggregate.tags["aggregate.total_duration"]
+    )
+    assert max(span.duration() for span in kept) == pytest.approx(
+        aggregate.tags["aggregate.max_duration"]
+    )
+
+
+def test_aggregate_spans_keeps_short_runs(aggregate_spans):
+    tracked_request = aggregate_spans
+    with tracked_request.span(operation="Controller/parent"):
+        run_queries(tracked_request, ["SELECT 1"] * 3)
+
+    spans = tracked_request.complete_spans
+    assert len(spans) == 4
+    assert all("aggregate.count" not in span.tags for span in spans)
+
+
+def test_aggregate_spans_breaks_run_on_different_statement(aggregate_spans):
+    tracked_request = aggregate_spans
+    with tracked_request.span(operation="Controller/parent"):
+        run_queries(tracked_request, ["SELECT 1"] * 5 + ["SELECT 2"] * 5)
+
+    spans = tracked_request.complete_spans
+    assert len(spans) == 9
+    assert [span.tags.get("aggregate.count") for span in spans] == [
+        None,
+        None,
+        None,
+        5,
+        None,
+        None,
+        None,
+        5,
+        None,
+    ]
+
+
+def test_aggregate_spans_keeps_spans_with_children(aggregate_spans):
+    tracked_request = aggregate_spans
+    with tracked_request.span(operation="Controller/parent"):
+        for _ in range(5):
+            with tracked_request.span(operation="Template/Render") as template:
+                run_queries(tracked_request, ["SELECT 1"])
+
+    spans = tracked_request.complete_spans
+    assert len(spans) == 11
+    templates = [span for span in spans if span.operation == "Template/Render"]
+    assert len(templates) == 5
+    children = [span for span in spans if span.operation == "SQL/Query"]
+    assert {span.parent for span in children} == {
+        template.span_id for template in templates
+    }
+    assert template in templates
+
+
+def test_aggregate_spans_keeps_backtraces(aggregate_spans):
+    tracked_request = aggregate_spans
+    with tracked_request.span(operation="Controller/parent"):
+        run_queries(tracked_request, ["SELECT 1"] * 10)
+        with tracked_request.span(operation="SQL/Query") as span:
+            span.tag("db.statement", "SELECT 1")
+            span.capture_backtrace()
+        run_queries(tracked_request, ["SELECT 1"] * 10)
+
+    spans = tracked_request.complete_spans
+    assert len(spans) == 5
+    assert sum(1 for span in spans if "stack" in span.tags) == 1
+    assert spans[3].tags["aggregate.count"] == 21